@@ -0,0 +1,88 @@
+# Throughput of the advanced API with 1, 2, 4, ... parallel callers.
+# The advanced queries are plain reads now, so throughput should grow with the number of callers
+# (while they used to DROP / CREATE views, concurrent callers queued up on the catalog locks).
+#
+# WARNING: recreates the tables of the database configured in Utility/database.ini
+# usage (from the repository root): python -m Benchmarks.concurrency_benchmark [seconds per run] [max callers]
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import Solution
+import Utility.DBConnector as Connector
+from Business.Apartment import Apartment
+from Business.Customer import Customer
+from Business.Owner import Owner
+
+OWNERS = 100
+APARTMENTS = 1000
+CUSTOMERS = 1000
+
+
+def _populate(rng: random.Random):
+    Solution.add_owners(Owner(i, "owner {}".format(i)) for i in range(1, OWNERS + 1))
+    Solution.add_customers(Customer(i, "customer {}".format(i)) for i in range(1, CUSTOMERS + 1))
+    Solution.add_apartments(Apartment(i, "street {}".format(i), "city {}".format(i % 20), "country {}".format(i % 3),
+                                      rng.randint(20, 200)) for i in range(1, APARTMENTS + 1))
+    for apartment_id in range(1, APARTMENTS + 1):
+        Solution.owner_owns_apartment(rng.randint(1, OWNERS), apartment_id)
+    for customer_id in range(1, CUSTOMERS + 1):
+        for apartment_id in rng.sample(range(1, APARTMENTS + 1), 5):
+            start_date = date(2020, 1, 1) + timedelta(days=rng.randint(0, 1000))
+            end_date = start_date + timedelta(days=rng.randint(1, 14))
+            if Solution.customer_made_reservation(customer_id, apartment_id, start_date, end_date,
+                                                  rng.randint(100, 5000)) == Solution.ReturnValue.OK:
+                Solution.customer_reviewed_apartment(customer_id, apartment_id, end_date, rng.randint(1, 10), "review")
+
+
+# calls 'function' from 'callers' threads for 'seconds', returns the number of calls per second
+def _throughput(function, callers: int, seconds: float) -> float:
+    calls = [0] * callers
+    stop = threading.Event()
+
+    def caller(number: int):
+        rng = random.Random(number)
+        while not stop.is_set():
+            function(rng)
+            calls[number] += 1
+
+    threads = [threading.Thread(target=caller, args=(number,)) for number in range(callers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(calls) / seconds
+
+
+def main(seconds: float = 5.0, max_callers: int = 16):
+    Connector.configure_pool(min_size=1, max_size=max_callers)
+    Solution.drop_tables()
+    Solution.create_tables()
+    try:
+        _populate(random.Random(0))
+        functions = {
+            "get_all_location_owners": lambda rng: Solution.get_all_location_owners(),
+            "best_value_for_money": lambda rng: Solution.best_value_for_money(),
+            "profit_per_month": lambda rng: Solution.profit_per_month(rng.randint(2020, 2023)),
+            "get_apartment_recommendation": lambda rng: Solution.get_apartment_recommendation(
+                rng.randint(1, CUSTOMERS)),
+        }
+        callers = [1]
+        while callers[-1] * 2 <= max_callers:
+            callers.append(callers[-1] * 2)
+
+        print("{:<30}".format("calls/s") + "".join("{:>10}".format(count) for count in callers))
+        for name, function in functions.items():
+            results = [_throughput(function, count, seconds) for count in callers]
+            print("{:<30}".format(name) + "".join("{:>10.1f}".format(result) for result in results))
+        print("pool: {}".format(Connector.pool_stats()))
+    finally:
+        Solution.drop_tables()
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0, int(sys.argv[2]) if len(sys.argv) > 2 else 16)
@@ -0,0 +1,80 @@
+# Deterministic synthetic airbnb data for the benchmarks.
+# The same seed and scale always give the same rows, and every table is produced as a generator,
+# so even the largest scales (10^7 reservations) are streamed into the database without being held in memory.
+import random
+from datetime import date, timedelta
+from typing import Iterator, Tuple
+
+from Business.Apartment import Apartment
+from Business.Customer import Customer
+from Business.Owner import Owner
+
+FIRST_DAY = date(2015, 1, 1)
+CITIES = 50
+COUNTRIES = 10
+
+
+class AirbnbGenerator:
+    # 'reservations' is the scale, the other tables are sized relative to it:
+    # ~20 reservations per apartment, ~10 per customer, ~5 apartments per owner, and ~half of the stays get reviewed
+    def __init__(self, reservations: int, seed: int = 0, review_ratio: float = 0.5):
+        self.seed = seed
+        self.reservations = reservations
+        self.apartments = max(1, reservations // 20)
+        self.customers = max(1, reservations // 10)
+        self.owners = max(1, self.apartments // 5)
+        self.review_ratio = review_ratio
+
+    def __rng(self, table: str) -> random.Random:
+        # one independent stream per table, so generating one table doesn't shift the others
+        return random.Random("{}:{}".format(self.seed, table))
+
+    def owners_rows(self) -> Iterator[Owner]:
+        for owner_id in range(1, self.owners + 1):
+            yield Owner(owner_id, "owner {}".format(owner_id))
+
+    def customers_rows(self) -> Iterator[Customer]:
+        for cust_id in range(1, self.customers + 1):
+            yield Customer(cust_id, "customer {}".format(cust_id))
+
+    def apartments_rows(self) -> Iterator[Apartment]:
+        rng = self.__rng('apartments')
+        for apartment_id in range(1, self.apartments + 1):
+            city = rng.randrange(CITIES)
+            yield Apartment(apartment_id, "{} main street".format(apartment_id), "city {}".format(city),
+                            "country {}".format(city % COUNTRIES), rng.randint(15, 250))
+
+    # (apartment_id, owner_id), every apartment has an owner
+    def owns_rows(self) -> Iterator[Tuple[int, int]]:
+        rng = self.__rng('owns')
+        for apartment_id in range(1, self.apartments + 1):
+            yield apartment_id, rng.randint(1, self.owners)
+
+    # (cust_id, apartment_id, start_date, end_date, total_price), never overlapping within an apartment
+    def reserves_rows(self) -> Iterator[Tuple[int, int, date, date, int]]:
+        rng = self.__rng('reserves')
+        per_apartment, remainder = divmod(self.reservations, self.apartments)
+        for apartment_id in range(1, self.apartments + 1):
+            nightly_price = rng.randint(40, 400)
+            day = FIRST_DAY + timedelta(days=rng.randint(0, 30))
+            for _ in range(per_apartment + (1 if apartment_id <= remainder else 0)):
+                nights = rng.randint(1, 14)
+                yield (rng.randint(1, self.customers), apartment_id, day, day + timedelta(days=nights),
+                       nights * nightly_price)
+                day += timedelta(days=nights + rng.randint(0, 10))
+
+    # (cust_id, apartment_id, review_date, rating, review_text), at most one review per customer and apartment,
+    # written after the stay it is about
+    def reviews_rows(self) -> Iterator[Tuple[int, int, date, int, str]]:
+        rng = self.__rng('reviews')
+        apartment_id = None
+        reviewed = set()
+        for cust_id, reserved_apartment_id, _, end_date, _ in self.reserves_rows():
+            if reserved_apartment_id != apartment_id:  # reservations come apartment by apartment
+                apartment_id = reserved_apartment_id
+                reviewed.clear()
+            if cust_id in reviewed or rng.random() >= self.review_ratio:
+                continue
+            reviewed.add(cust_id)
+            yield (cust_id, apartment_id, end_date + timedelta(days=rng.randint(0, 30)), rng.randint(1, 10),
+                   "review of apartment {} by customer {}".format(apartment_id, cust_id))
@@ -0,0 +1,53 @@
+# Throughput of the nightly fan-out (every customer's recommendation, every owner's and apartment's rating) run
+# through Utility.ParallelRunner with 1, 2, 4, ... workers. It should grow about linearly until Postgres saturates.
+#
+# WARNING: recreates the tables of the database configured in Utility/database.ini
+# usage (from the repository root): python -m Benchmarks.parallel_benchmark [max workers] [thread|process]
+import random
+import sys
+import time
+
+import Solution
+import Utility.DBConnector as Connector
+import Utility.ParallelRunner as ParallelRunner
+from Benchmarks.concurrency_benchmark import APARTMENTS, CUSTOMERS, OWNERS, _populate
+
+
+def main(max_workers: int = 16, mode: str = ParallelRunner.THREAD):
+    Connector.configure_pool(min_size=1, max_size=max_workers)
+    Solution.drop_tables()
+    Solution.create_tables()
+    try:
+        _populate(random.Random(0))
+        jobs = {
+            "get_apartment_recommendation": (Solution.get_apartment_recommendation, range(1, CUSTOMERS + 1)),
+            "get_owner_rating": (Solution.get_owner_rating, range(1, OWNERS + 1)),
+            "get_apartment_rating": (Solution.get_apartment_rating, range(1, APARTMENTS + 1)),
+        }
+        workers = [1]
+        while workers[-1] * 2 <= max_workers:
+            workers.append(workers[-1] * 2)
+
+        print("{:<30}".format("calls/s ({})".format(mode)) + "".join("{:>10}".format(count) for count in workers))
+        for name, (function, ids) in jobs.items():
+            rates = []
+            expected = None
+            for count in workers:
+                start = time.perf_counter()
+                results = ParallelRunner.run_each(function, ids, workers=count, mode=mode)
+                rates.append(len(ids) / (time.perf_counter() - start))
+                # every worker count must give the same results, in the same order
+                rendered = [str(result) for result in results]
+                if expected is None:
+                    expected = rendered
+                elif rendered != expected:
+                    print("{}: results with {} workers differ from the sequential run".format(name, count))
+            print("{:<30}".format(name) + "".join("{:>10.1f}".format(rate) for rate in rates))
+        if mode == ParallelRunner.THREAD:
+            print("pool: {}".format(Connector.pool_stats()))
+    finally:
+        Solution.drop_tables()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 16, sys.argv[2] if len(sys.argv) > 2 else ParallelRunner.THREAD)
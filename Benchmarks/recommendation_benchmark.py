@@ -0,0 +1,57 @@
+# Batch recommendations (get_apartment_recommendations, one pass over Reviews with NumPy / SciPy) against the
+# per-customer query (get_apartment_recommendation, one query per customer), at ~10^6 reviews by default.
+# The per-customer query is timed on a sample of customers and extrapolated to the whole customer base;
+# the batch results of that sample are checked against it.
+#
+# WARNING: recreates the tables of the database configured in Utility/database.ini
+# usage (from the repository root): python -m Benchmarks.recommendation_benchmark [reviews] [sampled customers]
+import random
+import sys
+import time
+
+import Solution
+from Benchmarks.generator import AirbnbGenerator
+from Benchmarks.suite import load
+
+TOLERANCE = 1e-9
+
+
+def _same(expected, actual) -> bool:
+    expected = sorted((apartment.get_id(), approximation) for apartment, approximation in expected)
+    actual = [(apartment.get_id(), approximation) for apartment, approximation in actual]
+    return len(expected) == len(actual) and all(
+        e_id == a_id and abs(e_value - a_value) <= TOLERANCE
+        for (e_id, e_value), (a_id, a_value) in zip(expected, actual))
+
+
+def main(reviews: int = 10 ** 6, sample: int = 200):
+    # the generator reviews about half of the stays
+    generator = AirbnbGenerator(reviews * 2, seed=0)
+    start = time.perf_counter()
+    load(generator)
+    print("loaded {} reservations in {:.1f}s".format(generator.reservations, time.perf_counter() - start))
+
+    customers = list(range(1, generator.customers + 1))
+    sampled = random.Random(0).sample(customers, min(sample, len(customers)))
+
+    start = time.perf_counter()
+    single = {customer_id: Solution.get_apartment_recommendation(customer_id) for customer_id in sampled}
+    per_customer = (time.perf_counter() - start) / len(sampled)
+
+    start = time.perf_counter()
+    batch = Solution.get_apartment_recommendations(customers)
+    batch_time = time.perf_counter() - start
+    if batch == Solution.ReturnValue.ERROR:
+        print("get_apartment_recommendations failed (are NumPy and SciPy installed?)")
+        return 1
+
+    mismatches = [customer_id for customer_id in sampled if not _same(single[customer_id], batch[customer_id])]
+    print("per customer: {:.2f} ms per call, ~{:.1f}s for all {} customers".format(
+        per_customer * 1e3, per_customer * len(customers), len(customers)))
+    print("batch:        {:.1f}s for all {} customers".format(batch_time, len(customers)))
+    print("{} of {} sampled customers differ".format(len(mismatches), len(sampled)))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6, int(sys.argv[2]) if len(sys.argv) > 2 else 200))
@@ -0,0 +1,102 @@
+# Microbenchmark of Utility.DBConnector.ResultSet against the previous ResultSet (kept below as LegacyResultSet):
+# building the set, iterating it by column name, projecting a column and printing it.
+# Reports wall time and peak allocated memory (tracemalloc) of each step. No database is needed.
+#
+# usage (from the repository root): python -m Benchmarks.resultset_benchmark [rows]
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+from Utility.DBConnector import ResultSet, ResultSetDict
+
+Column = namedtuple('Column', 'name')
+
+
+# the ResultSet this benchmark compares against, as it was before it was made compact
+class LegacyResultSet:
+    def __init__(self, description=None, results=None):
+        self.rows = []
+        self.cols_header = []
+        self.cols = ResultSetDict()
+        self.__fromQuery(description, results)
+
+    def __getitem__(self, idx):
+        if type(idx) == str:
+            return [x[self.cols[idx]] for x in self.rows]
+        return self.__getRow(idx)
+
+    def __str__(self):
+        string = ""
+        for col in self.cols_header:
+            string += str(col) + "   "
+        string += '\n'
+        for row in self.rows:
+            for val in row:
+                string += str(val) + "   "
+            string += '\n'
+        return string
+
+    def __iter__(self):
+        for row in range(len(self.rows)):
+            yield self.__getRow(row)
+
+    def __getRow(self, row: int):
+        if len(self.rows) <= row:
+            print('Invalid row ' + str(row))
+            return ResultSetDict()
+        row_to_return = ResultSetDict()
+        for val, col in zip(self.rows[row], self.cols_header):
+            row_to_return[col] = val
+        return row_to_return
+
+    def __fromQuery(self, description, results: list):
+        if results is None or len(results) == 0:
+            self.cols = ResultSetDict()
+        else:
+            self.rows = results.copy()
+            self.cols_header = [d.name for d in description]
+            self.cols = ResultSetDict()
+            for col, index in zip(self.cols_header, range(len(results[0]))):
+                self.cols[col] = index
+
+
+def _measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def _iterate(result_set):
+    total = 0
+    for row in result_set:
+        total += row['apartment_id'] + row['size']
+    return total
+
+
+def main(rows: int = 10 ** 6):
+    description = [Column('apartment_id'), Column('address'), Column('city'), Column('country'), Column('size')]
+    results = [(i, 'street {}'.format(i), 'city {}'.format(i % 100), 'country', i % 300 + 20) for i in range(rows)]
+    printed_rows = min(rows, 10 ** 5)
+
+    print("{:<20}{:>24}{:>24}".format("{} rows".format(rows), "legacy", "compact"))
+    for name, step in (("build", lambda cls: lambda: cls(description, list(results))),
+                       ("iterate by name", lambda cls: (lambda result_set: lambda: _iterate(result_set))(
+                           cls(description, list(results)))),
+                       ("project column", lambda cls: (lambda result_set: lambda: result_set['size'])(
+                           cls(description, list(results)))),
+                       ("str ({} rows)".format(printed_rows), lambda cls: (lambda result_set: lambda: str(result_set))(
+                           cls(description, results[:printed_rows])))):
+        measured = []
+        for cls in (LegacyResultSet, ResultSet):
+            elapsed, peak, _ = _measure(step(cls))
+            measured.append("{:8.3f}s {:9.1f}MiB".format(elapsed, peak / 2 ** 20))
+        print("{:<20}{:>24}{:>24}".format(name, *measured))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6)
@@ -0,0 +1,84 @@
+# Per-call latency of the string-formatting path (the query text is built with str.format, so Postgres parses and
+# plans it every time) against the prepared-statement path (EXECUTE of a statement prepared once per connection).
+# Both paths run on the same pooled connection, so the numbers only differ by parse/plan cost.
+#
+# WARNING: recreates the tables of the database configured in Utility/database.ini
+# usage (from the repository root): python -m Benchmarks.statements_benchmark [iterations]
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+import Solution
+import Utility.DBConnector as Connector
+from Business.Apartment import Apartment
+from Business.Customer import Customer
+from Business.Owner import Owner
+
+
+def _timed(function, iterations: int) -> list:
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        function(i)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _report(name: str, formatted: list, prepared: list):
+    def describe(timings):
+        ordered = sorted(timings)
+        return "mean={:8.1f}us p50={:8.1f}us p95={:8.1f}us".format(statistics.mean(ordered) * 1e6,
+                                                                   ordered[len(ordered) // 2] * 1e6,
+                                                                   ordered[int(len(ordered) * 0.95)] * 1e6)
+
+    print("{:<28} format   {}".format(name, describe(formatted)))
+    print("{:<28} prepared {}".format("", describe(prepared)))
+    print("{:<28} speedup  {:.2f}x".format("", statistics.mean(formatted) / statistics.mean(prepared)))
+
+
+def main(iterations: int = 5000):
+    Solution.drop_tables()
+    Solution.create_tables()
+    for i in range(1, 101):
+        Solution.add_owner(Owner(i, "owner {}".format(i)))
+        Solution.add_customer(Customer(i, "customer {}".format(i)))
+        Solution.add_apartment(Apartment(i, "street {}".format(i), "city {}".format(i % 10), "country", 50))
+
+    conn = Connector.DBConnector()
+    try:
+        _report("get_owner",
+                _timed(lambda i: conn.execute("SELECT * FROM Owners WHERE Owners.owner_id = {owner_id}".format(
+                    owner_id=i % 100 + 1)), iterations),
+                _timed(lambda i: conn.execute_prepared("get_owner", (i % 100 + 1,)), iterations))
+
+        _report("get_apartment",
+                _timed(lambda i: conn.execute("SELECT * FROM Apartments A WHERE A.apartment_id = {apartment_id}".format(
+                    apartment_id=i % 100 + 1)), iterations),
+                _timed(lambda i: conn.execute_prepared("get_apartment", (i % 100 + 1,)), iterations))
+
+        # every booking gets its own week, so each insert goes through the whole overlap check and succeeds
+        first_day = date(2000, 1, 1)
+
+        def book_formatted(i):
+            start_date = first_day + timedelta(weeks=i)
+            conn.execute("INSERT INTO Reserves "
+                         "SELECT {customer_id},{apartment_id},'{start_date}','{end_date}',{total_price} "
+                         "WHERE NOT EXISTS("
+                         "SELECT 1 FROM Reserves r WHERE r.apartment_id = {apartment_id} AND (r.start_date, r.end_date) OVERLAPS ('{start_date}', '{end_date}') )"
+                         .format(customer_id=1, apartment_id=1, start_date=start_date.strftime('%Y-%m-%d'),
+                                 end_date=(start_date + timedelta(days=7)).strftime('%Y-%m-%d'), total_price=700))
+
+        def book_prepared(i):
+            start_date = first_day + timedelta(weeks=i)
+            conn.execute_prepared("customer_made_reservation",
+                                  (2, 2, start_date, start_date + timedelta(days=7), 700))
+
+        _report("customer_made_reservation", _timed(book_formatted, iterations), _timed(book_prepared, iterations))
+    finally:
+        conn.close()
+        Solution.drop_tables()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
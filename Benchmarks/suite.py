@@ -0,0 +1,207 @@
+# Scale benchmark of the whole Solution.py API.
+# Loads a deterministic synthetic data set (Benchmarks.generator) at the requested scale, times every CRUD, basic and
+# advanced function, and reports p50 / p95 / p99 latency and throughput per function.
+# Results can be saved as a JSON baseline, and a later run can be compared against it to flag regressions.
+#
+# WARNING: recreates the tables of the database configured in Utility/database.ini
+# usage (from the repository root):
+#   python -m Benchmarks.suite --reservations 100000 --save baseline.json
+#   python -m Benchmarks.suite --reservations 100000 --compare baseline.json --threshold 0.2
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import date, timedelta
+from itertools import islice
+from typing import Callable, Dict, List
+
+import Solution
+import Utility.DBConnector as Connector
+from Benchmarks.generator import CITIES, COUNTRIES, AirbnbGenerator
+from Business.Apartment import Apartment
+from Business.Customer import Customer
+from Business.Owner import Owner
+
+COPY_CHUNK_SIZE = 50000
+
+
+def _copy(table: str, columns: tuple, rows):
+    conn = Connector.DBConnector()
+    try:
+        while True:
+            chunk = list(islice(rows, COPY_CHUNK_SIZE))
+            if not chunk:
+                break
+            conn.copy_in(table, columns, chunk)
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def load(generator: AirbnbGenerator):
+    Solution.drop_tables()
+    Solution.create_tables()
+    Solution.add_owners(generator.owners_rows())
+    Solution.add_customers(generator.customers_rows())
+    Solution.add_apartments(generator.apartments_rows())
+    _copy("Owns", ("apartment_id", "owner_id"), generator.owns_rows())
+    _copy("Reserves", ("cust_id", "apartment_id", "start_date", "end_date", "total_price"), generator.reserves_rows())
+    _copy("Reviews", ("cust_id", "apartment_id", "review_date", "rating", "review_text"), generator.reviews_rows())
+    conn = Connector.DBConnector()
+    try:
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(timings: List[float]) -> dict:
+    ordered = sorted(timings)
+    return {'calls': len(ordered),
+            'p50_ms': percentile(ordered, 0.50) * 1e3,
+            'p95_ms': percentile(ordered, 0.95) * 1e3,
+            'p99_ms': percentile(ordered, 0.99) * 1e3,
+            'throughput': len(ordered) / sum(ordered) if sum(ordered) > 0 else float('inf')}
+
+
+def _timed(function: Callable[[int], object], iterations: int) -> List[float]:
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        function(i)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+# (name, function of the iteration number) in the order they have to run: the write benchmarks build on each other
+# (e.g. 'delete_owner' deletes the owners 'add_owner' added) and only touch ids and dates outside the generated data
+def workload(generator: AirbnbGenerator, seed: int) -> List[tuple]:
+    rng = random.Random(seed)
+    new_id = lambda i: 10 ** 8 + i  # never generated
+    future = date(2090, 1, 1)  # reservations made by the benchmark start here, after all the generated ones
+    stay = lambda i: (future + timedelta(weeks=i), future + timedelta(weeks=i, days=5))
+    owner = lambda: rng.randint(1, generator.owners)
+    apartment = lambda: rng.randint(1, generator.apartments)
+    customer = lambda: rng.randint(1, generator.customers)
+    year = lambda: rng.randint(2015, 2020)
+
+    def location():
+        city = rng.randrange(CITIES)
+        return "city {}".format(city), "country {}".format(city % COUNTRIES)
+
+    return [
+        # CRUD
+        ("add_owner", lambda i: Solution.add_owner(Owner(new_id(i), "new owner"))),
+        ("get_owner", lambda i: Solution.get_owner(owner())),
+        ("add_customer", lambda i: Solution.add_customer(Customer(new_id(i), "new customer"))),
+        ("get_customer", lambda i: Solution.get_customer(customer())),
+        ("add_apartment", lambda i: Solution.add_apartment(Apartment(new_id(i), "{} new street".format(i), "new city",
+                                                                     "new country", 50))),
+        ("get_apartment", lambda i: Solution.get_apartment(apartment())),
+        ("owner_owns_apartment", lambda i: Solution.owner_owns_apartment(new_id(i), new_id(i))),
+        ("get_apartment_owner", lambda i: Solution.get_apartment_owner(apartment())),
+        ("get_owner_apartments", lambda i: Solution.get_owner_apartments(owner())),
+        ("search_available_apartments_page", lambda i: Solution.search_available_apartments_page(
+            *location(), date(2018, 1, 1) + timedelta(days=i % 365), date(2018, 1, 8) + timedelta(days=i % 365),
+            limit=20)),
+        ("customer_made_reservation", lambda i: Solution.customer_made_reservation(new_id(i), new_id(0), *stay(i), 500)),
+        ("customer_reviewed_apartment", lambda i: Solution.customer_reviewed_apartment(
+            new_id(i), new_id(0), stay(i)[1], 1 + i % 10, "benchmark review")),
+        ("customer_updated_review", lambda i: Solution.customer_updated_review(
+            new_id(i), new_id(0), stay(i)[1] + timedelta(days=1), 10 - i % 10, "updated benchmark review")),
+        ("customer_cancelled_reservation", lambda i: Solution.customer_cancelled_reservation(new_id(i), new_id(0),
+                                                                                             stay(i)[0])),
+        ("owner_drops_apartment", lambda i: Solution.owner_drops_apartment(new_id(i), new_id(i))),
+        ("delete_apartment", lambda i: Solution.delete_apartment(new_id(i))),
+        ("delete_customer", lambda i: Solution.delete_customer(new_id(i))),
+        ("delete_owner", lambda i: Solution.delete_owner(new_id(i))),
+        # BASIC
+        ("get_apartment_rating", lambda i: Solution.get_apartment_rating(apartment())),
+        ("get_owner_rating", lambda i: Solution.get_owner_rating(owner())),
+        ("get_top_customer", lambda i: Solution.get_top_customer()),
+        ("get_top_customers", lambda i: Solution.get_top_customers(10)),
+        ("reservations_per_owner", lambda i: Solution.reservations_per_owner()),
+        ("reservations_per_owner_page", lambda i: Solution.reservations_per_owner_page("owner {}".format(owner()), 100)),
+        # ADVANCED
+        ("get_all_location_owners", lambda i: Solution.get_all_location_owners()),
+        ("best_value_for_money", lambda i: Solution.best_value_for_money()),
+        ("best_value_for_money_top", lambda i: Solution.best_value_for_money_top(10)),
+        ("profit_per_month", lambda i: Solution.profit_per_month(year())),
+        ("profit_per_month_range", lambda i: Solution.profit_per_month_range(2015, 2020)),
+        ("get_apartment_recommendation", lambda i: Solution.get_apartment_recommendation(customer())),
+        ("get_apartment_recommendation_top", lambda i: Solution.get_apartment_recommendation_top(customer(), 10)),
+    ]
+
+
+def run(generator: AirbnbGenerator, iterations: int, seed: int = 0, only: List[str] = None) -> Dict[str, dict]:
+    results = {}
+    for name, function in workload(generator, seed):
+        # the write benchmarks depend on each other, so they always run; 'only' just filters the report
+        summary = summarize(_timed(function, iterations))
+        if not only or name in only:
+            results[name] = summary
+    return results
+
+
+# functions whose p95 latency grew by more than 'threshold' (0.2 = 20%) compared to the baseline
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    return [name for name, summary in results.items()
+            if name in baseline and summary['p95_ms'] > baseline[name]['p95_ms'] * (1 + threshold)]
+
+
+def report(results: Dict[str, dict], baseline: Dict[str, dict] = None, threshold: float = 0.2):
+    regressed = set(regressions(results, baseline, threshold)) if baseline else set()
+    print("{:<32}{:>8}{:>11}{:>11}{:>11}{:>12}{:>11}".format("function", "calls", "p50 ms", "p95 ms", "p99 ms",
+                                                             "calls/s", "vs base"))
+    for name, summary in results.items():
+        change = ""
+        if baseline and name in baseline and baseline[name]['p95_ms'] > 0:
+            change = "{:+.0%}".format(summary['p95_ms'] / baseline[name]['p95_ms'] - 1)
+        print("{:<32}{:>8}{:>11.3f}{:>11.3f}{:>11.3f}{:>12.1f}{:>11}{}".format(
+            name, summary['calls'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'], summary['throughput'],
+            change, "  REGRESSION" if name in regressed else ""))
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Scale benchmark of the Solution.py API")
+    parser.add_argument("--reservations", type=int, default=10 ** 4,
+                        help="scale of the generated data set, 10^3 to 10^7 reservations")
+    parser.add_argument("--iterations", type=int, default=200, help="calls per function")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="report only these functions")
+    parser.add_argument("--no-load", action="store_true", help="reuse the data set already in the database")
+    parser.add_argument("--save", metavar="JSON", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="JSON", help="compare the results against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 growth that counts as a regression")
+    args = parser.parse_args(argv)
+
+    generator = AirbnbGenerator(args.reservations, args.seed)
+    if not args.no_load:
+        start = time.perf_counter()
+        load(generator)
+        print("loaded {} reservations in {:.1f}s".format(args.reservations, time.perf_counter() - start))
+
+    results = run(generator, args.iterations, args.seed, args.only)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            saved = json.load(file)
+        if saved.get('reservations') != args.reservations:
+            print("warning: the baseline was measured at {} reservations".format(saved.get('reservations')))
+        baseline = saved['results']
+    report(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'reservations': args.reservations, 'iterations': args.iterations, 'seed': args.seed,
+                       'results': results}, file, indent=2)
+
+    return 1 if baseline and regressions(results, baseline, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+# Commit-bound throughput: the "add an apartment, assign it an owner, make three reservations" workflow with every call
+# committing on its own, against the same workflow inside a transaction() (one commit per workflow), and against
+# many workflows per transaction.
+#
+# WARNING: recreates the tables of the database configured in Utility/database.ini
+# usage (from the repository root): python -m Benchmarks.transaction_benchmark [workflows per run] [workflows per batch]
+import sys
+import time
+from datetime import date, timedelta
+
+import Solution
+from Business.Apartment import Apartment
+from Business.Customer import Customer
+from Business.Owner import Owner
+
+OWNERS = 10
+CUSTOMERS = 10
+
+
+def _workflow(apartment_id: int) -> list:
+    results = [Solution.add_apartment(Apartment(apartment_id, "{} main street".format(apartment_id), "city", "country",
+                                                50)),
+               Solution.owner_owns_apartment(1 + apartment_id % OWNERS, apartment_id)]
+    for stay in range(3):
+        start_date = date(2020, 1, 1) + timedelta(weeks=stay)
+        results.append(Solution.customer_made_reservation(1 + (apartment_id + stay) % CUSTOMERS, apartment_id, start_date,
+                                                          start_date + timedelta(days=3), 300))
+    return results
+
+
+# runs 'workflows' workflows starting at apartment 'first_id', 'batch' of them per transaction (0 = no transaction)
+def _run(first_id: int, workflows: int, batch: int) -> float:
+    start = time.perf_counter()
+    if batch == 0:
+        for apartment_id in range(first_id, first_id + workflows):
+            _workflow(apartment_id)
+    else:
+        for batch_start in range(first_id, first_id + workflows, batch):
+            with Solution.transaction():
+                for apartment_id in range(batch_start, min(batch_start + batch, first_id + workflows)):
+                    _workflow(apartment_id)
+    return workflows / (time.perf_counter() - start)
+
+
+def main(workflows: int = 500, batch: int = 50):
+    Solution.drop_tables()
+    Solution.create_tables()
+    try:
+        Solution.add_owners(Owner(i, "owner {}".format(i)) for i in range(1, OWNERS + 1))
+        Solution.add_customers(Customer(i, "customer {}".format(i)) for i in range(1, CUSTOMERS + 1))
+
+        # the results must not depend on the mode
+        with Solution.transaction():
+            in_transaction = _workflow(10 ** 6)
+        alone = _workflow(10 ** 6 + 1)
+        if in_transaction != alone:
+            print("different results: {} in a transaction, {} alone".format(in_transaction, alone))
+
+        runs = [("a commit per call", 0), ("a transaction per workflow", 1),
+                ("{} workflows per transaction".format(batch), batch)]
+        for number, (name, run_batch) in enumerate(runs):
+            throughput = _run(1 + number * workflows, workflows, run_batch)
+            print("{:<36}{:>10.1f} workflows/s".format(name, throughput))
+    finally:
+        Solution.drop_tables()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500, int(sys.argv[2]) if len(sys.argv) > 2 else 50)
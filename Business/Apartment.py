@@ -1,4 +1,9 @@
+from itertools import starmap
+
+
 class Apartment:
+    __slots__ = ('__id', '__address', '__city', '__country', '__size')
+
     def __init__(self, id: int=None, address: str=None, city: str=None, country: str=None, size: float=None) -> None:
         self.__id = id
         self.__address = address
@@ -36,6 +41,11 @@ class Apartment:
     def set_size(self, size):
         self.__size = size
 
+    # one Apartment per (id, address, city, country, size) row, e.g. the tuples of a query's result
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        return list(starmap(cls, rows))
+
     @staticmethod
     def bad_apartment():
         return Apartment()
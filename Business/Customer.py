@@ -1,4 +1,9 @@
+from itertools import starmap
+
+
 class Customer:
+    __slots__ = ('__id', '__name')
+
     def __init__(self, customer_id: int=None, customer_name: str=None) -> None:
         self.__id = customer_id
         self.__name = customer_name
@@ -15,6 +20,11 @@ class Customer:
     def set_customer_name(self, name):
         self.__name = name
 
+    # one Customer per (customer_id, customer_name) row, e.g. the tuples of a query's result
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        return list(starmap(cls, rows))
+
     @staticmethod
     def bad_customer():
         return Customer()
@@ -1,4 +1,9 @@
+from itertools import starmap
+
+
 class Owner:
+    __slots__ = ('__id', '__name')
+
     def __init__(self, owner_id: int=None, owner_name: str=None) -> None:
         self.__id = owner_id
         self.__name = owner_name
@@ -15,6 +20,11 @@ class Owner:
     def set_owner_name(self, name):
         self.__name = name
 
+    # one Owner per (owner_id, owner_name) row, e.g. the tuples of a query's result
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        return list(starmap(cls, rows))
+
     @staticmethod
     def bad_owner():
         return Owner()
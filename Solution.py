@@ -1,23 +1,243 @@
 from psycopg2 import sql
 from datetime import date, datetime
-from typing import List, Tuple
+from decimal import Decimal
+from itertools import chain, islice
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 import Utility.DBConnector as Connector
+import Utility.Statements as Statements
+import Utility.PlanCapture as PlanCapture
 from Utility.ReturnValue import ReturnValue
 from Utility.Exceptions import DatabaseException
+from Utility.EntityCache import EntityCache
+from Utility.BookingCalendar import BookingCalendar
+from Utility.Instrumentation import instrumented
 
 from Business.Owner import Owner
 from Business.Customer import Customer
 from Business.Apartment import Apartment
 
 
+# ---------------------------------- ENTITY CACHE: ----------------------------------
+
+# Optional read-through cache in front of get_owner / get_apartment / get_customer / get_apartment_owner (off by default).
+# It stores the entity's row (or None for "doesn't exist"), never the entity itself, so callers never share an object.
+# Keys are (kind, id); every write that can change what a getter returns invalidates the affected keys.
+_entity_cache = None
+
+
+def enable_entity_cache(max_size: int = 10000, ttl: float = 60.0) -> EntityCache:
+	global _entity_cache
+	_entity_cache = EntityCache(max_size, ttl)
+	return _entity_cache
+
+
+def disable_entity_cache():
+	global _entity_cache
+	_entity_cache = None
+
+
+# hits / misses / evictions / ... of the entity cache, or None when it's disabled
+def entity_cache_stats() -> dict:
+	cache = _entity_cache
+	return cache.stats() if cache is not None else None
+
+
+# returns (cached row or EntityCache.MISS, epoch to pass to _cache_store).
+# Inside a transaction the cache is bypassed: the transaction sees its own uncommitted writes, the cache must not
+def _cache_lookup(key: tuple):
+	cache = _entity_cache
+	if cache is None or Connector.current_transaction() is not None:
+		return EntityCache.MISS, None
+	try:
+		return cache.get(key), cache.epoch()
+	except TypeError:  # an unhashable id, let the database reject it
+		return EntityCache.MISS, None
+
+
+def _cache_store(key: tuple, row, epoch):
+	cache = _entity_cache
+	if cache is not None and epoch is not None:
+		cache.put(key, row, epoch)
+
+
+# Inside a transaction the keys are invalidated again once it commits, in case a reader outside of it cached the old
+# (still committed) row in the meantime
+def _cache_invalidate(*keys):
+	cache = _entity_cache
+	if cache is not None:
+		try:
+			cache.invalidate(*keys)
+		except TypeError:
+			cache.clear()
+		transaction = Connector.current_transaction()
+		if transaction is not None:
+			transaction.on_commit(lambda: _cache_invalidate(*keys))
+
+
+def _cache_invalidate_where(predicate):
+	cache = _entity_cache
+	if cache is not None:
+		cache.invalidate_where(predicate)
+		transaction = Connector.current_transaction()
+		if transaction is not None:
+			transaction.on_commit(lambda: _cache_invalidate_where(predicate))
+
+
+# ---------------------------------- TRANSACTIONS: ----------------------------------
+
+# Runs many API calls as one unit of work:
+#     with transaction():
+#         add_apartment(...)
+#         owner_owns_apartment(...)
+#         customer_made_reservation(...)
+# Every call inside the block uses the transaction's single connection, in a savepoint of its own, so it returns the
+# same ReturnValue it would alone (a failing call only undoes itself). Everything is committed once, at the end of the
+# block, or rolled back if the block raises or calls rollback() on the transaction ('with transaction() as tx:').
+def transaction() -> Connector.Transaction:
+	return Connector.Transaction()
+
+
+# ---------------------------------- BOOKING CALENDAR: ----------------------------------
+
+# Optional in-process index of the booked stays of every apartment (off by default). While it is on,
+# customer_made_reservation() only sends a stay to the database when the calendar has no booked stay overlapping it.
+# Reservations, cancellations and deletions made through this module keep it in sync; writes made elsewhere aren't
+# seen, so an overlap the calendar finds is only a hint: it is confirmed by a read-only probe of the GiST index of
+# 'Reserves' before answering BAD_PARAMS, and the stays the probe disproves are dropped from the calendar.
+# With 'sole_writer' (this process makes every reservation write) the overlaps are trusted and cost no round trip.
+# The database stays authoritative either way: it still checks every stay it gets.
+# Inside a transaction the calendar isn't consulted, and is only updated on commit
+_booking_calendar = None
+_booking_calendar_sole_writer = False
+
+Statements.register("booking_calendar_rows", (),
+					"SELECT apartment_id, cust_id, start_date, end_date FROM Reserves")
+
+Statements.register("booking_calendar_overlap", ("INTEGER", "DATE", "DATE"),
+					"SELECT 1 FROM Reserves "
+					"WHERE apartment_id = $1 AND daterange(start_date, end_date) && daterange($2, $3) "
+					"LIMIT 1")
+
+
+# warms the calendar from 'Reserves' (streamed, so memory only holds the calendar itself) and turns it on
+def enable_booking_calendar(sole_writer: bool = False, fetch_size: int = Connector.DEFAULT_FETCH_SIZE) -> BookingCalendar:
+	global _booking_calendar, _booking_calendar_sole_writer
+	calendar = BookingCalendar()
+	conn = Connector.DBConnector()
+	try:
+		with conn.stream_prepared("booking_calendar_rows", (), fetch_size) as result:
+			calendar.warm(result.rows())
+	finally:
+		conn.close()
+	_booking_calendar, _booking_calendar_sole_writer = calendar, sole_writer
+	return calendar
+
+
+def disable_booking_calendar():
+	global _booking_calendar
+	_booking_calendar = None
+
+
+# checks / hits / rejects / ... of the booking calendar, or None when it's disabled
+def booking_calendar_stats() -> dict:
+	calendar = _booking_calendar
+	return calendar.stats() if calendar is not None else None
+
+
+def _calendar_rejects(conn: Connector.DBConnector, apartment_id: int, start_date, end_date) -> bool:
+	calendar = _booking_calendar
+	if calendar is None or Connector.current_transaction() is not None:
+		return False
+	if not calendar.overlaps(apartment_id, start_date, end_date):
+		return False
+	if _booking_calendar_sole_writer:
+		return True
+	_, result = conn.execute_prepared("booking_calendar_overlap", (apartment_id, start_date, end_date), commit=False)
+	if result.rows:
+		return True
+	calendar.remove_stale(apartment_id, start_date, end_date)
+	return False
+
+
+# taken before a reservation is written, for the calendar to tell whether it was cancelled before it was added
+def _calendar_ticket():
+	calendar = _booking_calendar
+	return calendar.ticket() if calendar is not None else None
+
+
+# applies update(calendar) now, or once the current transaction commits
+def _calendar_update(update):
+	calendar = _booking_calendar
+	if calendar is None:
+		return
+	transaction = Connector.current_transaction()
+	if transaction is not None:
+		transaction.on_commit(lambda: _calendar_update(update))
+	else:
+		update(calendar)
+
+
+# ---------------------------------- INSTRUMENTATION: ----------------------------------
+
+# Every API function below is @instrumented: while Utility.Instrumentation is enabled, its latency is recorded under its
+# name and the queries it runs are attributed to it. The streaming iter_* generators aren't, their time is the caller's.
+
 # ---------------------------------- CRUD API: ----------------------------------
 
+# Body of the statement triggers that keep 'CustomerSimilarity' up to date: applies the reviews a statement took out
+# ('removed') and put in ('added'), both given as SELECTs of (cust_id, apartment_id, rating).
+# The kept reviews are the ones the statement didn't change. Every pair of reviews of the same apartment, by two different
+# customers, contributes rating / other rating (computed just like the recommendation query did) to the pair's row,
+# in both directions, so a pair is counted once whichever of its two reviews changes first.
+def _similarity_update(removed: str, added: str) -> str:
+	# not a CTE of its own: it is joined by apartment, and a CTE used several times would be a full scan of 'Reviews'
+	kept = ("(SELECT r.cust_id, r.apartment_id, r.rating FROM Reviews r "
+			"WHERE NOT EXISTS (SELECT 1 FROM Added a WHERE a.cust_id = r.cust_id AND a.apartment_id = r.apartment_id))")
+	return ("WITH Removed AS ({0}), "
+			"Added AS ({1}), "
+
+			"Deltas AS ("
+			"SELECT d.cust_id, o.cust_id AS other_cust_id, -(d.rating * 1.0 / o.rating * 1.0) AS ratio, -1 AS pairs "
+			"FROM Removed d JOIN (SELECT * FROM {2} k UNION ALL SELECT * FROM Removed) o ON o.apartment_id = d.apartment_id "
+			"WHERE o.cust_id <> d.cust_id "
+			"UNION ALL "
+			"SELECT o.cust_id, d.cust_id, -(o.rating * 1.0 / d.rating * 1.0), -1 "
+			"FROM Removed d JOIN {2} o ON o.apartment_id = d.apartment_id AND o.cust_id <> d.cust_id "
+			"UNION ALL "
+			"SELECT n.cust_id, o.cust_id, n.rating * 1.0 / o.rating * 1.0, 1 "
+			"FROM Added n JOIN (SELECT * FROM {2} k UNION ALL SELECT * FROM Added) o ON o.apartment_id = n.apartment_id "
+			"WHERE o.cust_id <> n.cust_id "
+			"UNION ALL "
+			"SELECT o.cust_id, n.cust_id, o.rating * 1.0 / n.rating * 1.0, 1 "
+			"FROM Added n JOIN {2} o ON o.apartment_id = n.apartment_id AND o.cust_id <> n.cust_id) "
+
+			"INSERT INTO CustomerSimilarity AS s (cust_id, other_cust_id, ratio_sum, ratio_count) "
+			"SELECT cust_id, other_cust_id, SUM(ratio), SUM(pairs) FROM Deltas GROUP BY cust_id, other_cust_id "
+			"ON CONFLICT (cust_id, other_cust_id) DO UPDATE "
+			"SET ratio_sum = s.ratio_sum + EXCLUDED.ratio_sum, ratio_count = s.ratio_count + EXCLUDED.ratio_count; ").format(
+		removed, added, kept)
+
+
+# Pairs drop to a count of 0 only through a removed review; both directions of a pair always have the same count
+_SIMILARITY_PRUNE = ("WITH Gone AS ("
+					 "DELETE FROM CustomerSimilarity s USING (SELECT DISTINCT cust_id FROM old_reviews) d "
+					 "WHERE s.cust_id = d.cust_id AND s.ratio_count = 0 "
+					 "RETURNING s.cust_id, s.other_cust_id) "
+					 "DELETE FROM CustomerSimilarity s USING Gone g "
+					 "WHERE s.cust_id = g.other_cust_id AND s.other_cust_id = g.cust_id; ")
+
+_NO_REVIEWS = "SELECT cust_id, apartment_id, rating FROM Reviews WHERE FALSE"
+
+@instrumented
 def create_tables():
 	conn = None
 	try:
 		conn = Connector.DBConnector()
 		conn.execute(
+					 # btree_gist lets a GiST index (the exclusion constraint of 'Reserves') take plain integer columns
+					 "CREATE EXTENSION IF NOT EXISTS btree_gist;"
 
 					 "CREATE TABLE Owners("
 					 "owner_id INTEGER PRIMARY KEY NOT NULL CHECK(owner_id > 0),"
@@ -61,15 +281,345 @@ def create_tables():
 					 "end_date DATE NOT NULL,"
 					 "CHECK (end_date > start_date),"
 					 "total_price INTEGER NOT NULL CHECK(total_price > 0),"
+					 # No two reservations of the same apartment may overlap. The constraint's GiST index makes the check
+					 # a range lookup, and it is enforced under concurrent bookings too (unlike a NOT EXISTS check)
+					 "EXCLUDE USING gist (apartment_id WITH =, daterange(start_date, end_date) WITH &&),"
 					 "FOREIGN KEY (cust_id) REFERENCES Customers(cust_id) ON DELETE CASCADE,"
 					 "FOREIGN KEY (apartment_id) REFERENCES Apartments(apartment_id) ON DELETE CASCADE);"
 
+					# Sum and count of the ratings of every apartment, kept up to date by triggers on 'Apartments' and 'Reviews'
+					# so reading an apartment's rating is a primary key lookup, no matter how many reviews there are
+					"CREATE TABLE ApartmentRatings( "
+					"apartment_id INTEGER PRIMARY KEY NOT NULL,"
+					"rating_sum INTEGER NOT NULL DEFAULT 0,"
+					"rating_count INTEGER NOT NULL DEFAULT 0,"
+					"FOREIGN KEY (apartment_id) REFERENCES Apartments(apartment_id) ON DELETE CASCADE);"
+
+					"CREATE OR REPLACE FUNCTION apartment_added() RETURNS TRIGGER AS $$ "
+					"BEGIN "
+					"INSERT INTO ApartmentRatings(apartment_id) VALUES (NEW.apartment_id); "
+					"INSERT INTO ApartmentReservations(apartment_id) VALUES (NEW.apartment_id); "
+					"INSERT INTO Locations(city, country, apartment_count) VALUES (NEW.city, NEW.country, 1) "
+					"ON CONFLICT (city, country) DO UPDATE SET apartment_count = Locations.apartment_count + 1; "
+					"RETURN NULL; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TRIGGER apartment_added AFTER INSERT ON Apartments "
+					"FOR EACH ROW EXECUTE FUNCTION apartment_added();"
+
+					# An update takes the old rating out and puts the new one in. Deleting an apartment cascades to
+					# its 'ApartmentRatings' row, so the updates of its cascaded reviews simply find nothing to update
+					"CREATE OR REPLACE FUNCTION review_changed() RETURNS TRIGGER AS $$ "
+					"BEGIN "
+					"IF TG_OP = 'UPDATE' AND OLD.rating = NEW.rating AND OLD.apartment_id = NEW.apartment_id THEN "
+					"RETURN NULL; "
+					"END IF; "
+					"IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+					"UPDATE ApartmentRatings SET rating_sum = rating_sum - OLD.rating, rating_count = rating_count - 1 "
+					"WHERE apartment_id = OLD.apartment_id; "
+					"PERFORM refresh_value_ratios(ARRAY[OLD.apartment_id]); "
+					"END IF; "
+					"IF TG_OP IN ('INSERT', 'UPDATE') THEN "
+					"UPDATE ApartmentRatings SET rating_sum = rating_sum + NEW.rating, rating_count = rating_count + 1 "
+					"WHERE apartment_id = NEW.apartment_id; "
+					"PERFORM refresh_value_ratios(ARRAY[NEW.apartment_id]); "
+					"END IF; "
+					"RETURN NULL; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TRIGGER review_changed AFTER INSERT OR UPDATE OR DELETE ON Reviews "
+					"FOR EACH ROW EXECUTE FUNCTION review_changed();"
+
+					# For every two customers that reviewed a common apartment: the sum (and count) of the ratios
+					# rating / other rating over their common apartments, kept up to date by statement triggers on 'Reviews'
+					# (they see all the reviews a statement changed at once, cascaded deletes included).
+					# A recommendation then reads its customer's averages with a primary key range scan
+					"CREATE TABLE CustomerSimilarity( "
+					"cust_id INTEGER NOT NULL,"
+					"other_cust_id INTEGER NOT NULL,"
+					"ratio_sum NUMERIC NOT NULL,"
+					"ratio_count INTEGER NOT NULL,"
+					"PRIMARY KEY (cust_id, other_cust_id));"
+
+					"CREATE OR REPLACE FUNCTION reviews_similarity_changed() RETURNS TRIGGER AS $$ "
+					"BEGIN "
+					"IF TG_OP = 'INSERT' THEN "
+					+ _similarity_update(_NO_REVIEWS, "SELECT cust_id, apartment_id, rating FROM new_reviews") +
+					"ELSIF TG_OP = 'DELETE' THEN "
+					+ _similarity_update("SELECT cust_id, apartment_id, rating FROM old_reviews", _NO_REVIEWS)
+					+ _SIMILARITY_PRUNE +
+					"ELSE "
+					# only the reviews whose rating (or key) changed matter
+					+ _similarity_update("SELECT cust_id, apartment_id, rating FROM old_reviews "
+										 "EXCEPT SELECT cust_id, apartment_id, rating FROM new_reviews",
+										 "SELECT cust_id, apartment_id, rating FROM new_reviews "
+										 "EXCEPT SELECT cust_id, apartment_id, rating FROM old_reviews")
+					+ _SIMILARITY_PRUNE +
+					"END IF; "
+					"RETURN NULL; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TRIGGER reviews_inserted_similarity AFTER INSERT ON Reviews "
+					"REFERENCING NEW TABLE AS new_reviews "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reviews_similarity_changed();"
+
+					"CREATE TRIGGER reviews_deleted_similarity AFTER DELETE ON Reviews "
+					"REFERENCING OLD TABLE AS old_reviews "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reviews_similarity_changed();"
+
+					"CREATE TRIGGER reviews_updated_similarity AFTER UPDATE ON Reviews "
+					"REFERENCING OLD TABLE AS old_reviews NEW TABLE AS new_reviews "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reviews_similarity_changed();"
+
+					# Revenue (and number) of the reservations that ended in every month, kept up to date by statement
+					# triggers on 'Reserves', so profit_per_month reads at most 12 rows per year however many reservations
+					# there are. A month without reservations simply has no row (or a row of zeros after cancellations)
+					"CREATE TABLE MonthlyRevenue( "
+					"year INTEGER NOT NULL,"
+					"month INTEGER NOT NULL,"
+					"revenue_sum BIGINT NOT NULL,"
+					"reservation_count INTEGER NOT NULL,"
+					"PRIMARY KEY (year, month));"
+
+					"CREATE OR REPLACE FUNCTION reserves_revenue_changed() RETURNS TRIGGER AS $$ "
+					"BEGIN "
+					"IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+					"UPDATE MonthlyRevenue m "
+					"SET revenue_sum = m.revenue_sum - d.revenue, reservation_count = m.reservation_count - d.reservations "
+					"FROM (SELECT EXTRACT(YEAR FROM end_date) AS year, EXTRACT(MONTH FROM end_date) AS month, "
+					"SUM(total_price) AS revenue, COUNT(*) AS reservations "
+					"FROM old_reserves GROUP BY 1, 2) d "
+					"WHERE m.year = d.year AND m.month = d.month; "
+					"END IF; "
+					"IF TG_OP IN ('INSERT', 'UPDATE') THEN "
+					"INSERT INTO MonthlyRevenue AS m (year, month, revenue_sum, reservation_count) "
+					"SELECT EXTRACT(YEAR FROM end_date), EXTRACT(MONTH FROM end_date), SUM(total_price), COUNT(*) "
+					"FROM new_reserves GROUP BY 1, 2 "
+					"ON CONFLICT (year, month) DO UPDATE "
+					"SET revenue_sum = m.revenue_sum + EXCLUDED.revenue_sum, "
+					"reservation_count = m.reservation_count + EXCLUDED.reservation_count; "
+					"END IF; "
+					"RETURN NULL; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TRIGGER reserves_inserted_revenue AFTER INSERT ON Reserves "
+					"REFERENCING NEW TABLE AS new_reserves "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reserves_revenue_changed();"
+
+					"CREATE TRIGGER reserves_deleted_revenue AFTER DELETE ON Reserves "
+					"REFERENCING OLD TABLE AS old_reserves "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reserves_revenue_changed();"
+
+					"CREATE TRIGGER reserves_updated_revenue AFTER UPDATE ON Reserves "
+					"REFERENCING OLD TABLE AS old_reserves NEW TABLE AS new_reserves "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reserves_revenue_changed();"
+
+					# Number of reservations of every apartment and of every owner (over the apartments it owns), kept up
+					# to date by triggers on 'Reserves' and 'Owns', so reservations_per_owner doesn't join 'Reserves' at all.
+					# The rows are created along with their apartment / owner (see apartment_added / owner_added).
+					# An apartment also has the sum of its reservations' nightly costs (total_price / nights, in integers,
+					# like best_value_for_money always computed it) and its value for money: average rating / average
+					# nightly cost, NULL while it has no reservations (or an average nightly cost of 0)
+					"CREATE TABLE ApartmentReservations( "
+					"apartment_id INTEGER PRIMARY KEY NOT NULL,"
+					"reservation_count INTEGER NOT NULL DEFAULT 0,"
+					"nightly_cost_sum BIGINT NOT NULL DEFAULT 0,"
+					"value_ratio NUMERIC,"
+					"FOREIGN KEY (apartment_id) REFERENCES Apartments(apartment_id) ON DELETE CASCADE);"
+
+					# Number of reservations of every customer that has any, kept up to date along with the above
+					"CREATE TABLE CustomerReservations( "
+					"cust_id INTEGER PRIMARY KEY NOT NULL,"
+					"reservation_count INTEGER NOT NULL,"
+					"FOREIGN KEY (cust_id) REFERENCES Customers(cust_id) ON DELETE CASCADE);"
+
+					# recomputes the value for money of the given apartments, after their ratings or reservations changed
+					"CREATE OR REPLACE FUNCTION refresh_value_ratios(ids INTEGER[]) RETURNS VOID AS $$ "
+					"BEGIN "
+					"UPDATE ApartmentReservations v SET value_ratio = CASE WHEN v.nightly_cost_sum <> 0 THEN "
+					"COALESCE(r.rating_sum::NUMERIC / NULLIF(r.rating_count, 0), 0) "
+					"/ (v.nightly_cost_sum::NUMERIC / v.reservation_count) END "
+					"FROM ApartmentRatings r "
+					"WHERE v.apartment_id = ANY(ids) AND r.apartment_id = v.apartment_id; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TABLE OwnerReservations( "
+					"owner_id INTEGER PRIMARY KEY NOT NULL,"
+					"reservation_count INTEGER NOT NULL DEFAULT 0,"
+					"FOREIGN KEY (owner_id) REFERENCES Owners(owner_id) ON DELETE CASCADE);"
+
+					"CREATE OR REPLACE FUNCTION owner_added() RETURNS TRIGGER AS $$ "
+					"BEGIN "
+					"INSERT INTO OwnerReservations(owner_id) VALUES (NEW.owner_id); "
+					"RETURN NULL; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TRIGGER owner_added AFTER INSERT ON Owners "
+					"FOR EACH ROW EXECUTE FUNCTION owner_added();"
+
+					# A reservation counts for its apartment and for the apartment's owner, if it has one right now
+					"CREATE OR REPLACE FUNCTION reserves_counters_changed() RETURNS TRIGGER AS $$ "
+					"BEGIN "
+					"IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+					"UPDATE ApartmentReservations a SET reservation_count = a.reservation_count - d.reservations, "
+					"nightly_cost_sum = a.nightly_cost_sum - d.nightly_costs "
+					"FROM (SELECT apartment_id, COUNT(*) AS reservations, "
+					"SUM(total_price / (end_date - start_date)) AS nightly_costs "
+					"FROM old_reserves GROUP BY apartment_id) d "
+					"WHERE a.apartment_id = d.apartment_id; "
+					"UPDATE OwnerReservations o SET reservation_count = o.reservation_count - d.reservations "
+					"FROM (SELECT ow.owner_id, COUNT(*) AS reservations FROM old_reserves r "
+					"JOIN Owns ow ON ow.apartment_id = r.apartment_id GROUP BY ow.owner_id) d "
+					"WHERE o.owner_id = d.owner_id; "
+					"UPDATE CustomerReservations c SET reservation_count = c.reservation_count - d.reservations "
+					"FROM (SELECT cust_id, COUNT(*) AS reservations FROM old_reserves GROUP BY cust_id) d "
+					"WHERE c.cust_id = d.cust_id; "
+					"DELETE FROM CustomerReservations c USING (SELECT DISTINCT cust_id FROM old_reserves) d "
+					"WHERE c.cust_id = d.cust_id AND c.reservation_count = 0; "
+					"PERFORM refresh_value_ratios(ARRAY(SELECT DISTINCT apartment_id FROM old_reserves)); "
+					"END IF; "
+					"IF TG_OP IN ('INSERT', 'UPDATE') THEN "
+					"UPDATE ApartmentReservations a SET reservation_count = a.reservation_count + d.reservations, "
+					"nightly_cost_sum = a.nightly_cost_sum + d.nightly_costs "
+					"FROM (SELECT apartment_id, COUNT(*) AS reservations, "
+					"SUM(total_price / (end_date - start_date)) AS nightly_costs "
+					"FROM new_reserves GROUP BY apartment_id) d "
+					"WHERE a.apartment_id = d.apartment_id; "
+					"UPDATE OwnerReservations o SET reservation_count = o.reservation_count + d.reservations "
+					"FROM (SELECT ow.owner_id, COUNT(*) AS reservations FROM new_reserves r "
+					"JOIN Owns ow ON ow.apartment_id = r.apartment_id GROUP BY ow.owner_id) d "
+					"WHERE o.owner_id = d.owner_id; "
+					"INSERT INTO CustomerReservations AS c (cust_id, reservation_count) "
+					"SELECT cust_id, COUNT(*) FROM new_reserves GROUP BY cust_id "
+					"ON CONFLICT (cust_id) DO UPDATE SET reservation_count = c.reservation_count + EXCLUDED.reservation_count; "
+					"PERFORM refresh_value_ratios(ARRAY(SELECT DISTINCT apartment_id FROM new_reserves)); "
+					"END IF; "
+					"RETURN NULL; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TRIGGER reserves_inserted_counters AFTER INSERT ON Reserves "
+					"REFERENCING NEW TABLE AS new_reserves "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reserves_counters_changed();"
+
+					"CREATE TRIGGER reserves_deleted_counters AFTER DELETE ON Reserves "
+					"REFERENCING OLD TABLE AS old_reserves "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reserves_counters_changed();"
+
+					"CREATE TRIGGER reserves_updated_counters AFTER UPDATE ON Reserves "
+					"REFERENCING OLD TABLE AS old_reserves NEW TABLE AS new_reserves "
+					"FOR EACH STATEMENT EXECUTE FUNCTION reserves_counters_changed();"
+
+					# An owner gains / loses the reservations of the apartment it starts / stops owning. The loss counts
+					# 'Reserves' itself rather than reading 'ApartmentReservations': when an apartment is deleted, the
+					# cascades may remove its counter row first, but its reservations are only subtracted from the owner
+					# once, by whichever of the two cascades (Owns / Reserves) comes second
+					"CREATE OR REPLACE FUNCTION owns_changed() RETURNS TRIGGER AS $$ "
+					"BEGIN "
+					"IF TG_OP = 'UPDATE' AND OLD.owner_id = NEW.owner_id AND OLD.apartment_id = NEW.apartment_id THEN "
+					"RETURN NULL; "
+					"END IF; "
+					"IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+					"UPDATE OwnerReservations SET reservation_count = reservation_count - "
+					"(SELECT COUNT(*) FROM Reserves WHERE apartment_id = OLD.apartment_id) "
+					"WHERE owner_id = OLD.owner_id; "
+					# an apartment that is being deleted is already gone here, apartment_location_changed took it out
+					"UPDATE OwnerLocations l SET apartment_count = l.apartment_count - 1 "
+					"FROM Apartments a "
+					"WHERE a.apartment_id = OLD.apartment_id AND l.owner_id = OLD.owner_id "
+					"AND l.city = a.city AND l.country = a.country; "
+					"DELETE FROM OwnerLocations WHERE owner_id = OLD.owner_id AND apartment_count = 0; "
+					"END IF; "
+					"IF TG_OP IN ('INSERT', 'UPDATE') THEN "
+					"UPDATE OwnerReservations SET reservation_count = reservation_count + "
+					"(SELECT COUNT(*) FROM Reserves WHERE apartment_id = NEW.apartment_id) "
+					"WHERE owner_id = NEW.owner_id; "
+					"INSERT INTO OwnerLocations(owner_id, city, country, apartment_count) "
+					"SELECT NEW.owner_id, city, country, 1 FROM Apartments WHERE apartment_id = NEW.apartment_id "
+					"ON CONFLICT (owner_id, city, country) DO UPDATE SET apartment_count = OwnerLocations.apartment_count + 1; "
+					"END IF; "
+					"RETURN NULL; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TRIGGER owns_changed AFTER INSERT OR UPDATE OR DELETE ON Owns "
+					"FOR EACH ROW EXECUTE FUNCTION owns_changed();"
+
+					# The locations (city, country) that have apartments, and the locations every owner has apartments in,
+					# each with its number of apartments (a row goes away when that drops to 0). An owner owns apartments in
+					# all the locations when it has as many 'OwnerLocations' rows as there are 'Locations' rows.
+					# 'Locations' is maintained by apartment_added and apartment_location_changed, 'OwnerLocations' by
+					# owns_changed and apartment_location_changed
+					"CREATE TABLE Locations( "
+					"city TEXT NOT NULL,"
+					"country TEXT NOT NULL,"
+					"apartment_count INTEGER NOT NULL,"
+					"PRIMARY KEY (city, country));"
+
+					"CREATE TABLE OwnerLocations( "
+					"owner_id INTEGER NOT NULL,"
+					"city TEXT NOT NULL,"
+					"country TEXT NOT NULL,"
+					"apartment_count INTEGER NOT NULL,"
+					"PRIMARY KEY (owner_id, city, country),"
+					"FOREIGN KEY (owner_id) REFERENCES Owners(owner_id) ON DELETE CASCADE);"
+
+					# Takes a deleted / moved apartment out of its old location (and its owner's), and puts a moved one in
+					# the new one. Runs BEFORE a delete, while the apartment's 'Owns' row (and its location) still exist
+					"CREATE OR REPLACE FUNCTION apartment_location_changed() RETURNS TRIGGER AS $$ "
+					"BEGIN "
+					"IF TG_OP = 'UPDATE' AND OLD.city = NEW.city AND OLD.country = NEW.country THEN "
+					"RETURN NULL; "
+					"END IF; "
+					"UPDATE Locations SET apartment_count = apartment_count - 1 "
+					"WHERE city = OLD.city AND country = OLD.country; "
+					"DELETE FROM Locations WHERE city = OLD.city AND country = OLD.country AND apartment_count = 0; "
+					"UPDATE OwnerLocations l SET apartment_count = l.apartment_count - 1 "
+					"FROM Owns ow "
+					"WHERE ow.apartment_id = OLD.apartment_id AND l.owner_id = ow.owner_id "
+					"AND l.city = OLD.city AND l.country = OLD.country; "
+					"DELETE FROM OwnerLocations l USING Owns ow "
+					"WHERE ow.apartment_id = OLD.apartment_id AND l.owner_id = ow.owner_id "
+					"AND l.city = OLD.city AND l.country = OLD.country AND l.apartment_count = 0; "
+					"IF TG_OP = 'DELETE' THEN "
+					"RETURN OLD; "
+					"END IF; "
+					"INSERT INTO Locations(city, country, apartment_count) VALUES (NEW.city, NEW.country, 1) "
+					"ON CONFLICT (city, country) DO UPDATE SET apartment_count = Locations.apartment_count + 1; "
+					"INSERT INTO OwnerLocations(owner_id, city, country, apartment_count) "
+					"SELECT owner_id, NEW.city, NEW.country, 1 FROM Owns WHERE apartment_id = NEW.apartment_id "
+					"ON CONFLICT (owner_id, city, country) DO UPDATE SET apartment_count = OwnerLocations.apartment_count + 1; "
+					"RETURN NULL; "
+					"END; $$ LANGUAGE plpgsql;"
+
+					"CREATE TRIGGER apartment_deleted_location BEFORE DELETE ON Apartments "
+					"FOR EACH ROW EXECUTE FUNCTION apartment_location_changed();"
+
+					"CREATE TRIGGER apartment_moved AFTER UPDATE OF city, country ON Apartments "
+					"FOR EACH ROW EXECUTE FUNCTION apartment_location_changed();"
+
 					# Creating this view "globally", since we need it for 'get_apartment_rating' and 'get_owner_rating' as well
 					# It returns a table with all apartments and their average rating. If an apartment doesn't have ratings - its average rating is 0.
+					# It only divides the maintained sums, so a lookup by 'id' is a primary key lookup in 'ApartmentRatings'
 					"CREATE VIEW AllApartmentsRating AS "
-					"SELECT a.apartment_id as id, COALESCE(AVG(r.rating), 0) AS rating "
-					"FROM Apartments a LEFT JOIN Reviews r ON a.apartment_id = r.apartment_id "
-					"GROUP BY a.apartment_id; ")
+					"SELECT apartment_id AS id, COALESCE(rating_sum::NUMERIC / NULLIF(rating_count, 0), 0) AS rating "
+					"FROM ApartmentRatings; "
+
+					# Secondary indexes, one per access path of the API that the primary keys don't cover:
+					# - an owner's apartments (get_owner_apartments, get_owner_rating, reservations_per_owner)
+					"CREATE INDEX owns_owner_id ON Owns(owner_id) INCLUDE (apartment_id);"
+					# - who reviewed an apartment and how (get_apartment_recommendation). A customer's own reviews are
+					#   already served by the primary key (cust_id, apartment_id)
+					"CREATE INDEX reviews_apartment_id ON Reviews(apartment_id) INCLUDE (cust_id, rating);"
+					# - an apartment's reservations (joins on apartment_id). A customer's reservations of an apartment
+					#   (customer_reviewed_apartment) are served by the primary key
+					"CREATE INDEX reserves_apartment_id ON Reserves(apartment_id);"
+					# - owners by name (reservations_per_owner's grouping, and its pages in name order)
+					"CREATE INDEX owners_owner_name ON Owners(owner_name) INCLUDE (owner_id);"
+					# - the leaderboards (get_top_customers, best_value_for_money_top), best first
+					"CREATE INDEX customer_reservations_top ON CustomerReservations(reservation_count DESC, cust_id);"
+					"CREATE INDEX apartment_reservations_value ON ApartmentReservations(value_ratio DESC, apartment_id) "
+					"WHERE value_ratio IS NOT NULL;"
+					# - apartments by location, in apartment_id order within a location (search_available_apartments' pages)
+					"CREATE INDEX apartments_city_country ON Apartments(city, country, apartment_id);")
 
 		conn.commit()
 
@@ -77,23 +627,32 @@ def create_tables():
 		print(e)
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 
+@instrumented
 def clear_tables():
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		conn.execute("TRUNCATE Owners, Apartments, Customers, Owns, Reviews, Reserves")
+		conn.execute("TRUNCATE Owners, Apartments, Customers, Owns, Reviews, Reserves, ApartmentRatings, "
+					 "CustomerSimilarity, MonthlyRevenue, ApartmentReservations, OwnerReservations, Locations, OwnerLocations, CustomerReservations")
 		conn.commit()
+		if _entity_cache is not None:
+			_entity_cache.clear()
+		if _booking_calendar is not None:
+			_booking_calendar.clear()
 
 	except Exception as e:
 		print(e)
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 
+@instrumented
 def drop_tables():
 	conn = None
 	try:
@@ -106,26 +665,49 @@ def drop_tables():
 					 "DROP TABLE IF EXISTS Customers CASCADE;"
 					 "DROP TABLE IF EXISTS Owns CASCADE;"
 					 "DROP TABLE IF EXISTS Reviews CASCADE;"
-					 "DROP TABLE IF EXISTS Reserves CASCADE;")
+					 "DROP TABLE IF EXISTS Reserves CASCADE;"
+					 "DROP TABLE IF EXISTS ApartmentRatings CASCADE;"
+					 "DROP TABLE IF EXISTS CustomerSimilarity CASCADE;"
+					 "DROP TABLE IF EXISTS MonthlyRevenue CASCADE;"
+					 "DROP TABLE IF EXISTS ApartmentReservations CASCADE;"
+					 "DROP TABLE IF EXISTS OwnerReservations CASCADE;"
+					 "DROP TABLE IF EXISTS Locations CASCADE;"
+					 "DROP TABLE IF EXISTS OwnerLocations CASCADE;"
+					 "DROP TABLE IF EXISTS CustomerReservations CASCADE;"
+
+					 "DROP FUNCTION IF EXISTS apartment_added() CASCADE;"
+					 "DROP FUNCTION IF EXISTS review_changed() CASCADE;"
+					 "DROP FUNCTION IF EXISTS reviews_similarity_changed() CASCADE;"
+					 "DROP FUNCTION IF EXISTS reserves_revenue_changed() CASCADE;"
+					 "DROP FUNCTION IF EXISTS owner_added() CASCADE;"
+					 "DROP FUNCTION IF EXISTS reserves_counters_changed() CASCADE;"
+					 "DROP FUNCTION IF EXISTS owns_changed() CASCADE;"
+					 "DROP FUNCTION IF EXISTS apartment_location_changed() CASCADE;"
+					 "DROP FUNCTION IF EXISTS refresh_value_ratios(INTEGER[]) CASCADE;")
 		conn.commit()
+		if _entity_cache is not None:
+			_entity_cache.clear()
+		if _booking_calendar is not None:
+			_booking_calendar.clear()
 
 	except Exception as e:
 		print(e)
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+
 
+Statements.register("add_owner", ("INTEGER", "TEXT"),
+					"INSERT INTO Owners(owner_id, owner_name) VALUES ($1, $2)")
 
+
+@instrumented
 def add_owner(owner: Owner) -> ReturnValue:
 	conn = None
 	try:
-		owner_id = sql.Literal(owner.get_owner_id())
-		owner_name = sql.Literal(owner.get_owner_name())
-
 		conn = Connector.DBConnector()
-		query = sql.SQL("INSERT INTO Owners(owner_id, owner_name) "
-						"VALUES ({owner_id},{owner_name})").format(owner_id=owner_id, owner_name=owner_name)
-		rows, _ = conn.execute(query)
+		rows, _ = conn.execute_prepared("add_owner", (owner.get_owner_id(), owner.get_owner_name()))
 		conn.commit()
 	except DatabaseException.NOT_NULL_VIOLATION as e:
 		return ReturnValue.BAD_PARAMS
@@ -140,36 +722,52 @@ def add_owner(owner: Owner) -> ReturnValue:
 	except Exception as e:
 		return ReturnValue.ERROR
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+	_cache_invalidate(('owner', owner.get_owner_id()))
 	return ReturnValue.OK
 
 
+Statements.register("get_owner", ("INTEGER",),
+					"SELECT * FROM Owners WHERE Owners.owner_id = $1")
+
+
+@instrumented
 def get_owner(owner_id: int) -> Owner:
+	row, epoch = _cache_lookup(('owner', owner_id))
+	if row is not EntityCache.MISS:
+		return Owner(row[0], row[1]) if row is not None else Owner.bad_owner()
+
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		_, result = conn.execute(
-			"SELECT * FROM Owners WHERE Owners.owner_id = {owner_id}".format(owner_id=owner_id))
+		_, result = conn.execute_prepared("get_owner", (owner_id,))
 		conn.commit()
 
 	except Exception as e:
 		return Owner.bad_owner()
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
-	if result.rows:
-		return Owner(result.rows[0][0], result.rows[0][1])
+	row = result.rows[0] if result.rows else None
+	_cache_store(('owner', owner_id), row, epoch)
+	if row is not None:
+		return Owner(row[0], row[1])
 	return Owner.bad_owner()
 
 
+Statements.register("delete_owner", ("INTEGER",),
+					"DELETE FROM Owners WHERE Owners.owner_id = $1")
+
+
+@instrumented
 def delete_owner(owner_id: int) -> ReturnValue:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		query = sql.SQL("DELETE FROM Owners "
-						"WHERE Owners.owner_id = {owner_id}").format(owner_id=sql.Literal(owner_id))
-		rows_effected, result = conn.execute(query)
+		rows_effected, result = conn.execute_prepared("delete_owner", (owner_id,))
 		conn.commit()
 
 	except Exception as e:
@@ -177,32 +775,33 @@ def delete_owner(owner_id: int) -> ReturnValue:
 
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	if rows_effected == 0:
 		if owner_id > 0:
 			return ReturnValue.NOT_EXISTS
 		return ReturnValue.BAD_PARAMS
 
+	_cache_invalidate(('owner', owner_id))
+	# the owner's apartments are left without an owner (the delete cascades to 'Owns')
+	_cache_invalidate_where(lambda key, row: key[0] == 'apartment_owner' and row is not None and row[0] == owner_id)
 	return ReturnValue.OK
 
 
+# 'size' is NUMERIC (and not INTEGER) so a fractional size is rounded into the column, like a literal would be
+Statements.register("add_apartment", ("INTEGER", "TEXT", "TEXT", "TEXT", "NUMERIC"),
+					"INSERT INTO Apartments(apartment_id, address, city, country, size) VALUES ($1, $2, $3, $4, $5)")
+
+
+@instrumented
 def add_apartment(apartment: Apartment) -> ReturnValue:
 	conn = None
 	try:
-		apartment_id = sql.Literal(apartment.get_id())
-		address = sql.Literal(apartment.get_address())
-		city = sql.Literal(apartment.get_city())
-		country = sql.Literal(apartment.get_country())
-		size = sql.Literal(apartment.get_size())
-
 		conn = Connector.DBConnector()
-		query = sql.SQL("INSERT INTO Apartments(apartment_id, address, city, country, size) "
-						"VALUES ({apartment_id},{address},{city},{country},{size})").format(
-			apartment_id=apartment_id,
-			address=address, city=city,
-			country=country, size=size)
-		_, _ = conn.execute(query)
+		_, _ = conn.execute_prepared("add_apartment", (apartment.get_id(), apartment.get_address(),
+													   apartment.get_city(), apartment.get_country(),
+													   apartment.get_size()))
 		conn.commit()
 	except DatabaseException.NOT_NULL_VIOLATION as e:
 		return ReturnValue.BAD_PARAMS
@@ -218,62 +817,80 @@ def add_apartment(apartment: Apartment) -> ReturnValue:
 	except Exception as e:
 		return ReturnValue.ERROR
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+	_cache_invalidate(('apartment', apartment.get_id()))
 	return ReturnValue.OK
 
 
+Statements.register("get_apartment", ("INTEGER",),
+					"SELECT * FROM Apartments A WHERE A.apartment_id = $1")
+
+
+@instrumented
 def get_apartment(apartment_id: int) -> Apartment:
+	row, epoch = _cache_lookup(('apartment', apartment_id))
+	if row is not EntityCache.MISS:
+		return Apartment(row[0], row[1], row[2], row[3], row[4]) if row is not None else Apartment.bad_apartment()
+
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		rows_effected, result = conn.execute("SELECT * FROM Apartments A WHERE A.apartment_id = {apartment_id}".format(
-			apartment_id=apartment_id))
+		rows_effected, result = conn.execute_prepared("get_apartment", (apartment_id,))
 		conn.commit()
 
 	except Exception as e:
 		return Apartment.bad_apartment()
 
 	finally:
-		conn.close()
-	if result.rows:
-		return Apartment(result.rows[0][0], result.rows[0][1], result.rows[0][2], result.rows[0][3],
-						 result.rows[0][4])
+		if conn is not None:
+			conn.close()
+	row = result.rows[0] if result.rows else None
+	_cache_store(('apartment', apartment_id), row, epoch)
+	if row is not None:
+		return Apartment(row[0], row[1], row[2], row[3], row[4])
 	return Apartment.bad_apartment()
 
 
+Statements.register("delete_apartment", ("INTEGER",),
+					"DELETE FROM Apartments A WHERE A.apartment_id = $1")
+
+
+@instrumented
 def delete_apartment(apartment_id: int) -> ReturnValue:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		query = sql.SQL("DELETE FROM Apartments A WHERE A.apartment_id = {apartment_id}".format(
-			apartment_id=apartment_id))
-		rows_effected, result = conn.execute(query)
+		rows_effected, result = conn.execute_prepared("delete_apartment", (apartment_id,))
 		conn.commit()
 
 	except Exception as e:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	if rows_effected == 0:
 		if apartment_id > 0:
 			return ReturnValue.NOT_EXISTS
 		return ReturnValue.BAD_PARAMS
 
+	_cache_invalidate(('apartment', apartment_id), ('apartment_owner', apartment_id))
+	_calendar_update(lambda calendar: calendar.remove_apartment(apartment_id))
 	return ReturnValue.OK
 
 
+Statements.register("add_customer", ("INTEGER", "TEXT"),
+					"INSERT INTO Customers(cust_id, cust_name) VALUES ($1, $2)")
+
+
+@instrumented
 def add_customer(customer: Customer) -> ReturnValue:
 	conn = None
 	try:
-		cust_id = sql.Literal(customer.get_customer_id())
-		cust_name = sql.Literal(customer.get_customer_name())
-
 		conn = Connector.DBConnector()
-		query = sql.SQL("INSERT INTO Customers(cust_id, cust_name) "
-						"VALUES ({cust_id},{cust_name})").format(cust_id=cust_id, cust_name=cust_name)
-		rows, _ = conn.execute(query)
+		rows, _ = conn.execute_prepared("add_customer", (customer.get_customer_id(), customer.get_customer_name()))
 		conn.commit()
 	except DatabaseException.NOT_NULL_VIOLATION as e:
 		return ReturnValue.BAD_PARAMS
@@ -288,73 +905,99 @@ def add_customer(customer: Customer) -> ReturnValue:
 	except Exception as e:
 		return ReturnValue.ERROR
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+	_cache_invalidate(('customer', customer.get_customer_id()))
 	return ReturnValue.OK
 
 
+Statements.register("get_customer", ("INTEGER",),
+					"SELECT * FROM Customers C WHERE C.cust_id = $1")
+
+
+@instrumented
 def get_customer(customer_id: int) -> Customer:
+	row, epoch = _cache_lookup(('customer', customer_id))
+	if row is not EntityCache.MISS:
+		return Customer(row[0], row[1]) if row is not None else Customer.bad_customer()
+
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		rows_effected, result = conn.execute(
-			"SELECT * FROM Customers C WHERE C.cust_id = {cust_id}".format(cust_id=customer_id))
+		rows_effected, result = conn.execute_prepared("get_customer", (customer_id,))
 		conn.commit()
 
 	except Exception as e:
 		return Customer.bad_customer()
 
 	finally:
-		conn.close()
-	if result.rows:
-		return Customer(result.rows[0][0], result.rows[0][1])
+		if conn is not None:
+			conn.close()
+	row = result.rows[0] if result.rows else None
+	_cache_store(('customer', customer_id), row, epoch)
+	if row is not None:
+		return Customer(row[0], row[1])
 	return Customer.bad_customer()
 
 
+Statements.register("delete_customer", ("INTEGER",),
+					"DELETE FROM Customers C WHERE C.cust_id = $1")
+
+
+@instrumented
 def delete_customer(customer_id: int) -> ReturnValue:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		query = sql.SQL("DELETE FROM Customers C "
-						"WHERE C.cust_id = {cust_id}").format(cust_id=sql.Literal(customer_id))
-		rows_effected, result = conn.execute(query)
+		rows_effected, result = conn.execute_prepared("delete_customer", (customer_id,))
 		conn.commit()
 
 	except Exception as e:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	if rows_effected == 0:
 		if customer_id > 0:
 			return ReturnValue.NOT_EXISTS
 		return ReturnValue.BAD_PARAMS
 
+	_cache_invalidate(('customer', customer_id))
+	_calendar_update(lambda calendar: calendar.remove_customer(customer_id))
 	return ReturnValue.OK
 
 
+# Overlapping is rejected by the exclusion constraint of 'Reserves' (daterange is half-open, just like OVERLAPS)
+Statements.register("customer_made_reservation", ("INTEGER", "INTEGER", "DATE", "DATE", "NUMERIC"),
+					"INSERT INTO Reserves(cust_id, apartment_id, start_date, end_date, total_price) "
+					"VALUES ($1, $2, $3, $4, $5)")
+
+
+@instrumented
 def customer_made_reservation(customer_id: int, apartment_id: int, start_date: date, end_date: date,
 							  total_price: float) -> ReturnValue:
+	ticket = _calendar_ticket()
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-
-		# A bit complicated: there isn't a FROM clause here.
-		# Basically, 'WHERE NOT EXISTS' is true when there's no overlapping, and in that case, 'select' will just create a row on the fly
-		# 'WHERE NOT EXISTS' is false when there is overlapping, and in that case the entire subquery will return an empty relation
-		rows_effected, _ = conn.execute("INSERT INTO Reserves "
-										"SELECT {customer_id},{apartment_id},'{start_date}','{end_date}',{total_price} "
-										"WHERE NOT EXISTS("
-										"SELECT 1 FROM Reserves r WHERE r.apartment_id = {apartment_id} AND (r.start_date, r.end_date) OVERLAPS ('{start_date}', '{end_date}') )"
-										.format(customer_id=customer_id, apartment_id=apartment_id,
-												start_date=start_date.strftime('%Y-%m-%d'),
-												end_date=end_date.strftime('%Y-%m-%d'), total_price=total_price))
+		if _calendar_rejects(conn, apartment_id, start_date, end_date):
+			return ReturnValue.BAD_PARAMS  # overlaps a booked stay, no need to try the insert
+		rows_effected, _ = conn.execute_prepared("customer_made_reservation",
+												 (customer_id, apartment_id, start_date, end_date, total_price))
 		conn.commit()
 
 	except DatabaseException.NOT_NULL_VIOLATION as e:
 		return ReturnValue.BAD_PARAMS
 	except DatabaseException.CHECK_VIOLATION as e:
 		return ReturnValue.BAD_PARAMS
+	except DatabaseException.EXCLUSION_VIOLATION as e:  # In case of dates overlapping
+		if _booking_calendar is not None:
+			_booking_calendar.record_missed_overlap()
+		return ReturnValue.BAD_PARAMS
+	except DatabaseException.UNIQUE_VIOLATION as e:  # Same customer, apartment and start date - overlapping as well
+		return ReturnValue.BAD_PARAMS
 	except DatabaseException.FOREIGN_KEY_VIOLATION as e:
 		return ReturnValue.NOT_EXISTS
 	except DatabaseException.ConnectionInvalid as e:
@@ -362,14 +1005,19 @@ def customer_made_reservation(customer_id: int, apartment_id: int, start_date: d
 	except Exception as e:
 		return ReturnValue.ERROR
 	finally:
-		conn.close()
-
-	if rows_effected == 0:  # In case of dates overlapping
-		return ReturnValue.BAD_PARAMS
+		if conn is not None:
+			conn.close()
 
+	_calendar_update(lambda calendar: calendar.add(apartment_id, customer_id, start_date, end_date, ticket))
 	return ReturnValue.OK
 
 
+Statements.register("customer_cancelled_reservation", ("INTEGER", "INTEGER", "DATE"),
+					"DELETE FROM Reserves "
+					"WHERE Reserves.cust_id = $1 AND Reserves.apartment_id = $2 AND Reserves.start_date = $3")
+
+
+@instrumented
 def customer_cancelled_reservation(customer_id: int, apartment_id: int, start_date: date) -> ReturnValue:
 	# If SQL will search the table for a tuple with these bad parameters, it will find nothing and return 'NOT EXISTS'
 	# And while it is true that it doesn't exist, we want to inform that those are bad parameters, so we perform this check
@@ -379,10 +1027,7 @@ def customer_cancelled_reservation(customer_id: int, apartment_id: int, start_da
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		rows_effected, _ = conn.execute("DELETE FROM Reserves "
-										"WHERE Reserves.cust_id = {customer_id} AND Reserves.apartment_id = {apartment_id} AND Reserves.start_date = '{start_date}'"
-										.format(customer_id=customer_id, apartment_id=apartment_id,
-												start_date=start_date.strftime('%Y-%m-%d')))
+		rows_effected, _ = conn.execute_prepared("customer_cancelled_reservation", (customer_id, apartment_id, start_date))
 		conn.commit()
 
 	except DatabaseException.NOT_NULL_VIOLATION as e:
@@ -397,13 +1042,26 @@ def customer_cancelled_reservation(customer_id: int, apartment_id: int, start_da
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	if rows_effected == 0:
 		return ReturnValue.NOT_EXISTS
 
+	_calendar_update(lambda calendar: calendar.remove(apartment_id, start_date))
 	return ReturnValue.OK
 
+# Same shtick as with 'customer_made_reservation()'
+# 'WHERE EXISTS' is true when there's a reservation that ended before 'review_date', and in that case, 'select' will just create a row on the fly
+# 'WHERE EXISTS' is false otherwise, and in that case the entire subquery will return an empty relation
+Statements.register("customer_reviewed_apartment", ("INTEGER", "INTEGER", "DATE", "INTEGER", "TEXT"),
+					"INSERT INTO Reviews "
+					"SELECT $1, $2, $3, $4, $5 "
+					"WHERE EXISTS("
+					"SELECT 1 FROM Reserves r WHERE r.cust_id = $1 AND r.apartment_id = $2 AND r.end_date <= $3)")
+
+
+@instrumented
 def customer_reviewed_apartment(customer_id: int, apartment_id: int, review_date: date, rating: int,
 								review_text: str) -> ReturnValue:
 	# Insert is conditional, so if condition isn't met, we might ignore BAD_PARAMS (because we didn't insert them, so we wouldn't get an exception)
@@ -414,16 +1072,8 @@ def customer_reviewed_apartment(customer_id: int, apartment_id: int, review_date
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-
-		# Same shtick as with 'customer_made_reservation()'
-		# 'WHERE EXISTS' is true when there's a reservation that ended before 'review_date', and in that case, 'select' will just create a row on the fly
-		# 'WHERE EXISTS' is false otherwise, and in that case the entire subquery will return an empty relation
-		rows_effected, _ = conn.execute("INSERT INTO Reviews "
-					 "SELECT {customer_id},{apartment_id},'{review_date}',{rating},'{review_text}' "
-					 "WHERE EXISTS("
-					 "SELECT 1 FROM Reserves r WHERE r.cust_id = {customer_id} AND r.apartment_id = {apartment_id} AND r.end_date <= '{review_date}')"
-					 .format(customer_id=customer_id, apartment_id=apartment_id,
-							 review_date=review_date.strftime('%Y-%m-%d'), rating=rating, review_text=review_text))
+		rows_effected, _ = conn.execute_prepared("customer_reviewed_apartment",
+												 (customer_id, apartment_id, review_date, rating, review_text))
 		conn.commit()
 
 	except DatabaseException.NOT_NULL_VIOLATION as e:
@@ -440,7 +1090,8 @@ def customer_reviewed_apartment(customer_id: int, apartment_id: int, review_date
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	if rows_effected:
 		return ReturnValue.OK
@@ -448,6 +1099,13 @@ def customer_reviewed_apartment(customer_id: int, apartment_id: int, review_date
 		return ReturnValue.NOT_EXISTS
 
 
+Statements.register("customer_updated_review", ("INTEGER", "INTEGER", "DATE", "INTEGER", "TEXT"),
+					"UPDATE Reviews "
+					"SET review_date = $3, rating = $4, review_text = $5 "
+					"WHERE cust_id = $1 AND apartment_id = $2 AND review_date <= $3")
+
+
+@instrumented
 def customer_updated_review(customer_id: int, apartment_id: int, update_date: date, new_rating: int,
 							new_text: str) -> ReturnValue:
 	# Same deal as with 'customer_reviewed_apartment()'
@@ -457,12 +1115,8 @@ def customer_updated_review(customer_id: int, apartment_id: int, update_date: da
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		rows_effected, _ = conn.execute("UPDATE Reviews "
-										"SET review_date = '{update_date}', rating={new_rating}, review_text='{new_text}' "
-										"WHERE cust_id={customer_id} AND apartment_id={apartment_id} AND review_date <= '{update_date}'"
-										.format(new_rating=new_rating, new_text=new_text, customer_id=customer_id,
-												apartment_id=apartment_id,
-												update_date=update_date.strftime('%Y-%m-%d')))
+		rows_effected, _ = conn.execute_prepared("customer_updated_review",
+												 (customer_id, apartment_id, update_date, new_rating, new_text))
 		conn.commit()
 
 	except DatabaseException.NOT_NULL_VIOLATION as e:
@@ -475,7 +1129,8 @@ def customer_updated_review(customer_id: int, apartment_id: int, update_date: da
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	if rows_effected == 0:
 		return ReturnValue.NOT_EXISTS
@@ -483,18 +1138,18 @@ def customer_updated_review(customer_id: int, apartment_id: int, update_date: da
 	return ReturnValue.OK
 
 
+Statements.register("owner_owns_apartment", ("INTEGER", "INTEGER"),
+					"INSERT INTO Owns(apartment_id, owner_id) "
+					"SELECT $2, $1 "
+					"WHERE EXISTS (SELECT 1 FROM Owners WHERE owner_id = $1)")
+
+
+@instrumented
 def owner_owns_apartment(owner_id: int, apartment_id: int) -> ReturnValue:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-
-		query_str = sql.SQL("INSERT INTO Owns(apartment_id,owner_id) "
-							"SELECT {apartment_id},{owner_id} "
-							"WHERE EXISTS (SELECT 1 FROM owners WHERE owner_id = {owner_id});").format(
-			apartment_id=sql.Literal(apartment_id),
-			owner_id=sql.Literal(owner_id))
-
-		rows_effected, result = conn.execute(query_str)
+		rows_effected, result = conn.execute_prepared("owner_owns_apartment", (owner_id, apartment_id))
 		conn.commit()
 	except DatabaseException.NOT_NULL_VIOLATION as e:
 		return ReturnValue.BAD_PARAMS
@@ -509,23 +1164,27 @@ def owner_owns_apartment(owner_id: int, apartment_id: int) -> ReturnValue:
 	except Exception as e:
 		return ReturnValue.ERROR
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	if rows_effected == 0:
 		if owner_id > 0:
 			return ReturnValue.NOT_EXISTS
 		return ReturnValue.BAD_PARAMS
 
+	_cache_invalidate(('apartment_owner', apartment_id))
 	return ReturnValue.OK
 
+Statements.register("owner_drops_apartment", ("INTEGER", "INTEGER"),
+					"DELETE FROM Owns WHERE Owns.owner_id = $1 AND Owns.apartment_id = $2")
+
+
+@instrumented
 def owner_drops_apartment(owner_id: int, apartment_id: int) -> ReturnValue:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		query = sql.SQL("DELETE FROM Owns "
-						"WHERE Owns.owner_id = {owner_id} AND Owns.apartment_id = {apartment_id} ").format(
-			owner_id=sql.Literal(owner_id), apartment_id=sql.Literal(apartment_id))
-		rows_effected, result = conn.execute(query)
+		rows_effected, result = conn.execute_prepared("owner_drops_apartment", (owner_id, apartment_id))
 		conn.commit()
 
 	except DatabaseException.NOT_NULL_VIOLATION as e:
@@ -538,72 +1197,527 @@ def owner_drops_apartment(owner_id: int, apartment_id: int) -> ReturnValue:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	if rows_effected == 0:
 		if owner_id > 0 and apartment_id > 0:
 			return ReturnValue.NOT_EXISTS
 		return ReturnValue.BAD_PARAMS
 
+	_cache_invalidate(('apartment_owner', apartment_id))
 	return ReturnValue.OK
 
 
+Statements.register("get_apartment_owner", ("INTEGER",),
+					"SELECT Owns.owner_id, Owners.owner_name FROM Owns, Owners "
+					"WHERE Owns.apartment_id = $1 AND Owners.owner_id = Owns.owner_id")
+
+
+@instrumented
 def get_apartment_owner(apartment_id: int) -> Owner:
+	row, epoch = _cache_lookup(('apartment_owner', apartment_id))
+	if row is not EntityCache.MISS:
+		return Owner(row[0], row[1]) if row is not None else Owner.bad_owner()
+
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		rows_effected, result = conn.execute(
-			"SELECT Owns.owner_id,Owners.owner_name FROM Owns,Owners "
-			"WHERE Owns.apartment_id = {apartment_id} AND Owners.owner_id = Owns.owner_id;".format(
-				apartment_id=apartment_id))
+		rows_effected, result = conn.execute_prepared("get_apartment_owner", (apartment_id,))
 		conn.commit()
 
 	except Exception as e:
 		return Owner.bad_owner()
 
 	finally:
-		conn.close()
-	if result.rows:
-		return Owner(result.rows[0][0], result.rows[0][1])
+		if conn is not None:
+			conn.close()
+	row = result.rows[0] if result.rows else None
+	_cache_store(('apartment_owner', apartment_id), row, epoch)
+	if row is not None:
+		return Owner(row[0], row[1])
 	return Owner.bad_owner()
 
 
+Statements.register("get_owner_apartments", ("INTEGER",),
+					"SELECT Apartments.* FROM Apartments, Owns "
+					"WHERE Owns.owner_id = $1 AND Apartments.apartment_id = Owns.apartment_id")
+
+
+@instrumented
 def get_owner_apartments(owner_id: int) -> List[Apartment]:
 	conn = None
 	apartments = []
 	try:
 		conn = Connector.DBConnector()
-		rows_effected, result = conn.execute(
-			"SELECT Apartments.* FROM Apartments, Owns "
-			"WHERE Owns.owner_id = {owner_id} AND Apartments.apartment_id = Owns.apartment_id;".format(
-				owner_id=owner_id))
+		rows_effected, result = conn.execute_prepared("get_owner_apartments", (owner_id,))
 		conn.commit()
 
 	except Exception as e:
 		return apartments
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 	# build the list of apartments.
-	for index in range(rows_effected):
-		apartments.append(
-			Apartment(result.rows[index][0], result.rows[index][1], result.rows[index][2], result.rows[index][3],
-					  result.rows[index][4]))
-	return apartments
+	return Apartment.from_rows(result.rows)
+
+
+# Same as 'get_owner_apartments()', but a generator: the apartments are read from a server-side cursor 'fetch_size' rows
+# at a time, so memory stays bounded however many apartments there are. On an error the generator just stops.
+def iter_owner_apartments(owner_id: int, fetch_size: int = Connector.DEFAULT_FETCH_SIZE) -> Iterator[Apartment]:
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		with conn.stream_prepared("get_owner_apartments", (owner_id,), fetch_size) as result:
+			for row in result.rows():
+				yield Apartment(*row)
+
+	except Exception as e:
+		return
+
+	finally:
+		if conn is not None:
+			conn.close()
+
+
+
+# Apartments in a location that are free for the whole stay [start_date, end_date) and rated at least 'min_rating'
+# (an apartment without reviews is rated 0, like in 'AllApartmentsRating'), in apartment_id order.
+# Pages are keyset pages: each one starts after the last apartment_id of the previous one, so a page is a range scan
+# of the apartments_city_country index however deep it is. Being free is an anti-join probing the GiST index of
+# the exclusion constraint of 'Reserves' (apartment_id, daterange), one range lookup per candidate apartment
+Statements.register("search_available_apartments", ("TEXT", "TEXT", "DATE", "DATE", "NUMERIC", "INTEGER", "INTEGER"),
+					"SELECT a.apartment_id, a.address, a.city, a.country, a.size "
+					"FROM Apartments a "
+					"JOIN ApartmentRatings r ON r.apartment_id = a.apartment_id "
+					"WHERE a.city = $1 AND a.country = $2 AND a.apartment_id > $6 "
+					"AND COALESCE(r.rating_sum::NUMERIC / NULLIF(r.rating_count, 0), 0) >= $5 "
+					"AND NOT EXISTS (SELECT 1 FROM Reserves rs WHERE rs.apartment_id = a.apartment_id "
+					"AND daterange(rs.start_date, rs.end_date) && daterange($3, $4)) "
+					"ORDER BY a.apartment_id "
+					"LIMIT $7")
+
+
+# One page of the search: at most 'limit' apartments, starting after the apartment_id 'after'
+# (the last id of the previous page; None for the first page)
+@instrumented
+def search_available_apartments_page(city: str, country: str, start_date: date, end_date: date, after: int = None,
+									 limit: int = 1000, min_rating: float = 0) -> List[Apartment]:
+	if start_date is None or end_date is None or end_date <= start_date:
+		return ReturnValue.BAD_PARAMS
+
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		_, result = conn.execute_prepared("search_available_apartments",
+										  (city, country, start_date, end_date, min_rating, after or 0, limit))
+		conn.commit()
+		return Apartment.from_rows(result.rows)
+
+	except Exception as e:
+		return ReturnValue.ERROR
+
+	finally:
+		if conn is not None:
+			conn.close()
+
+
+# The whole search as a generator: pages of 'page_size' apartments are read one after the other (each in its own
+# short transaction) until 'limit' apartments were yielded, or all of them if 'limit' is None.
+# On bad dates or an error the generator just stops.
+def search_available_apartments(city: str, country: str, start_date: date, end_date: date, limit: int = None,
+								min_rating: float = 0, page_size: int = 1000) -> Iterator[Apartment]:
+	if start_date is None or end_date is None or end_date <= start_date:
+		return
+
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		after = 0
+		while limit is None or limit > 0:
+			size = page_size if limit is None else min(page_size, limit)
+			_, result = conn.execute_prepared("search_available_apartments",
+											  (city, country, start_date, end_date, min_rating, after, size))
+			conn.commit()
+			for row in result.rows:
+				yield Apartment(*row)
+			if len(result.rows) < size:
+				break
+			after = result.rows[-1][0]
+			if limit is not None:
+				limit -= size
+
+	except Exception as e:
+		return
+
+	finally:
+		if conn is not None:
+			conn.close()
+
+# ---------------------------------- BULK API: ----------------------------------
+
+# Rows are streamed with COPY into a temporary staging table, chunk by chunk, and moved into the real table with a single
+# INSERT ... ON CONFLICT DO NOTHING. Rows that INSERT skipped are exactly the ones that already exist.
+# Rows that would break a NOT NULL / CHECK constraint are rejected beforehand, so they can never abort a whole chunk.
+BULK_CHUNK_SIZE = 10000
+
+
+def _positive_id(value) -> bool:
+	return type(value) is int and value > 0
+
+
+# an INTEGER column rounds what it gets, so a fractional size only passes 'size > 0' from 0.5 and up
+def _positive_size(value) -> bool:
+	if type(value) is int:
+		return value > 0
+	return isinstance(value, (float, Decimal)) and value >= 0.5
+
+
+# Split (index, row) pairs into consecutive rounds, so that no two rows in a round share a key.
+# Every row lands after all the earlier rows it shares a key with, so applying the rounds in order
+# gives the same result as applying the rows one by one.
+def _rounds(indexed_rows, key_functions) -> List[list]:
+	rounds = []
+	last_round = {}
+	for index, row in indexed_rows:
+		keys = [(position, key_function(row)) for position, key_function in enumerate(key_functions)]
+		round_number = max([last_round.get(key, -1) for key in keys]) + 1
+		for key in keys:
+			last_round[key] = round_number
+		if round_number == len(rounds):
+			rounds.append([])
+		rounds[round_number].append((index, row))
+	return rounds
+
+
+def _bulk_add(entities: Iterable, to_row, is_valid, stage_ddl: str, stage: str, columns: Tuple[str, ...],
+			  insert_query: str, key_functions, cache_kind: str, chunk_size: int) -> List[ReturnValue]:
+	results = []
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+	except Exception as e:
+		pass  # every valid row is reported as ERROR
+
+	try:
+		entities = iter(entities)
+		while True:
+			chunk = list(islice(entities, chunk_size))
+			if not chunk:
+				break
+
+			valid_rows = []
+			for index, entity in enumerate(chunk, len(results)):
+				try:
+					row = to_row(entity)
+					valid = is_valid(row)
+				except Exception as e:
+					valid = False
+				results.append(ReturnValue.ERROR if valid else ReturnValue.BAD_PARAMS)
+				if valid:
+					valid_rows.append((index, row))
+			if conn is None:
+				continue
+
+			for round_rows in _rounds(valid_rows, key_functions):
+				try:
+					conn.execute(stage_ddl, commit=False)
+					conn.copy_in(stage, columns, [row for _, row in round_rows])
+					_, inserted = conn.execute(insert_query, commit=False)
+					if Connector.current_transaction() is not None:
+						# the commit only releases a savepoint, so ON COMMIT DROP wouldn't drop it before the next round
+						conn.execute("DROP TABLE " + stage, commit=False)
+					conn.commit()
+				except Exception as e:
+					try:
+						conn.rollback()
+					except DatabaseException.ConnectionInvalid as e:
+						pass
+					continue  # the round's rows stay ERROR
+
+				# 'insert_query' returns the primary key of every row it inserted
+				inserted_keys = set(inserted.rows)
+				for index, row in round_rows:
+					results[index] = ReturnValue.OK if (row[0],) in inserted_keys else ReturnValue.ALREADY_EXISTS
+				_cache_invalidate(*[(cache_kind, key) for key, in inserted_keys])
+
+	finally:
+		if conn is not None:
+			conn.close()
+	return results
+
+
+@instrumented
+def add_owners(owners: Iterable[Owner], chunk_size: int = BULK_CHUNK_SIZE) -> List[ReturnValue]:
+	return _bulk_add(owners,
+					 lambda owner: (owner.get_owner_id(), owner.get_owner_name()),
+					 lambda row: _positive_id(row[0]) and row[1] is not None,
+					 "CREATE TEMP TABLE owners_stage (owner_id INTEGER, owner_name TEXT) ON COMMIT DROP",
+					 "owners_stage", ("owner_id", "owner_name"),
+					 "INSERT INTO Owners(owner_id, owner_name) "
+					 "SELECT owner_id, owner_name FROM owners_stage "
+					 "ON CONFLICT DO NOTHING RETURNING owner_id",
+					 (itemgetter(0),), 'owner', chunk_size)
+
+
+@instrumented
+def add_apartments(apartments: Iterable[Apartment], chunk_size: int = BULK_CHUNK_SIZE) -> List[ReturnValue]:
+	return _bulk_add(apartments,
+					 lambda apartment: (apartment.get_id(), apartment.get_address(), apartment.get_city(),
+										apartment.get_country(), apartment.get_size()),
+					 lambda row: _positive_id(row[0]) and None not in row[1:4] and _positive_size(row[4]),
+					 # 'size' is staged as NUMERIC and rounded by the INSERT, like add_apartment does
+					 "CREATE TEMP TABLE apartments_stage (apartment_id INTEGER, address TEXT, city TEXT, country TEXT, "
+					 "size NUMERIC) ON COMMIT DROP",
+					 "apartments_stage", ("apartment_id", "address", "city", "country", "size"),
+					 "INSERT INTO Apartments(apartment_id, address, city, country, size) "
+					 "SELECT apartment_id, address, city, country, size FROM apartments_stage "
+					 "ON CONFLICT DO NOTHING RETURNING apartment_id",
+					 # an apartment clashes with another one on its id, or on its address
+					 (itemgetter(0), itemgetter(1, 2, 3)), 'apartment', chunk_size)
+
+
+@instrumented
+def add_customers(customers: Iterable[Customer], chunk_size: int = BULK_CHUNK_SIZE) -> List[ReturnValue]:
+	return _bulk_add(customers,
+					 lambda customer: (customer.get_customer_id(), customer.get_customer_name()),
+					 lambda row: _positive_id(row[0]) and row[1] is not None,
+					 "CREATE TEMP TABLE customers_stage (cust_id INTEGER, cust_name TEXT) ON COMMIT DROP",
+					 "customers_stage", ("cust_id", "cust_name"),
+					 "INSERT INTO Customers(cust_id, cust_name) "
+					 "SELECT cust_id, cust_name FROM customers_stage "
+					 "ON CONFLICT DO NOTHING RETURNING cust_id",
+					 (itemgetter(0),), 'customer', chunk_size)
+
+
+# Reservations, cancellations and reviews in batches: every chunk goes out as one statement over a VALUES list of the
+# rows (tagged with their index), which applies the rows in index order and answers with the status of every row.
+# The rules are the ones of the single-row functions; what SQL would reject for the whole statement (NOT NULL / CHECK)
+# is rejected beforehand, and what depends on other rows (overlaps, duplicates) is decided inside the statement.
+def _batch_write(rows: Iterable, is_valid, query: str, template: str, key_functions, chunk_size: int) -> List[ReturnValue]:
+	results = []
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+	except Exception as e:
+		pass  # every valid row is reported as ERROR
+
+	try:
+		rows = iter(rows)
+		while True:
+			chunk = list(islice(rows, chunk_size))
+			if not chunk:
+				break
+
+			valid_rows = []
+			for index, row in enumerate(chunk, len(results)):
+				try:
+					row = tuple(row)
+					valid = is_valid(row)
+				except Exception as e:
+					valid = False
+				results.append(ReturnValue.ERROR if valid else ReturnValue.BAD_PARAMS)
+				if valid:
+					valid_rows.append((index, row))
+			if conn is None or not valid_rows:
+				continue
+
+			rounds = _rounds(valid_rows, key_functions) if key_functions else [valid_rows]
+			for round_rows in rounds:
+				try:
+					_, statuses = conn.execute_values(query, [(index,) + row for index, row in round_rows], template,
+													  commit=False)
+					conn.commit()
+				except Exception as e:
+					try:
+						conn.rollback()
+					except DatabaseException.ConnectionInvalid as e:
+						pass
+					continue  # the round's rows stay ERROR
+
+				for index, status in statuses.rows:
+					results[index] = ReturnValue[status]
+
+	finally:
+		if conn is not None:
+			conn.close()
+	return results
+
+
+def _is_date(value) -> bool:
+	return isinstance(value, date)
+
+
+# The statement inserts in index order, and ON CONFLICT DO NOTHING (no target: the primary key and the exclusion
+# constraint alike) skips a row that overlaps a reservation, including one inserted earlier by the same statement.
+# A skipped row is NOT_EXISTS when its apartment is missing, or its customer is and nothing overlaps it
+# (that is what the foreign key would have said), and BAD_PARAMS otherwise.
+_RESERVATIONS_BATCH = ("WITH input(idx, cust_id, apartment_id, start_date, end_date, total_price) AS (VALUES %s), "
+					   "inserted AS ("
+					   "INSERT INTO Reserves(cust_id, apartment_id, start_date, end_date, total_price) "
+					   "SELECT cust_id, apartment_id, start_date, end_date, total_price FROM input i "
+					   "WHERE EXISTS (SELECT 1 FROM Customers c WHERE c.cust_id = i.cust_id) "
+					   "AND EXISTS (SELECT 1 FROM Apartments a WHERE a.apartment_id = i.apartment_id) "
+					   "ORDER BY idx "
+					   "ON CONFLICT DO NOTHING "
+					   "RETURNING cust_id, apartment_id, start_date, end_date), "
+					   # a rejected row can't precede an identical accepted one, so the first match is the inserted row
+					   "applied AS ("
+					   "SELECT MIN(i.idx) AS idx, i.apartment_id, i.start_date, i.end_date "
+					   "FROM input i JOIN inserted USING (cust_id, apartment_id, start_date, end_date) "
+					   "GROUP BY i.cust_id, i.apartment_id, i.start_date, i.end_date) "
+					   "SELECT i.idx, CASE "
+					   "WHEN EXISTS (SELECT 1 FROM applied WHERE applied.idx = i.idx) THEN 'OK' "
+					   "WHEN NOT EXISTS (SELECT 1 FROM Apartments a WHERE a.apartment_id = i.apartment_id) "
+					   "THEN 'NOT_EXISTS' "
+					   "WHEN NOT EXISTS (SELECT 1 FROM Customers c WHERE c.cust_id = i.cust_id) "
+					   "AND NOT EXISTS (SELECT 1 FROM Reserves r WHERE r.apartment_id = i.apartment_id "
+					   "AND daterange(r.start_date, r.end_date) && daterange(i.start_date, i.end_date)) "
+					   "AND NOT EXISTS (SELECT 1 FROM applied a WHERE a.idx < i.idx AND a.apartment_id = i.apartment_id "
+					   "AND daterange(a.start_date, a.end_date) && daterange(i.start_date, i.end_date)) "
+					   "THEN 'NOT_EXISTS' "
+					   "ELSE 'BAD_PARAMS' END "
+					   "FROM input i")
+
+
+# 'reservations' are (customer_id, apartment_id, start_date, end_date, total_price) tuples
+@instrumented
+def customers_made_reservations(reservations: Iterable[Tuple[int, int, date, date, float]],
+								chunk_size: int = BULK_CHUNK_SIZE) -> List[ReturnValue]:
+	ticket = _calendar_ticket()
+	if ticket is not None:
+		reservations = list(reservations)
+	results = _batch_write(reservations,
+						   lambda row: len(row) == 5 and _positive_id(row[0]) and _positive_id(row[1]) and
+									   _is_date(row[2]) and _is_date(row[3]) and row[3] > row[2] and _positive_size(row[4]),
+						   _RESERVATIONS_BATCH, "(%s, %s::INTEGER, %s::INTEGER, %s::DATE, %s::DATE, %s::NUMERIC)",
+						   None, chunk_size)
+	if ticket is not None:
+		booked = [tuple(row) for row, result in zip(reservations, results) if result == ReturnValue.OK]
+
+		def book(calendar: BookingCalendar):
+			for customer_id, apartment_id, start_date, end_date, _ in booked:
+				calendar.add(apartment_id, customer_id, start_date, end_date, ticket)
+		_calendar_update(book)
+	return results
+
+
+# the same reservation can be listed twice, only its first row cancels it
+_CANCELLATIONS_BATCH = ("WITH input(idx, cust_id, apartment_id, start_date) AS (VALUES %s), "
+						"deleted AS ("
+						"DELETE FROM Reserves r USING input i "
+						"WHERE r.cust_id = i.cust_id AND r.apartment_id = i.apartment_id AND r.start_date = i.start_date "
+						"RETURNING r.cust_id, r.apartment_id, r.start_date), "
+						"applied AS ("
+						"SELECT MIN(i.idx) AS idx FROM input i JOIN deleted USING (cust_id, apartment_id, start_date) "
+						"GROUP BY i.cust_id, i.apartment_id, i.start_date) "
+						"SELECT i.idx, CASE WHEN i.idx IN (SELECT idx FROM applied) THEN 'OK' ELSE 'NOT_EXISTS' END "
+						"FROM input i")
+
+
+# 'cancellations' are (customer_id, apartment_id, start_date) tuples
+@instrumented
+def customers_cancelled_reservations(cancellations: Iterable[Tuple[int, int, date]],
+									 chunk_size: int = BULK_CHUNK_SIZE) -> List[ReturnValue]:
+	if _booking_calendar is not None:
+		cancellations = list(cancellations)
+	results = _batch_write(cancellations,
+						   lambda row: len(row) == 3 and _positive_id(row[0]) and _positive_id(row[1]),
+						   _CANCELLATIONS_BATCH, "(%s, %s::INTEGER, %s::INTEGER, %s::DATE)", None, chunk_size)
+	if _booking_calendar is not None:
+		cancelled = [tuple(row) for row, result in zip(cancellations, results) if result == ReturnValue.OK]
+
+		def cancel(calendar: BookingCalendar):
+			for _, apartment_id, start_date in cancelled:
+				calendar.remove(apartment_id, start_date)
+		_calendar_update(cancel)
+	return results
+
+
+# Only a customer whose reservation of the apartment ended by 'review_date' may review it (otherwise NOT_EXISTS).
+# A review without a text is BAD_PARAMS once it is eligible, and of the rows of one (customer, apartment)
+# the first that gets in wins, the later ones are ALREADY_EXISTS.
+_REVIEWS_BATCH = ("WITH input(idx, cust_id, apartment_id, review_date, rating, review_text) AS (VALUES %s), "
+				  "checked AS ("
+				  "SELECT i.*, EXISTS(SELECT 1 FROM Reserves r WHERE r.cust_id = i.cust_id "
+				  "AND r.apartment_id = i.apartment_id AND r.end_date <= i.review_date) AS eligible "
+				  "FROM input i), "
+				  "inserted AS ("
+				  "INSERT INTO Reviews(cust_id, apartment_id, review_date, rating, review_text) "
+				  "SELECT cust_id, apartment_id, review_date, rating, review_text FROM checked "
+				  "WHERE eligible AND review_text IS NOT NULL "
+				  "ORDER BY idx "
+				  "ON CONFLICT DO NOTHING "
+				  "RETURNING cust_id, apartment_id), "
+				  "applied AS ("
+				  "SELECT MIN(c.idx) AS idx FROM checked c JOIN inserted USING (cust_id, apartment_id) "
+				  "WHERE c.eligible AND c.review_text IS NOT NULL "
+				  "GROUP BY c.cust_id, c.apartment_id) "
+				  "SELECT idx, CASE "
+				  "WHEN NOT eligible THEN 'NOT_EXISTS' "
+				  "WHEN review_text IS NULL THEN 'BAD_PARAMS' "
+				  "WHEN idx IN (SELECT idx FROM applied) THEN 'OK' "
+				  "ELSE 'ALREADY_EXISTS' END "
+				  "FROM checked")
+
+
+def _is_rating(value) -> bool:
+	return type(value) is int and 1 <= value <= 10
+
+
+# 'reviews' are (customer_id, apartment_id, review_date, rating, review_text) tuples
+@instrumented
+def customers_reviewed_apartments(reviews: Iterable[Tuple[int, int, date, int, str]],
+								  chunk_size: int = BULK_CHUNK_SIZE) -> List[ReturnValue]:
+	return _batch_write(reviews,
+						lambda row: len(row) == 5 and _positive_id(row[0]) and _positive_id(row[1]) and
+									_is_rating(row[3]),
+						_REVIEWS_BATCH, "(%s, %s::INTEGER, %s::INTEGER, %s::DATE, %s::INTEGER, %s::TEXT)",
+						None, chunk_size)
+
+
+# An update applies when the review exists and is not newer than 'update_date'. Updates of the same review are split
+# into rounds (one statement each), since each one moves the review's date that the next one is compared with
+_REVIEW_UPDATES_BATCH = ("WITH input(idx, cust_id, apartment_id, update_date, rating, review_text) AS (VALUES %s), "
+						 "updated AS ("
+						 "UPDATE Reviews r SET review_date = i.update_date, rating = i.rating, review_text = i.review_text "
+						 "FROM input i "
+						 "WHERE r.cust_id = i.cust_id AND r.apartment_id = i.apartment_id "
+						 "AND r.review_date <= i.update_date AND i.review_text IS NOT NULL "
+						 "RETURNING i.idx) "
+						 "SELECT i.idx, CASE "
+						 "WHEN i.idx IN (SELECT idx FROM updated) THEN 'OK' "
+						 "WHEN EXISTS (SELECT 1 FROM Reviews r WHERE r.cust_id = i.cust_id "
+						 "AND r.apartment_id = i.apartment_id AND r.review_date <= i.update_date) THEN 'BAD_PARAMS' "
+						 "ELSE 'NOT_EXISTS' END "
+						 "FROM input i")
+
+
+# 'updates' are (customer_id, apartment_id, update_date, new_rating, new_text) tuples
+@instrumented
+def customers_updated_reviews(updates: Iterable[Tuple[int, int, date, int, str]],
+							  chunk_size: int = BULK_CHUNK_SIZE) -> List[ReturnValue]:
+	return _batch_write(updates,
+						lambda row: len(row) == 5 and _positive_id(row[0]) and _positive_id(row[1]) and
+									_is_rating(row[3]),
+						_REVIEW_UPDATES_BATCH, "(%s, %s::INTEGER, %s::INTEGER, %s::DATE, %s::INTEGER, %s::TEXT)",
+						(itemgetter(0, 1),), chunk_size)
 
 
 # ---------------------------------- BASIC API: ----------------------------------
 
+Statements.register("get_apartment_rating", ("INTEGER",),
+					"SELECT rating FROM AllApartmentsRating WHERE id = $1")
+
+
+@instrumented
 def get_apartment_rating(apartment_id: int) -> float:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-
-		# In each function call, we drop the view from last function call (if exists), and create a new one to use
-		rows_affected, result = conn.execute("SELECT rating "
-								 "FROM AllApartmentsRating "
-								 "WHERE id = {apartment_id} ".format(apartment_id=apartment_id))
+		rows_affected, result = conn.execute_prepared("get_apartment_rating", (apartment_id,))
 
 		conn.commit()
 		return result[0]['rating']
@@ -612,17 +1726,22 @@ def get_apartment_rating(apartment_id: int) -> float:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+
+Statements.register("get_owner_rating", ("INTEGER",),
+					"SELECT COALESCE(AVG(rating), 0) AS average_rating "
+					"FROM AllApartmentsRating AAR JOIN Owns o ON AAR.id = o.apartment_id "
+					"WHERE o.owner_id = $1")
 
+
+@instrumented
 def get_owner_rating(owner_id: int) -> float:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
 
-		_, result = conn.execute(
-								 "SELECT COALESCE(AVG(rating), 0) AS average_rating "
-								 "FROM AllApartmentsRating AAR JOIN Owns o ON AAR.id = o.apartment_id "
-								 "WHERE o.owner_id = {owner_id}; ".format(owner_id=owner_id))
+		_, result = conn.execute_prepared("get_owner_rating", (owner_id,))
 
 		conn.commit()
 		return result[0]['average_rating']
@@ -631,27 +1750,33 @@ def get_owner_rating(owner_id: int) -> float:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+
+
+# The customers by number of reservations, read from 'CustomerReservations' (only customers with reservations have a row):
+# First by the count in descending order (so bigger is first), and if there's a tie - then by 'cust_id' in ascending order
+# (so smaller is first). Both come straight from the customer_reservations_top index, so taking the first 'k' rows
+# is an index range scan
 
+# Minor tidbit: 'CustomerReservations' only gives us 'cust_id', but we need 'cust_name' as well;
+# so we join with 'Customers' on the returned 'cust_id'
+_TOP_CUSTOMERS = ("SELECT c.cust_id, c.cust_name "
+				  "FROM CustomerReservations r "
+				  "JOIN Customers c ON c.cust_id = r.cust_id "
+				  "ORDER BY r.reservation_count DESC, r.cust_id ")
 
+Statements.register("get_top_customer", (), _TOP_CUSTOMERS + "LIMIT 1")
+
+Statements.register("get_top_customers", ("INTEGER",), _TOP_CUSTOMERS + "LIMIT $1")
+
+
+@instrumented
 def get_top_customer() -> Customer:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		# We group 'Reserves' by 'cust_id', and then sort it:
-		# First by group's count in descending order (so bigger is first), and if there's a tie - then by 'cust_id' in ascending order (so smaller is first)
-		# Then we limit only to the first tuple (we only want the top customer)
-
-		# Minor tidbit: 'Reserves' only gives us 'cust_id', but we need 'cust_name' as well;
-		# so we query in 'Customers' using the returned 'cust_id' from the subquery
-		_, result = conn.execute("SELECT cust_id, cust_name "
-								 "FROM Customers as c "
-								 "WHERE c.cust_id = "
-								 "(SELECT cust_id "
-								 "FROM Reserves "
-								 "GROUP BY cust_id "
-								 "ORDER BY COUNT(*) DESC, cust_id "
-								 "LIMIT 1)")
+		_, result = conn.execute_prepared("get_top_customer")
 		conn.commit()
 
 		return Customer(result[0]['cust_id'], result[0]['cust_name'])
@@ -660,19 +1785,63 @@ def get_top_customer() -> Customer:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+
+
+# The 'k' customers with the most reservations, best first (same order as 'get_top_customer()')
+@instrumented
+def get_top_customers(k: int) -> List[Customer]:
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		_, result = conn.execute_prepared("get_top_customers", (k,))
+		conn.commit()
+		return Customer.from_rows(result.rows)
 
+	except Exception as e:
+		return ReturnValue.ERROR
 
+	finally:
+		if conn is not None:
+			conn.close()
+
+
+# We want num_of_reservations for *all* owners, not just ones with actual reservations.
+# Every owner has a row in 'OwnerReservations' (with its maintained count), so this is a scan of 'Owners' and a
+# primary key join, whatever the size of 'Reserves'. Owners that share a name are still reported together
+Statements.register("reservations_per_owner", (),
+					"SELECT o.owner_name, SUM(c.reservation_count) AS numberOfReservations "
+					"FROM Owners o "
+					"JOIN OwnerReservations c ON o.owner_id = c.owner_id "
+					"GROUP BY o.owner_name")
+
+# Pages of the same report in owner_name order (keyset pagination, served by the owners_owner_name index):
+# the first page, and the page after a given owner_name
+Statements.register("reservations_per_owner_first_page", ("INTEGER",),
+					"SELECT o.owner_name, SUM(c.reservation_count) AS numberOfReservations "
+					"FROM Owners o "
+					"JOIN OwnerReservations c ON o.owner_id = c.owner_id "
+					"GROUP BY o.owner_name "
+					"ORDER BY o.owner_name "
+					"LIMIT $1")
+
+Statements.register("reservations_per_owner_next_page", ("TEXT", "INTEGER"),
+					"SELECT o.owner_name, SUM(c.reservation_count) AS numberOfReservations "
+					"FROM Owners o "
+					"JOIN OwnerReservations c ON o.owner_id = c.owner_id "
+					"WHERE o.owner_name > $1 "
+					"GROUP BY o.owner_name "
+					"ORDER BY o.owner_name "
+					"LIMIT $2")
+
+
+@instrumented
 def reservations_per_owner() -> List[Tuple[str, int]]:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		# We want num_of_reservations for *all* owners, not just ones with actual reservations.
-		_, result = conn.execute("SELECT o.owner_name, COALESCE(COUNT(r.apartment_id), 0) AS numberOfReservations "
-								 "FROM Owners o "
-								 "LEFT JOIN Owns ow ON o.owner_id = ow.owner_id "
-								 "LEFT JOIN Reserves r ON ow.apartment_id = r.apartment_id "
-								 "GROUP BY o.owner_name;")
+		_, result = conn.execute_prepared("reservations_per_owner")
 		conn.commit()
 
 
@@ -682,198 +1851,309 @@ def reservations_per_owner() -> List[Tuple[str, int]]:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 
-# ---------------------------------- ADVANCED API: ----------------------------------
+# One page of 'reservations_per_owner()': at most 'limit' (owner_name, number of reservations) tuples, in owner_name order,
+# starting after the owner_name 'after' (the last name of the previous page; None for the first page)
+@instrumented
+def reservations_per_owner_page(after: str = None, limit: int = 1000) -> List[Tuple[str, int]]:
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		if after is None:
+			_, result = conn.execute_prepared("reservations_per_owner_first_page", (limit,))
+		else:
+			_, result = conn.execute_prepared("reservations_per_owner_next_page", (after, limit))
+		conn.commit()
+		return result.rows
 
-def get_all_location_owners() -> List[Owner]:
+	except Exception as e:
+		return ReturnValue.ERROR
+
+	finally:
+		if conn is not None:
+			conn.close()
+
+
+# Same as 'reservations_per_owner()', but a generator of (owner_name, number of reservations) tuples that are read from
+# a server-side cursor 'fetch_size' rows at a time. On an error the generator just stops.
+def iter_reservations_per_owner(fetch_size: int = Connector.DEFAULT_FETCH_SIZE) -> Iterator[Tuple[str, int]]:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
+		with conn.stream_prepared("reservations_per_owner", (), fetch_size) as result:
+			yield from result.rows()
+
+	except Exception as e:
+		return
+
+	finally:
+		if conn is not None:
+			conn.close()
 
-		rows_effected, result = conn.execute(
-			"DROP VIEW IF EXISTS AllCityCountryCombinations CASCADE; "
-			"DROP VIEW IF EXISTS CityCountryPerOwner CASCADE;"
 
-			"CREATE VIEW AllCityCountryCombinations AS "
-			"SELECT DISTINCT city, country "
-			"FROM Apartments; "
+# ---------------------------------- ADVANCED API: ----------------------------------
+
+# The advanced queries used to DROP and CREATE their helper views on every call, which takes exclusive locks on the
+# catalog and serializes concurrent callers. The helpers are CTEs now, so every query is a single read-only SELECT
+# that can be prepared like the rest.
+# With Utility.PlanCapture enabled, each call also captures that SELECT's EXPLAIN ANALYZE plan for inspection / diffing.
 
-			"CREATE VIEW CityCountryPerOwner AS "
-			"SELECT Owns.owner_id, Apartments.city, Apartments.country "
-			"FROM Apartments "
-			"JOIN Owns ON Apartments.apartment_id = Owns.apartment_id;"
+# Relational division over the maintained location counts: the owners with an 'OwnerLocations' row for every location.
+# No owner qualifies while there are no apartments at all
+Statements.register("get_all_location_owners", (),
+					"SELECT o.owner_id, o.owner_name "
+					"FROM OwnerLocations ol "
+					"JOIN Owners o ON ol.owner_id = o.owner_id "
+					"GROUP BY o.owner_id, o.owner_name "
+					"HAVING COUNT(*) = (SELECT COUNT(*) FROM Locations)")
 
-			"SELECT ccpo.owner_id, o.owner_name "
-			"FROM CityCountryPerOwner ccpo "
-			"JOIN Owners o ON ccpo.owner_id = o.owner_id "
-			"WHERE (ccpo.city, ccpo.country) IN (SELECT city, country FROM AllCityCountryCombinations) "
-			"GROUP BY ccpo.owner_id, o.owner_name "
-			"HAVING COUNT(DISTINCT ccpo.city || ', ' || ccpo.country) = (SELECT COUNT(*) FROM AllCityCountryCombinations); ")
 
+@instrumented
+def get_all_location_owners() -> List[Owner]:
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		rows_effected, result = conn.execute_prepared("get_all_location_owners")
 		conn.commit()
+		if PlanCapture.enabled:
+			PlanCapture.capture(conn, "get_all_location_owners", "get_all_location_owners")
 
 		# JUST convert the result from ResultSet to list
-		list_to_ret = []
-		for index in range(rows_effected):
-			list_to_ret.append(Owner(result.rows[index][0],result.rows[index][1]))
-		return list_to_ret
+		return Owner.from_rows(result.rows)
 
 	except Exception as e:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+
 
+# The apartments by average rating / average nightly cost, both maintained in 'ApartmentReservations' (only apartments
+# with reservations have a ratio), ties broken by apartment_id. The apartment_reservations_value index gives them in
+# this order, so the first 'k' are an index range scan
+_BEST_VALUE_FOR_MONEY = ("SELECT a.apartment_id, a.address, a.city, a.country, a.size, v.value_ratio AS review_cost_ratio "
+						 "FROM ApartmentReservations v "
+						 "JOIN Apartments a ON v.apartment_id = a.apartment_id "
+						 "WHERE v.value_ratio IS NOT NULL "
+						 "ORDER BY v.value_ratio DESC, v.apartment_id ")
 
+Statements.register("best_value_for_money", (), _BEST_VALUE_FOR_MONEY + "LIMIT 1")
+
+Statements.register("best_value_for_money_top", ("INTEGER",), _BEST_VALUE_FOR_MONEY + "LIMIT $1")
+
+
+@instrumented
 def best_value_for_money() -> Apartment:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
-		rows_effected, result = conn.execute(
-			"DROP VIEW IF EXISTS AverageRatingPerApartment CASCADE; "
-			"DROP VIEW IF EXISTS AverageCostPerApartment CASCADE;"
-
-			"CREATE VIEW AverageRatingPerApartment AS "
-			"SELECT apartment_id, AVG(rating) avg_rating "
-			"FROM Reviews "
-			"GROUP BY apartment_id;"
+		rows_effected, result = conn.execute_prepared("best_value_for_money")
+		conn.commit()
+		if PlanCapture.enabled:
+			PlanCapture.capture(conn, "best_value_for_money", "best_value_for_money")
+		return Apartment(result.rows[0][0],result.rows[0][1],result.rows[0][2],result.rows[0][3],result.rows[0][4]) if rows_effected else Apartment.bad_apartment()
 
-			"CREATE VIEW AverageCostPerApartment AS "
-			"SELECT apartment_id, AVG(total_price / (end_date - start_date)) avg_cost "
-			"FROM Reserves "
-			"GROUP BY apartment_id;"
+	except Exception as e:
+		return ReturnValue.ERROR
 
-			"SELECT c.apartment_id, a.address, a.city, a.country, a.size, COALESCE(r.avg_rating, 0) / c.avg_cost AS review_cost_ratio "
-			"FROM AverageCostPerApartment c "
-			"LEFT JOIN AverageRatingPerApartment r ON c.apartment_id = r.apartment_id "
-			"JOIN Apartments a ON c.apartment_id = a.apartment_id "
-			"ORDER BY review_cost_ratio DESC "
-			"LIMIT 1; "
+	finally:
+		if conn is not None:
+			conn.close()
 
-		)
 
+# The 'k' apartments with the best value for money, best first (same order as 'best_value_for_money()')
+@instrumented
+def best_value_for_money_top(k: int) -> List[Apartment]:
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		_, result = conn.execute_prepared("best_value_for_money_top", (k,))
 		conn.commit()
-		return Apartment(result.rows[0][0],result.rows[0][1],result.rows[0][2],result.rows[0][3],result.rows[0][4]) if rows_effected else Apartment.bad_apartment()
+		if PlanCapture.enabled:
+			PlanCapture.capture(conn, "best_value_for_money_top", "best_value_for_money_top", (k,))
+		return [Apartment(*row[:5]) for row in result.rows]
 
 	except Exception as e:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
+
+
+# Every month of the year appears in the result (with 0 when nothing ended in it), hence the LEFT OUTER JOIN of all 12 months
+# with the year's rows of 'MonthlyRevenue'
+Statements.register("profit_per_month", ("INTEGER",),
+					"SELECT m.month, CAST(0.15 * COALESCE(r.revenue_sum, 0) AS FLOAT) "
+					"FROM generate_series(1, 12) AS m(month) "
+					"LEFT OUTER JOIN MonthlyRevenue r ON r.year = $1 AND r.month = m.month "
+					"ORDER BY m.month")
 
 
-# Note to self: in a transaction (bunch of statements) PostgreSQL returns the return value of the last statement
-# So if the last statement is 'COMMIT', it will return its return value, which is an *empty table*.
-# Also, we don't even need to write 'COMMIT' anyway, it is done automatically by the 'DBConnector' class
+@instrumented
 def profit_per_month(year: int) -> List[Tuple[int, float]]:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
+		_, result = conn.execute_prepared("profit_per_month", (year,))
+		conn.commit()
+		if PlanCapture.enabled:
+			PlanCapture.capture(conn, "profit_per_month", "profit_per_month", (year,))
+		return result.rows
+
+	except Exception as e:
+		return ReturnValue.ERROR
+
+	finally:
+		if conn is not None:
+			conn.close()
+
 
-		# In each function call, we drop the view from last function call (if exists), and create a new one to use
-		_, result = conn.execute("DROP VIEW IF EXISTS MonthsView CASCADE;"
-								 "DROP VIEW IF EXISTS ApartmentsInYear CASCADE; "
-
-								 "CREATE VIEW MonthsView AS "
-                                "SELECT 1 AS MonthNumber "
-                                "UNION ALL "
-                                "SELECT 2 "
-                                "UNION ALL "
-                                "SELECT 3 "
-                                "UNION ALL "
-                                "SELECT 4 "
-                                "UNION ALL "
-                                "SELECT 5 "
-                                "UNION ALL "
-                                "SELECT 6 "
-                                "UNION ALL "
-                                "SELECT 7 "
-                                "UNION ALL "
-                                "SELECT 8 "
-                                "UNION ALL "
-                                "SELECT 9 "
-                                "UNION ALL "
-                                "SELECT 10 "
-                                "UNION ALL "
-                                "SELECT 11 "
-                                "UNION ALL "
-                                "SELECT 12; "
-
-                                 "CREATE VIEW ApartmentsInYear AS "
-                                 "SELECT total_price, EXTRACT(MONTH FROM (end_date)) AS month "
-                                 "FROM Reserves "
-                                 "WHERE {year} = EXTRACT(YEAR FROM (end_date)); "
-
-                                 "SELECT MonthNumber, CAST(0.15*(SUM(COALESCE(total_price,0))) AS FLOAT) "
-                                 "FROM ApartmentsInYear AIY "
-                                 "RIGHT OUTER JOIN MonthsView NV ON AIY.month = NV.MonthNumber "
-                                 "GROUP BY MonthNumber " 
-                                 "ORDER BY MonthNumber; ".format(year=year))
+# Every month of every year from 'start_year' to 'end_year' (inclusive), in order
+Statements.register("profit_per_month_range", ("INTEGER", "INTEGER"),
+					"SELECT y.year, m.month, CAST(0.15 * COALESCE(r.revenue_sum, 0) AS FLOAT) "
+					"FROM generate_series($1, $2) AS y(year) "
+					"CROSS JOIN generate_series(1, 12) AS m(month) "
+					"LEFT OUTER JOIN MonthlyRevenue r ON r.year = y.year AND r.month = m.month "
+					"ORDER BY y.year, m.month")
 
+
+# Same as 'profit_per_month()' for a range of years: (year, month, profit) tuples, read from the monthly rollup, so the cost
+# only depends on the number of months
+@instrumented
+def profit_per_month_range(start_year: int, end_year: int) -> List[Tuple[int, int, float]]:
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		_, result = conn.execute_prepared("profit_per_month_range", (start_year, end_year))
 		conn.commit()
+		if PlanCapture.enabled:
+			PlanCapture.capture(conn, "profit_per_month_range", "profit_per_month_range", (start_year, end_year))
 		return result.rows
 
 	except Exception as e:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
+		if conn is not None:
+			conn.close()
 
 
 # GOD FUCKING DAMMIT A CUSTOMER CAN ONLY REVIEW AN APARTMENT *ONCE* THIS CHANGES EVERYTHING AAAAAAAAAAAAAAAAAAAAAAAA (i luv snakes)
+# The averages of the ratios of every other customer to 'customer_id' are read from 'CustomerSimilarity' (maintained
+# on every review write) instead of being computed by joining 'Reviews' with itself. The customer itself isn't in there:
+# it only reviewed apartments the recommendation leaves out anyway
+_RECOMMENDATION_APPROXIMATIONS = (
+					"WITH averageRatioPerCustomer AS ("
+					"SELECT other_cust_id AS cust_id, ratio_sum / ratio_count AS average_ratio "
+					"FROM CustomerSimilarity "
+					"WHERE cust_id = $1), "
+
+					# Here's where the magic happens - we join 'Reviews' with 'averageRatioPerCustomer' based on 'cust_id',
+					# and take only tuples that DON'T include apartments that 'customer_id' reviewed
+					# Then, we group by 'apartment_id' (becuase multiple approximations can occur),
+					# and calculate the approximation for each apartment
+					"approximationPerApartment AS ("
+					"SELECT apartment_id, AVG(LEAST(GREATEST(average_ratio * rating,1),10)) as approximation " # Keeping each approx in legal rating range
+					"FROM Reviews r JOIN averageRatioPerCustomer ARPC ON r.cust_id = ARPC.cust_id "
+					"WHERE r.apartment_id NOT IN ("
+					"SELECT apartment_id FROM Reviews WHERE cust_id = $1) "
+					"GROUP BY r.apartment_id) "
+
+					# This is just a formality - we need an apartment object, not just the apartment id, so we join with 'Apartments'
+					"SELECT a.apartment_id AS id, a.address AS address, a.city AS city, a.country AS country, a.size AS size, APA.approximation AS approximation "
+					"FROM Apartments a JOIN approximationPerApartment APA ON a.apartment_id = APA.apartment_id")
+
+Statements.register("get_apartment_recommendation", ("INTEGER",), _RECOMMENDATION_APPROXIMATIONS)
+
+# the 'n' best approximations, ties broken by apartment_id
+Statements.register("get_apartment_recommendation_top", ("INTEGER", "INTEGER"),
+					_RECOMMENDATION_APPROXIMATIONS + " ORDER BY approximation DESC, id LIMIT $2")
+
+
+@instrumented
 def get_apartment_recommendation(customer_id: int) -> List[Tuple[Apartment, float]]:
 	conn = None
 	try:
 		conn = Connector.DBConnector()
+		_, result = conn.execute_prepared("get_apartment_recommendation", (customer_id,))
+		conn.commit()
+		if PlanCapture.enabled:
+			PlanCapture.capture(conn, "get_apartment_recommendation", "get_apartment_recommendation", (customer_id,))
+		# the first 5 columns are the apartment itself, the last one its approximation
+		return [ (Apartment(*row[:5]), float(row[5])) for row in result.rows ]
+
+	except Exception as e:
+		return ReturnValue.ERROR
+
+	finally:
+		if conn is not None:
+			conn.close()
+
+
+# Same as 'get_apartment_recommendation()', but only the 'n' apartments with the highest approximations, best first
+@instrumented
+def get_apartment_recommendation_top(customer_id: int, n: int) -> List[Tuple[Apartment, float]]:
+	conn = None
+	try:
+		conn = Connector.DBConnector()
+		_, result = conn.execute_prepared("get_apartment_recommendation_top", (customer_id, n))
+		conn.commit()
+		if PlanCapture.enabled:
+			PlanCapture.capture(conn, "get_apartment_recommendation_top", "get_apartment_recommendation_top",
+								(customer_id, n))
+		return [ (Apartment(*row[:5]), float(row[5])) for row in result.rows ]
+
+	except Exception as e:
+		return ReturnValue.ERROR
 
-		_, result = conn.execute("DROP VIEW IF EXISTS ReducedReviews CASCADE; "
-								 "DROP VIEW IF EXISTS JoinedWithRatios CASCADE; "
-								 "DROP VIEW IF EXISTS averageRatioPerCustomer CASCADE; "
-								 "DROP VIEW IF EXISTS approximationPerApartment CASCADE; "
+	finally:
+		if conn is not None:
+			conn.close()
 
-								 # Reducing 'Reviews' to include only tuples with apartments that 'customer_id' has reviewed
-								 "CREATE VIEW ReducedReviews AS "
-								 "SELECT * "
-								 "FROM Reviews "
-								 "WHERE apartment_id IN ( "
-								 "SELECT apartment_id FROM Reviews WHERE cust_id = {customer_id}); "
 
-								 # Joining 'ReducedReviews' with itself, and getting all the ratios for each customer
-								 "CREATE VIEW JoinedWithRatios AS "
-								 "SELECT r1.cust_id AS r1_cust_id, r1.apartment_id, r2.cust_id AS r2_cust_id, (r1.rating * 1.0 / r2.rating * 1.0) AS ratio " # Multiplying by 1.0 for double promotion
-								 "FROM ReducedReviews r1 JOIN ReducedReviews r2 ON r1.apartment_id = r2.apartment_id "
-								 "WHERE r1.cust_id = {customer_id}; "
+# All reviews as (cust_id, apartment_id, rating), for the batch recommendations
+Statements.register("all_review_ratings", (),
+					"SELECT cust_id, apartment_id, rating FROM Reviews")
 
-								 # Taking average of all said ratios for each customer
-								 # Now we have a table of 2 columns: cust_id and its average ratio
-								 "CREATE VIEW averageRatioPerCustomer AS "
-								 "SELECT r2_cust_id AS cust_id, AVG(ratio) AS average_ratio "
-								 "FROM JoinedWithRatios "
-								 "GROUP BY r2_cust_id; "
+Statements.register("get_apartments_by_ids", ("INTEGER[]",),
+					"SELECT apartment_id, address, city, country, size FROM Apartments WHERE apartment_id = ANY($1)")
 
 
-								 # Here's where the magic happens - we join 'Reviews' with 'averageRatioPerCustomer' based on 'cust_id',
-								 # and take only tuples that DON'T include apartments that 'customer_id' reviewed
-								 # Then, we group by 'apartment_id' (becuase multiple approximations can occur),
-								 # and calculate the approximation for each apartment
-								 "CREATE VIEW approximationPerApartment AS "
-								 "SELECT apartment_id, AVG(LEAST(GREATEST(average_ratio * rating,1),10)) as approximation " # Keeping each approx in legal rating range
-								 "FROM Reviews r JOIN averageRatioPerCustomer ARPC ON r.cust_id = ARPC.cust_id "
-								 "WHERE r.apartment_id NOT IN ("
-								 "SELECT apartment_id FROM Reviews WHERE cust_id = {customer_id}) "
-								 "GROUP BY r.apartment_id; "
+# 'get_apartment_recommendation()' for many customers at once: 'Reviews' is read once (streamed straight into an array)
+# and the ratios and approximations of all the customers are computed with sparse matrix operations
+# (see Utility.RatioRecommender, needs NumPy and SciPy).
+# Returns customer_id -> the same (Apartment, approximation) pairs as 'get_apartment_recommendation(customer_id)',
+# sorted by apartment_id
+@instrumented
+def get_apartment_recommendations(customer_ids: Iterable[int]) -> Dict[int, List[Tuple[Apartment, float]]]:
+	conn = None
+	try:
+		import numpy
+		from Utility.RatioRecommender import recommend
 
-								 # This is just a formality - we need an apartment object, not just the apartment id, so we join with 'Apartments'
-								 "SELECT a.apartment_id AS id, a.address AS address, a.city AS city, a.country AS country, a.size AS size, APA.approximation AS approximation "
-								 "FROM Apartments a JOIN approximationPerApartment APA ON a.apartment_id = APA.apartment_id ".format(customer_id=customer_id))
+		conn = Connector.DBConnector()
+		with conn.stream_prepared("all_review_ratings") as reviews:
+			ratings = numpy.fromiter(chain.from_iterable(reviews.rows()), dtype=numpy.int64)
+		recommendations = recommend(ratings, customer_ids)
 
+		apartment_ids = sorted({apartment_id for pairs in recommendations.values() for apartment_id, _ in pairs})
+		_, result = conn.execute_prepared("get_apartments_by_ids", (apartment_ids,))
 		conn.commit()
-		return [ (Apartment(row['id'], row['address'], row['city'], row['country'], row['size']), float(row['approximation'])) for row in result ]
+		# the reviews and the apartments are read by two statements, each with a snapshot of its own, so an apartment
+		# deleted in between is just left out (its reviews went with it)
+		apartments = {row[0]: row for row in result.rows}
+		return {customer_id: [(Apartment(*apartments[apartment_id]), approximation)
+							  for apartment_id, approximation in pairs if apartment_id in apartments]
+				for customer_id, pairs in recommendations.items()}
 
 	except Exception as e:
 		return ReturnValue.ERROR
 
 	finally:
-		conn.close()
\ No newline at end of file
+		if conn is not None:
+			conn.close()
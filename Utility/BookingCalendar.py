@@ -0,0 +1,216 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import date
+from typing import Dict, Iterable, List, Set, Tuple
+
+TICKET_TTL = 60.0  # seconds a ticket stays valid, and removals are remembered, see BookingCalendar.ticket()
+
+
+# The reservations of one apartment, sorted by start date. They never overlap (the exclusion constraint of 'Reserves'
+# guarantees it), so the end dates are sorted too, and a stay can only overlap the last reservation starting before it ends.
+class _Bookings:
+    __slots__ = ('starts', 'ends', 'customers')
+
+    def __init__(self):
+        self.starts: List = []
+        self.ends: List = []
+        self.customers: List[int] = []
+
+    def overlaps(self, start_date, end_date) -> bool:
+        position = bisect_left(self.starts, end_date)  # the reservations from here on start when the stay ended
+        return position > 0 and self.ends[position - 1] > start_date
+
+    def add(self, customer_id: int, start_date, end_date):
+        position = bisect_left(self.starts, start_date)
+        if position < len(self.starts) and self.starts[position] == start_date:
+            return  # already known
+        self.starts.insert(position, start_date)
+        self.ends.insert(position, end_date)
+        self.customers.insert(position, customer_id)
+
+    # the start dates of the reservations overlapping [start_date, end_date)
+    def overlapping(self, start_date, end_date) -> list:
+        position = bisect_left(self.starts, end_date)
+        first = position
+        while first > 0 and self.ends[first - 1] > start_date:
+            first -= 1
+        return self.starts[first:position]
+
+    # removes the reservation starting on 'start_date' and returns its customer (None if there's none)
+    def remove(self, start_date):
+        position = bisect_left(self.starts, start_date)
+        if position == len(self.starts) or self.starts[position] != start_date:
+            return None
+        del self.starts[position], self.ends[position]
+        return self.customers.pop(position)
+
+
+# In-process index of the booked stays of every apartment, used to reject a reservation that overlaps a booked one.
+# It is warmed from 'Reserves' and then only follows the writes made through it, so with other writers it can be stale.
+# The database stays authoritative: a stay the calendar lets through is still checked by the exclusion constraint,
+# and an overlap the calendar finds is only a hint unless the caller knows it is the only writer (see Solution.py).
+#
+# The writes reach the calendar after their commit, so they can arrive out of order: a reservation cancelled right
+# after it was made could be removed before it is added. A writer therefore takes a ticket() before its database write
+# and passes it to add(), which then ignores a stay that was removed (or whose apartment / customer was) after the
+# ticket was taken. A ticket older than TICKET_TTL is ignored too, which bounds how long removals are remembered.
+# Leaving a stay out is always safe, it only costs the round trip the calendar could have saved.
+class BookingCalendar:
+    def __init__(self):
+        self.__apartments: Dict[int, _Bookings] = {}
+        self.__by_customer: Dict[int, Set[Tuple[int, object]]] = {}  # cust_id -> {(apartment_id, start_date)}
+        self.__lock = threading.Lock()
+        self.__sequence = 0
+        self.__identity = object()  # tickets of another calendar (e.g. before it was re-enabled) are never valid
+        self.__removed: Dict[tuple, int] = {}  # ('stay', apartment_id, start_date) / ('apartment', apartment_id) /
+        # ('customer', cust_id) -> sequence number of its last removal
+        self.__removals = deque()  # (time, sequence number, key) of the remembered removals, oldest first
+        self.checks = 0
+        self.hits = 0  # checks of an apartment that has bookings in the calendar
+        self.rejects = 0  # checks answered "overlaps"
+        self.stale_hits = 0  # overlaps the database disproved (the stays were dropped from the calendar)
+        self.ignored_adds = 0  # stays not added since they were removed meanwhile (or their ticket expired)
+        self.missed_overlaps = 0  # stays the calendar let through that the database rejected as overlapping
+
+    # replaces the calendar's content with 'rows' of (apartment_id, cust_id, start_date, end_date)
+    def warm(self, rows: Iterable[tuple]):
+        apartments, by_customer = {}, {}
+        for apartment_id, customer_id, start_date, end_date in rows:
+            bookings = apartments.get(apartment_id)
+            if bookings is None:
+                bookings = apartments[apartment_id] = _Bookings()
+            bookings.add(customer_id, start_date, end_date)
+            by_customer.setdefault(customer_id, set()).add((apartment_id, start_date))
+        with self.__lock:
+            self.__apartments, self.__by_customer = apartments, by_customer
+
+    # True when [start_date, end_date) certainly overlaps a booked stay of the apartment.
+    # An empty or reversed range overlaps nothing here, the CHECK constraint of 'Reserves' is the one to reject it
+    def overlaps(self, apartment_id: int, start_date, end_date) -> bool:
+        with self.__lock:
+            self.checks += 1
+            try:
+                if not start_date < end_date:
+                    return False
+                bookings = self.__apartments.get(apartment_id)
+                if bookings is None:
+                    return False
+                self.hits += 1
+                if bookings.overlaps(start_date, end_date):
+                    self.rejects += 1
+                    return True
+            except TypeError:  # an unhashable id or dates that don't compare, let the database reject them
+                pass
+            return False
+
+    # taken before the database write whose stay will be add()ed
+    def ticket(self) -> tuple:
+        with self.__lock:
+            return self.__identity, self.__sequence, time.monotonic()
+
+    # a stay whose dates aren't plain dates (e.g. strings the database parsed) is left out, the calendar can't order it
+    def add(self, apartment_id: int, customer_id: int, start_date, end_date, ticket: tuple = None):
+        if type(start_date) is not date or type(end_date) is not date:
+            return
+        with self.__lock:
+            if ticket is not None and not self.__valid(ticket, apartment_id, customer_id, start_date):
+                self.ignored_adds += 1
+                return
+            bookings = self.__apartments.get(apartment_id)
+            if bookings is None:
+                bookings = self.__apartments[apartment_id] = _Bookings()
+            bookings.add(customer_id, start_date, end_date)
+            self.__by_customer.setdefault(customer_id, set()).add((apartment_id, start_date))
+
+    def remove(self, apartment_id: int, start_date):
+        if type(start_date) is not date:
+            return
+        with self.__lock:
+            self.__remember_removal(('stay', apartment_id, start_date))
+            bookings = self.__apartments.get(apartment_id)
+            if bookings is None:
+                return
+            customer_id = bookings.remove(start_date)
+            if not bookings.starts:
+                del self.__apartments[apartment_id]
+            stays = self.__by_customer.get(customer_id)
+            if stays is not None:
+                stays.discard((apartment_id, start_date))
+                if not stays:
+                    del self.__by_customer[customer_id]
+
+    # drops the stays of the apartment overlapping [start_date, end_date), that the database says aren't there anymore
+    def remove_stale(self, apartment_id: int, start_date, end_date):
+        with self.__lock:
+            bookings = self.__apartments.get(apartment_id)
+            starts = bookings.overlapping(start_date, end_date) if bookings is not None else []
+            self.stale_hits += 1
+            self.rejects -= 1  # the overlap overlaps() reported didn't reject anything after all
+        for start in starts:
+            self.remove(apartment_id, start)
+
+    def remove_apartment(self, apartment_id: int):
+        with self.__lock:
+            self.__remember_removal(('apartment', apartment_id))
+            bookings = self.__apartments.pop(apartment_id, None)
+            if bookings is None:
+                return
+            for customer_id, start_date in zip(bookings.customers, bookings.starts):
+                stays = self.__by_customer.get(customer_id)
+                if stays is not None:
+                    stays.discard((apartment_id, start_date))
+                    if not stays:
+                        del self.__by_customer[customer_id]
+
+    def remove_customer(self, customer_id: int):
+        with self.__lock:
+            self.__remember_removal(('customer', customer_id))
+            for apartment_id, start_date in self.__by_customer.pop(customer_id, ()):
+                bookings = self.__apartments.get(apartment_id)
+                if bookings is not None:
+                    bookings.remove(start_date)
+                    if not bookings.starts:
+                        del self.__apartments[apartment_id]
+
+    def record_missed_overlap(self):
+        with self.__lock:
+            self.missed_overlaps += 1
+
+    # called with the lock held
+    def __remember_removal(self, key: tuple):
+        now = time.monotonic()
+        self.__sequence += 1
+        self.__removed[key] = self.__sequence
+        self.__removals.append((now, self.__sequence, key))
+        while self.__removals and now - self.__removals[0][0] > TICKET_TTL:
+            _, sequence, old_key = self.__removals.popleft()
+            if self.__removed.get(old_key) == sequence:
+                del self.__removed[old_key]
+
+    # called with the lock held: nothing the stay depends on was removed since the ticket was taken
+    def __valid(self, ticket: tuple, apartment_id: int, customer_id: int, start_date) -> bool:
+        identity, sequence, taken = ticket
+        if identity is not self.__identity or time.monotonic() - taken > TICKET_TTL:
+            return False
+        return all(self.__removed.get(key, 0) <= sequence
+                   for key in (('stay', apartment_id, start_date), ('apartment', apartment_id),
+                               ('customer', customer_id)))
+
+    def clear(self):
+        with self.__lock:
+            self.__apartments, self.__by_customer = {}, {}
+
+    def size(self) -> int:
+        with self.__lock:
+            return sum(len(bookings.starts) for bookings in self.__apartments.values())
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {'checks': self.checks, 'hits': self.hits, 'rejects': self.rejects, 'stale_hits': self.stale_hits,
+                    'ignored_adds': self.ignored_adds, 'missed_overlaps': self.missed_overlaps,
+                    'hit_rate': self.hits / self.checks if self.checks else None,
+                    'reject_rate': self.rejects / self.checks if self.checks else None,
+                    'apartments': len(self.__apartments),
+                    'bookings': sum(len(bookings.starts) for bookings in self.__apartments.values())}
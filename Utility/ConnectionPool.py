@@ -0,0 +1,229 @@
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+from Utility.Exceptions import DatabaseException
+
+
+# a psycopg2 connection that remembers when it was created, when it was last handed back to the pool
+# and which statements were already prepared on it (prepared statements live as long as the session)
+class PooledConnection(extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.returned_at = self.created_at
+        self.prepared = set()
+
+
+class PoolStats:
+    __slots__ = ('checkouts', 'returns', 'creations', 'discards', 'evictions', 'failed_health_checks',
+                 'waits', 'wait_time', 'timeouts', 'peak_in_use')
+
+    def __init__(self):
+        for field in PoolStats.__slots__:
+            setattr(self, field, 0)
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in PoolStats.__slots__}
+
+    def __str__(self):
+        return ', '.join('{}={}'.format(field, value) for field, value in self.as_dict().items())
+
+
+# A bounded, thread-safe pool of psycopg2 connections.
+# - at most 'max_size' connections are open at once; a checkout beyond that waits up to 'timeout' seconds
+# - at least 'min_size' connections are kept open, idle connections above that are closed after 'max_idle' seconds
+# - a connection that sat idle for more than 'health_check_after' seconds is pinged before it is handed out
+class ConnectionPool:
+    def __init__(self, params: dict, min_size: int = 1, max_size: int = 10, timeout: float = 30.0,
+                 max_idle: float = 300.0, health_check_after: float = 5.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min_size={}, max_size={}".format(min_size, max_size))
+        self.params = dict(params)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.stats = PoolStats()
+        self.__idle = []  # LIFO, so the hot connections are reused and the cold ones age out
+        self.__in_use = 0
+        self.__closed = False
+        self.__lock = threading.Condition(threading.Lock())
+
+    # number of open connections (idle + checked out)
+    def size(self) -> int:
+        with self.__lock:
+            return len(self.__idle) + self.__in_use
+
+    def idle(self) -> int:
+        with self.__lock:
+            return len(self.__idle)
+
+    def in_use(self) -> int:
+        with self.__lock:
+            return self.__in_use
+
+    def get_stats(self) -> dict:
+        with self.__lock:
+            stats = self.stats.as_dict()
+            stats.update(size=len(self.__idle) + self.__in_use, idle=len(self.__idle), in_use=self.__in_use,
+                         min_size=self.min_size, max_size=self.max_size)
+            return stats
+
+    # check a connection out of the pool, opening a new one if needed
+    def get(self) -> PooledConnection:
+        deadline = None
+        waited = False
+        wait_start = 0.0
+        with self.__lock:
+            while True:
+                if self.__closed:
+                    raise DatabaseException.ConnectionInvalid("Connection pool is closed")
+                self.__evict_idle()
+                if self.__idle:
+                    connection = self.__idle.pop()
+                    self.__in_use += 1
+                    break
+                if self.__in_use < self.max_size:
+                    # reserve the slot, the actual connect happens outside the lock
+                    connection = None
+                    self.__in_use += 1
+                    break
+                if not waited:
+                    waited = True
+                    wait_start = time.monotonic()
+                    deadline = wait_start + self.timeout
+                    self.stats.waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats.timeouts += 1
+                    self.stats.wait_time += time.monotonic() - wait_start
+                    raise DatabaseException.ConnectionInvalid("Timed out waiting for a database connection")
+                self.__lock.wait(remaining)
+            if waited:
+                self.stats.wait_time += time.monotonic() - wait_start
+            self.stats.checkouts += 1
+            self.stats.peak_in_use = max(self.stats.peak_in_use, self.__in_use)
+
+        if connection is not None and not self.__healthy(connection):
+            self.__discard(connection, count_in_use=False)
+            with self.__lock:
+                self.stats.failed_health_checks += 1
+            connection = None
+        if connection is None:
+            try:
+                connection = self.__connect()
+            except Exception:
+                with self.__lock:
+                    self.__in_use -= 1
+                    self.__lock.notify()
+                raise DatabaseException.ConnectionInvalid("Could not connect to database")
+        return connection
+
+    # hand a connection back. Anything left of an open transaction is rolled back first.
+    def put(self, connection: PooledConnection, discard: bool = False):
+        if not discard:
+            discard = not self.__reset(connection)
+        with self.__lock:
+            self.__in_use -= 1
+            self.stats.returns += 1
+            if discard or self.__closed:
+                self.stats.discards += 1
+            else:
+                connection.returned_at = time.monotonic()
+                self.__idle.append(connection)
+                connection = None
+            self.__evict_idle()
+            self.__lock.notify()
+        if connection is not None:
+            ConnectionPool.__close_quietly(connection)
+
+    # open connections until there are 'min_size' of them
+    def warm(self):
+        while True:
+            with self.__lock:
+                if self.__closed or len(self.__idle) + self.__in_use >= self.min_size:
+                    return
+                self.__in_use += 1
+            try:
+                connection = self.__connect()
+            except Exception:
+                with self.__lock:
+                    self.__in_use -= 1
+                    self.__lock.notify()
+                raise DatabaseException.ConnectionInvalid("Could not connect to database")
+            self.put(connection)
+
+    # close every idle connection; connections still checked out are closed when they are returned
+    def close(self):
+        with self.__lock:
+            self.__closed = True
+            idle, self.__idle = self.__idle, []
+            self.__lock.notify_all()
+        for connection in idle:
+            ConnectionPool.__close_quietly(connection)
+
+    def __connect(self) -> PooledConnection:
+        connection = psycopg2.connect(connection_factory=PooledConnection, **self.params)
+        connection.autocommit = False
+        with self.__lock:
+            self.stats.creations += 1
+        return connection
+
+    def __discard(self, connection, count_in_use: bool = True):
+        ConnectionPool.__close_quietly(connection)
+        with self.__lock:
+            self.stats.discards += 1
+            if count_in_use:
+                self.__in_use -= 1
+                self.__lock.notify()
+
+    # called with the lock held: close connections that were idle for too long, keeping 'min_size' open
+    def __evict_idle(self):
+        if self.max_idle is None or not self.__idle:
+            return
+        now = time.monotonic()
+        while self.__idle and len(self.__idle) + self.__in_use > self.min_size:
+            oldest = self.__idle[0]
+            if now - oldest.returned_at < self.max_idle:
+                break
+            self.__idle.pop(0)
+            self.stats.evictions += 1
+            ConnectionPool.__close_quietly(oldest)
+
+    def __healthy(self, connection: PooledConnection) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - connection.returned_at < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    # leave the connection idle and outside of any transaction, returns False if it can't be reused
+    @staticmethod
+    def __reset(connection: PooledConnection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            status = connection.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def __close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
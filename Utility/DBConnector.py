@@ -1,9 +1,25 @@
 import psycopg2
-from psycopg2 import errors, sql
+from psycopg2 import errors, extensions, sql
 from configparser import ConfigParser
 from Utility.Exceptions import DatabaseException
+from Utility.ConnectionPool import ConnectionPool
+import Utility.Statements as Statements
+import Utility.Instrumentation as Instrumentation
+import contextvars
+import io
+import itertools
 import os
-from typing import Union
+import threading
+import time
+from operator import itemgetter
+from typing import Tuple, Union
+
+
+# a value in COPY's text format
+def _copy_value(value) -> str:
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
 
 
 class ResultSetDict(dict):
@@ -13,34 +29,82 @@ class ResultSetDict(dict):
         return super().__getitem__(item.lower())
 
 
+# A row of a ResultSet: a read-only view over the row's tuple that shares the column -> index map of its ResultSet,
+# so handing out a row allocates one small object instead of a dict
+class ResultSetRow:
+    __slots__ = ('__values', '__index')
+
+    def __init__(self, values: tuple, index: dict):
+        self.__values = values
+        self.__index = index
+
+    def __getitem__(self, item):
+        if type(item) is not str:
+            return None
+        index = self.__index.get(item)
+        if index is None:
+            index = self.__index[item.lower()]
+        return self.__values[index]
+
+    def get(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.__index.keys()
+
+    def values(self):
+        return list(self.__values)
+
+    def items(self):
+        return list(zip(self.__index, self.__values))
+
+    def __iter__(self):
+        return iter(self.__index)
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, item):
+        return type(item) is str and (item in self.__index or item.lower() in self.__index)
+
+    def __eq__(self, other):
+        if isinstance(other, ResultSetRow):
+            other = dict(other.items())
+        return dict(self.items()) == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 class ResultSet:
+    __slots__ = ('rows', 'cols_header', 'cols', '__index')
+
     # constructor
     def __init__(self, description=None, results=None):
         self.rows = []
         self.cols_header = []
         self.cols = ResultSetDict()
+        self.__index = {}
         self.__fromQuery(description, results)
 
     def __getitem__(self, idx):
         if type(idx) == str:
-            return [x[self.cols[idx]] for x in self.rows]
+            return list(map(itemgetter(self.cols[idx]), self.rows))
         return self.__getRow(idx)
 
     # so you can use print(ResultSet)
     def __str__(self):
-        string = ""
-        for col in self.cols_header:
-            string += str(col) + "   "
-        string += '\n'
-        for row in self.rows:
-            for val in row:
-                string += str(val) + "   "
-            string += '\n'
-        return string
+        lines = ["".join([str(col) + "   " for col in self.cols_header])]
+        lines.extend(["".join([str(val) + "   " for val in row]) for row in self.rows])
+        lines.append("")
+        return "\n".join(lines)
 
     def __iter__(self):
-        for row in range(len(self.rows)):
-            yield self.__getRow(row)
+        index = self.__index
+        return (ResultSetRow(row, index) for row in self.rows)
 
     # what is the size of the ResultSet?
     def size(self):
@@ -54,70 +118,350 @@ class ResultSet:
         if len(self.rows) <= row:
             print('Invalid row ' + str(row))
             return ResultSetDict()
-        row_to_return = ResultSetDict()
-        for val, col in zip(self.rows[row], self.cols_header):
-            row_to_return[col] = val
-        return row_to_return
+        return ResultSetRow(self.rows[row], self.__index)
 
+    # 'results' is taken over as is (the cursor's list of tuples), not copied
     def __fromQuery(self, description, results: list):
         if results is None or len(results) == 0:  # no results
             self.cols = ResultSetDict()
         else:
-            self.rows = results.copy()
+            self.rows = results
             self.cols_header = [d.name for d in description]
             self.cols = ResultSetDict()
             for col, index in zip(self.cols_header, range(len(results[0]))):
                 self.cols[col] = index
+            self.__index = dict(self.cols)
+
+
+# Rows of a SELECT that are fetched from a server-side (named) cursor, 'fetch_size' rows at a time, instead of being
+# loaded all at once. It can be iterated once, and each row can be accessed by column name like a ResultSet row.
+class StreamingResultSet:
+    # with 'execute_time' (instrumentation enabled), the stream is recorded as one query when it is closed
+    def __init__(self, cursor, query=None, args=None, execute_time: float = None):
+        self.cols_header = []
+        self.cols = ResultSetDict()
+        self.__index = {}
+        self.__cursor = cursor
+        self.__query = query
+        self.__args = args
+        self.__execute_time = execute_time
+        self.__fetch_time = 0.0
+        self.__rows_returned = 0
+
+    # the rows as ResultSet rows (column name -> value)
+    def __iter__(self):
+        for row in self.rows():
+            yield ResultSetRow(row, self.__index)
+
+    # the rows as plain tuples, in column order
+    def rows(self):
+        if self.__cursor is None:
+            return
+        if self.__execute_time is not None:
+            yield from self.__timed_rows()
+            return
+        for row in self.__cursor:
+            if not self.cols_header:  # a named cursor only has a description once something was fetched
+                self.__read_header()
+            yield row
+
+    # rows() while instrumented: times every wait on the cursor (most rows come from its buffer, a few wait on a fetch)
+    def __timed_rows(self):
+        rows = iter(self.__cursor)
+        while True:
+            started = time.perf_counter()
+            row = next(rows, None)
+            self.__fetch_time += time.perf_counter() - started
+            if row is None:
+                return
+            if not self.cols_header:
+                self.__read_header()
+            self.__rows_returned += 1
+            yield row
+
+    def close(self):
+        if self.__cursor is not None:
+            try:
+                self.__cursor.close()
+            except Exception:
+                pass
+            self.__cursor = None
+            if self.__execute_time is not None:
+                Instrumentation.registry.record_query(self.__query, self.__args, self.__execute_time,
+                                                      self.__fetch_time, 0.0, self.__rows_returned, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __read_header(self):
+        self.cols_header = [d.name for d in self.__cursor.description]
+        for index, col in enumerate(self.cols_header):
+            self.cols[col] = index
+        self.__index.update(self.cols)
+
+
+# how many rows a server-side cursor fetches per round trip
+DEFAULT_FETCH_SIZE = 2000
+_cursor_ids = itertools.count()
+
+# the process-wide pool every DBConnector checks its connection out of, created on first use
+_params = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# (re)create the shared pool with the given settings (see ConnectionPool for the parameters)
+# connections checked out of the previous pool are closed when they are returned
+def configure_pool(**kwargs) -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        old_pool = _pool
+        _pool = ConnectionPool(DBConnector.config(), **kwargs)
+    if old_pool is not None:
+        old_pool.close()
+    return _pool
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DBConnector.config())
+    return _pool
+
+
+# checkouts, waits, connection creations etc. of the shared pool, useful for sizing it
+def pool_stats() -> dict:
+    return get_pool().get_stats()
+
+
+# the Transaction the current thread (or task) is running in, if any
+_transaction = contextvars.ContextVar('transaction', default=None)
+
+
+# A unit of work: inside 'with Transaction():' every DBConnector uses the transaction's single connection instead of
+# checking one out of the pool, and works in a savepoint of its own. Its commit() only releases the savepoint
+# (its rollback() / close() without commit roll back to it), so a failing call undoes just itself and the other calls
+# carry on. The transaction is committed once when the block ends, or rolled back if the block raises or rollback()
+# was called. A Transaction entered inside another one joins it.
+class Transaction:
+    def __init__(self, pool: ConnectionPool = None):
+        self.connection = None
+        self.__pool = pool
+        self.__savepoint_ids = itertools.count()
+        self.__on_commit = []
+        self.__rollback_only = False
+        self.__token = None
+        self.__outer = None
+
+    def __enter__(self):
+        outer = _transaction.get()
+        if outer is not None:
+            self.__outer = outer
+            return outer
+        if self.__pool is None:
+            self.__pool = get_pool()
+        self.connection = self.__pool.get()
+        self.__token = _transaction.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__outer is not None:
+            self.__outer = None
+            return False
+        _transaction.reset(self.__token)
+        connection, self.connection = self.connection, None
+        callbacks, self.__on_commit = self.__on_commit, []
+        try:
+            if exc_type is None and not self.__rollback_only:
+                try:
+                    connection.commit()
+                except Exception:
+                    raise DatabaseException.ConnectionInvalid("Could not commit changes")
+            else:
+                callbacks = []
+                connection.rollback()
+        finally:
+            self.__pool.put(connection)
+        for callback in callbacks:
+            callback()
+        return False
+
+    # roll the whole transaction back when the block ends, instead of committing it
+    def rollback(self):
+        self.__rollback_only = True
+
+    # 'callback' is called once the transaction has committed (never if it rolls back)
+    def on_commit(self, callback):
+        self.__on_commit.append(callback)
+
+    def savepoint_name(self) -> str:
+        return "sp_{}".format(next(self.__savepoint_ids))
+
+
+def current_transaction() -> Union[Transaction, None]:
+    return _transaction.get()
 
 
 class DBConnector:
     # constructor
-    def __init__(self):
+    def __init__(self, pool: ConnectionPool = None):
+        self.connection = None
+        self.cursor = None
+        self.__transaction = _transaction.get()
+        self.__savepoint = None
+        if self.__transaction is not None:
+            self.__join(self.__transaction)
+            return
+        self.__pool = pool if pool is not None else get_pool()
+        self.connection = self.__pool.get()
         try:
-            # Obtain the configuration parameters
-            params = DBConnector.__config()
-            self.connection = psycopg2.connect(**params)
-            self.connection.autocommit = False
             self.cursor = self.connection.cursor()
         except Exception as e:
+            self.__pool.put(self.connection, discard=True)
             self.connection = None
-            self.cursor = None
             raise DatabaseException.ConnectionInvalid("Could not connect to database")
 
-    # close connection
+    # work inside 'transaction': on its connection, in a savepoint
+    def __join(self, transaction: Transaction):
+        self.connection = transaction.connection
+        self.__savepoint = transaction.savepoint_name()
+        try:
+            self.cursor = self.connection.cursor()
+            self.cursor.execute("SAVEPOINT " + self.__savepoint)
+        except Exception as e:
+            self.connection = None
+            raise DatabaseException.ConnectionInvalid("Could not connect to database")
+
+    # close connection (gives it back to the pool; in a transaction, drops what wasn't committed since the savepoint)
     def close(self):
+        if self.__savepoint is not None and self.connection is not None:
+            try:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT {0}; RELEASE SAVEPOINT {0}".format(self.__savepoint))
+            except Exception:
+                pass
         if self.cursor is not None:
-            self.cursor.close()
+            try:
+                self.cursor.close()
+            except Exception:
+                pass
+            self.cursor = None
         if self.connection is not None:
-            self.connection.close()
+            if self.__savepoint is None:
+                self.__pool.put(self.connection)
+            self.connection = None
 
-    # commit connection's changes
+    # commit connection's changes (in a transaction: keep them, for the transaction to commit)
     def commit(self):
         if self.connection is not None:
+            instrument = Instrumentation.registry.enabled
+            if instrument:
+                started = time.perf_counter()
             try:
-                self.connection.commit()
+                if self.__savepoint is not None:
+                    self.cursor.execute("RELEASE SAVEPOINT {0}; SAVEPOINT {0}".format(self.__savepoint))
+                else:
+                    self.connection.commit()
             except Exception:
                 raise DatabaseException.ConnectionInvalid("Could not commit changes")
+            if instrument:
+                Instrumentation.registry.record_commit(time.perf_counter() - started)
 
-    # rollback connection's changes
+    # rollback connection's changes (in a transaction: back to the savepoint)
     def rollback(self):
         if self.connection is not None:
             try:
-                self.connection.rollback()
+                if self.__savepoint is not None:
+                    self.cursor.execute("ROLLBACK TO SAVEPOINT " + self.__savepoint)
+                else:
+                    self.connection.rollback()
             except Exception:
                 raise DatabaseException.ConnectionInvalid("Could not rollback changes")
 
     # executes the query, if it is SELECT you may ask to print the results with printSchema
     # returns the number of rows effected and a ResultSet (for SELECT)
-    def execute(self, query: Union[str, sql.Composed], printSchema=False) -> (int, ResultSet):
+    # with commit=False the statement is left in the open transaction, for the caller to commit or rollback
+    def execute(self, query: Union[str, sql.Composed], printSchema=False, commit=True) -> (int, ResultSet):
+        return self.__execute(query, None, printSchema, commit)
+
+    # executes 'query', whose single %s stands for the VALUES list of 'rows' (every row formatted with 'template',
+    # e.g. "(%s, %s::DATE)"), in a single round trip however many rows there are (like psycopg2's execute_values)
+    def execute_values(self, query: str, rows, template: str, printSchema=False, commit=True) -> (int, ResultSet):
+        if self.connection is None:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+        values = b','.join([self.cursor.mogrify(template, row) for row in rows])
+        values = values.decode(extensions.encodings[self.connection.encoding])
+        return self.__execute(query, (extensions.AsIs(values),), printSchema, commit)
+
+    # executes a statement registered in Utility.Statements with the given arguments.
+    # The statement is PREPAREd the first time it runs on this connection, after that Postgres skips parse/plan.
+    def execute_prepared(self, name: str, args: tuple = (), printSchema=False, commit=True) -> (int, ResultSet):
+        if self.connection is None:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+        statement = Statements.get(name)
+        if statement.name not in self.connection.prepared:
+            self.__prepare(statement)
+        pending = self.connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+        try:
+            return self.__execute(statement.execute_sql, tuple(args), printSchema, commit)
+        except errors.InvalidSqlStatementName:
+            # the session lost its prepared statements (DISCARD ALL, server side reset...), prepare again and retry.
+            # Only when nothing was pending: the rollback would discard that work (or the transaction's savepoint)
+            if pending:
+                self.connection.prepared.clear()
+                raise
+            self.rollback()
+            self.connection.prepared.clear()
+            self.__prepare(statement)
+            return self.__execute(statement.execute_sql, tuple(args), printSchema, commit)
+
+    # the plan of a registered statement for the given arguments, as EXPLAIN (FORMAT JSON) returns it.
+    # 'options' are extra EXPLAIN options, e.g. "ANALYZE, BUFFERS". The transaction is rolled back afterwards,
+    # so not even an ANALYZEd write leaves anything behind
+    def explain_prepared(self, name: str, args: tuple = (), options: str = "") -> list:
         if self.connection is None:
             raise DatabaseException.ConnectionInvalid("Connection Invalid")
+        statement = Statements.get(name)
+        if statement.name not in self.connection.prepared:
+            self.__prepare(statement)
+        query = "EXPLAIN ({}FORMAT JSON) {}".format(options + ", " if options else "", statement.execute_sql)
+        try:
+            _, result = self.__execute(query, tuple(args), False, False)
+        finally:
+            self.rollback()
+        return result.rows[0][0]
+
+    # PREPAREs under a savepoint: a name that is somehow prepared already only rolls back to it, instead of aborting
+    # (or rolling back) the work this connection has pending. Still a single round trip when it succeeds
+    def __prepare(self, statement: Statements.Statement):
+        try:
+            self.cursor.execute("SAVEPOINT prepare_statement; " + statement.prepare_sql +
+                                "; RELEASE SAVEPOINT prepare_statement")
+        except errors.DuplicatePreparedStatement:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement; RELEASE SAVEPOINT prepare_statement")
+        self.connection.prepared.add(statement.name)
+
+    def __execute(self, query, args, printSchema, commit) -> (int, ResultSet):
+        if self.connection is None:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+
+        # timing the phases costs only this check while the instrumentation is disabled
+        instrument = Instrumentation.registry.enabled
+        if instrument:
+            started = time.perf_counter()
 
         # try execute the query
         try:
-            self.cursor.execute(query)
+            self.cursor.execute(query, args)
             row_effected = max(self.cursor.rowcount, 0)
-            self.commit()
+            if instrument:
+                executed = time.perf_counter()
+            if commit:
+                self.commit()
         except errors.lookup("23502"):
             raise DatabaseException.NOT_NULL_VIOLATION("NOT_NULL_VIOLATION")
         except errors.lookup("23503"):
@@ -126,19 +470,100 @@ class DBConnector:
             raise DatabaseException.UNIQUE_VIOLATION("UNIQUE_VIOLATION")
         except errors.lookup("23514"):
             raise DatabaseException.CHECK_VIOLATION("CHECK_VIOLATION")
+        except errors.lookup("23P01"):
+            raise DatabaseException.EXCLUSION_VIOLATION("EXCLUSION_VIOLATION")
+
+        if instrument:
+            committed = time.perf_counter()
 
         # get entries in case of SELECT
         if self.cursor.description is not None:
-            entries = ResultSet(self.cursor.description, self.cursor.fetchall())
+            rows = self.cursor.fetchall()
+            if instrument:
+                fetched = time.perf_counter()
+            entries = ResultSet(self.cursor.description, rows)
         else:
+            if instrument:
+                fetched = committed
             entries = ResultSet()
 
+        if instrument:
+            Instrumentation.registry.record_query(query, args, executed - started, fetched - committed,
+                                                  time.perf_counter() - fetched, entries.size(), row_effected,
+                                                  committed - executed)
+
         # print SELECT entries
         if printSchema:
             print(entries)
 
         return row_effected, entries
 
+    # runs a SELECT on a server-side cursor and returns its rows as they are fetched, 'fetch_size' at a time.
+    # The rows can be read until the transaction ends (the next commit / rollback / close of this connector)
+    def stream(self, query: Union[str, sql.Composed], args=None,
+               fetch_size: int = DEFAULT_FETCH_SIZE) -> StreamingResultSet:
+        if self.connection is None:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+        cursor = self.connection.cursor(name="stream_{}".format(next(_cursor_ids)))
+        cursor.itersize = fetch_size
+        instrument = Instrumentation.registry.enabled
+        if instrument:
+            started = time.perf_counter()
+        try:
+            cursor.execute(query, args)
+        except Exception:
+            cursor.close()
+            raise
+        if instrument:
+            return StreamingResultSet(cursor, query, args, time.perf_counter() - started)
+        return StreamingResultSet(cursor)
+
+    # stream() for a statement registered in Utility.Statements
+    def stream_prepared(self, name: str, args: tuple = (), fetch_size: int = DEFAULT_FETCH_SIZE) -> StreamingResultSet:
+        statement = Statements.get(name)
+        return self.stream(statement.cursor_sql, statement.cursor_args(tuple(args)), fetch_size)
+
+    # streams 'rows' (tuples, in the order of 'columns') into 'table' with COPY FROM STDIN.
+    # Doesn't commit, returns the number of rows copied
+    def copy_in(self, table: str, columns: Tuple[str, ...], rows) -> int:
+        if self.connection is None:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+        instrument = Instrumentation.registry.enabled
+        if instrument:
+            started = time.perf_counter()
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join([_copy_value(value) for value in row]))
+            buffer.write('\n')
+        buffer.seek(0)
+        query = sql.SQL("COPY {} ({}) FROM STDIN").format(sql.Identifier(table.lower()),
+                                                          sql.SQL(', ').join(map(sql.Identifier, columns)))
+        if instrument:
+            built = time.perf_counter()
+        try:
+            self.cursor.copy_expert(query, buffer)
+        except errors.lookup("23502"):
+            raise DatabaseException.NOT_NULL_VIOLATION("NOT_NULL_VIOLATION")
+        except errors.lookup("23505"):
+            raise DatabaseException.UNIQUE_VIOLATION("UNIQUE_VIOLATION")
+        except errors.lookup("23514"):
+            raise DatabaseException.CHECK_VIOLATION("CHECK_VIOLATION")
+        except errors.lookup("23P01"):
+            raise DatabaseException.EXCLUSION_VIOLATION("EXCLUSION_VIOLATION")
+        copied = max(self.cursor.rowcount, 0)
+        if instrument:
+            Instrumentation.registry.record_query(query, None, time.perf_counter() - built, 0.0, built - started, 0,
+                                                  copied)
+        return copied
+
+    # connection parameters, database.ini is only parsed once per process
+    @staticmethod
+    def config() -> dict:
+        global _params
+        if _params is None:
+            _params = DBConnector.__config()
+        return dict(_params)
+
     # grant credentials
     @staticmethod
     def __config(filename=os.path.join(os.path.join(os.getcwd(), "Utility"), 'database.ini'),
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# An in-process, thread-safe LRU cache whose entries also expire 'ttl' seconds after they were stored.
+# Writers invalidate the keys they change. A reader that loaded a value from the database only stores it if nothing
+# was invalidated since it started (see epoch()), so a slow read can't put back a value a write just invalidated.
+class EntityCache:
+    MISS = object()  # returned by get() when the key isn't cached (None is a valid cached value)
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        if max_size < 1:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self.__epoch = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return EntityCache.MISS
+            if entry[0] is not None and entry[0] <= time.monotonic():
+                del self.__entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return EntityCache.MISS
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    # the current invalidation epoch, to pass to put() along with a value read after it
+    def epoch(self) -> int:
+        return self.__epoch
+
+    def put(self, key, value, epoch: int = None):
+        with self.__lock:
+            if epoch is not None and epoch != self.__epoch:
+                return  # something was invalidated while the value was read, it may be stale
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            self.__entries[key] = (expires_at, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        with self.__lock:
+            self.__epoch += 1
+            for key in keys:
+                if self.__entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    # drop every entry for which predicate(key, value) is true
+    def invalidate_where(self, predicate):
+        with self.__lock:
+            self.__epoch += 1
+            for key in [key for key, (_, value) in self.__entries.items() if predicate(key, value)]:
+                del self.__entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__epoch += 1
+            self.invalidations += len(self.__entries)
+            self.__entries.clear()
+
+    def size(self) -> int:
+        return len(self.__entries)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations,
+                    'size': len(self.__entries), 'max_size': self.max_size, 'ttl': self.ttl}
@@ -0,0 +1,81 @@
+from datetime import date
+from typing import Dict, List
+
+import Utility.DBConnector as Connector
+import Utility.Statements as Statements
+
+# arguments EXPLAIN uses for a statement's parameters when no sample was given for it
+DEFAULT_SAMPLES = {
+    'INTEGER': 1,
+    'INTEGER[]': [1],
+    'NUMERIC': 1,
+    'DATE': date(2020, 1, 1),
+    'TEXT': 'sample',
+}
+
+
+class Finding:
+    __slots__ = ('statement', 'relation', 'table_rows', 'plan_rows', 'filter')
+
+    def __init__(self, statement: str, relation: str, table_rows: float, plan_rows: float, filter: str):
+        self.statement = statement
+        self.relation = relation
+        self.table_rows = table_rows
+        self.plan_rows = plan_rows
+        self.filter = filter
+
+    def __str__(self):
+        return '{}: Seq Scan on {} (~{:.0f} rows in the table, ~{:.0f} expected){}'.format(
+            self.statement, self.relation, self.table_rows, self.plan_rows,
+            ', filter: ' + self.filter if self.filter else '')
+
+
+def _sequential_scans(plan: dict):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan
+    for child in plan.get('Plans', ()):
+        yield from _sequential_scans(child)
+
+
+# EXPLAINs every registered statement against the (populated) database and reports the sequential scans
+# on tables of at least 'min_rows' rows (by the planner's statistics, so ANALYZE the database first).
+# 'samples' maps statement names to the arguments to explain them with.
+def advise(samples: Dict[str, tuple] = None, min_rows: int = 10000) -> List[Finding]:
+    samples = samples or {}
+    findings = []
+    conn = Connector.DBConnector()
+    try:
+        _, sizes = conn.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+        table_rows = {name: rows for name, rows in sizes.rows}
+        for name, statement in sorted(Statements.all_statements().items()):
+            args = samples.get(name)
+            if args is None:
+                args = tuple(DEFAULT_SAMPLES.get(arg_type.upper(), 1) for arg_type in statement.arg_types)
+            try:
+                plan = conn.explain_prepared(name, args)[0]['Plan']
+            except Exception as e:
+                print('Could not explain {}: {}'.format(name, e))
+                continue
+            for scan in _sequential_scans(plan):
+                relation = scan.get('Relation Name', '')
+                rows = table_rows.get(relation, 0)
+                if rows >= min_rows:
+                    findings.append(Finding(name, relation, rows, scan.get('Plan Rows', 0), scan.get('Filter')))
+    finally:
+        conn.close()
+    return findings
+
+
+def print_report(findings: List[Finding]):
+    if not findings:
+        print('No sequential scans on large tables')
+    for finding in findings:
+        print(finding)
+
+
+# usage (from the repository root, against a populated database): python -m Utility.IndexAdvisor [min_rows]
+if __name__ == '__main__':
+    import sys
+    import Solution  # registers the API's statements
+
+    print_report(advise(min_rows=int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
@@ -0,0 +1,206 @@
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the latency histogram buckets, the last bucket takes everything above
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the Solution.py function whose queries are running right now (set by @instrumented)
+_current_function = contextvars.ContextVar('current_function', default=None)
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    # upper bound of the bucket the q-quantile falls in (the max for the last bucket)
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], self.counts))}
+
+
+# one executed query, as handed to the hooks and kept in the slow query log.
+# For a COPY, 'build_time' is the time spent formatting the rows sent; for a streamed SELECT, 'fetch_time' is the time
+# spent waiting on the server-side cursor while the rows were read
+class QueryRecord:
+    __slots__ = ('query', 'args', 'function', 'execute_time', 'commit_time', 'fetch_time', 'build_time',
+                 'rows_returned', 'rows_affected', 'timestamp')
+
+    def __init__(self, query, args, function, execute_time, fetch_time, build_time, rows_returned, rows_affected,
+                 commit_time=0.0):
+        self.query = query
+        self.args = args
+        self.function = function
+        self.execute_time = execute_time
+        self.commit_time = commit_time
+        self.fetch_time = fetch_time
+        self.build_time = build_time
+        self.rows_returned = rows_returned
+        self.rows_affected = rows_affected
+        self.timestamp = time.time()
+
+    @property
+    def total_time(self) -> float:
+        return self.execute_time + self.commit_time + self.fetch_time + self.build_time
+
+    def as_dict(self) -> dict:
+        record = {field: getattr(self, field) for field in QueryRecord.__slots__}
+        record['query'] = str(self.query)
+        record['args'] = None if self.args is None else [str(arg) for arg in self.args]
+        record['total_time'] = self.total_time
+        return record
+
+    def __str__(self):
+        return ('{:.1f}ms (execute {:.1f}ms, commit {:.1f}ms, fetch {:.1f}ms, build {:.1f}ms) {} rows returned, '
+                '{} affected, in {}: {}').format(
+            self.total_time * 1e3, self.execute_time * 1e3, self.commit_time * 1e3, self.fetch_time * 1e3,
+            self.build_time * 1e3, self.rows_returned, self.rows_affected, self.function, self.query)
+
+
+# In-process registry of everything the instrumentation measures.
+# Disabled by default; while it is, DBConnector and @instrumented only pay for reading the 'enabled' flag.
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_threshold = None  # seconds, None = no slow query log
+        self.__lock = threading.Lock()
+        self.__hooks: List[Callable[[QueryRecord], None]] = []
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.queries = 0
+            self.commits = 0
+            self.rows_returned = 0
+            self.rows_affected = 0
+            # 'commit' observes every commit, also the ones a caller makes after running its queries
+            self.phases: Dict[str, Histogram] = {'execute': Histogram(), 'commit': Histogram(), 'fetch': Histogram(),
+                                                 'build': Histogram(), 'total': Histogram()}
+            self.functions: Dict[str, Histogram] = {}
+            self.function_errors: Dict[str, int] = {}
+            self.slow_queries = deque(maxlen=1000)
+
+    # 'hook' is called with a QueryRecord after every query (from the thread that ran it)
+    def add_hook(self, hook: Callable[[QueryRecord], None]):
+        with self.__lock:
+            self.__hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[QueryRecord], None]):
+        with self.__lock:
+            self.__hooks.remove(hook)
+
+    # 'commit_time' is the commit made along with the query (execute(commit=True)), it is already in the 'commit' phase
+    def record_query(self, query, args, execute_time: float, fetch_time: float, build_time: float,
+                     rows_returned: int, rows_affected: int, commit_time: float = 0.0):
+        record = QueryRecord(query, args, _current_function.get(), execute_time, fetch_time, build_time,
+                             rows_returned, rows_affected, commit_time)
+        slow = self.slow_query_threshold is not None and record.total_time >= self.slow_query_threshold
+        with self.__lock:
+            self.queries += 1
+            self.rows_returned += rows_returned
+            self.rows_affected += rows_affected
+            self.phases['execute'].observe(execute_time)
+            self.phases['fetch'].observe(fetch_time)
+            self.phases['build'].observe(build_time)
+            self.phases['total'].observe(record.total_time)
+            if slow:
+                self.slow_queries.append(record)
+            hooks = list(self.__hooks)
+        if slow:
+            logger.warning('slow query: %s', record)
+        for hook in hooks:
+            hook(record)
+
+    def record_commit(self, seconds: float):
+        with self.__lock:
+            self.commits += 1
+            self.phases['commit'].observe(seconds)
+
+    def record_call(self, function: str, seconds: float, failed: bool = False):
+        with self.__lock:
+            histogram = self.functions.get(function)
+            if histogram is None:
+                histogram = self.functions[function] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                self.function_errors[function] = self.function_errors.get(function, 0) + 1
+
+    # everything measured so far, as plain dicts and lists
+    def snapshot(self) -> dict:
+        with self.__lock:
+            return {'queries': self.queries,
+                    'commits': self.commits,
+                    'rows_returned': self.rows_returned,
+                    'rows_affected': self.rows_affected,
+                    'phases': {name: histogram.as_dict() for name, histogram in self.phases.items()},
+                    'functions': {name: histogram.as_dict() for name, histogram in self.functions.items()},
+                    'function_errors': dict(self.function_errors),
+                    'slow_queries': [record.as_dict() for record in self.slow_queries]}
+
+
+registry = Registry()
+
+
+def enable(slow_query_threshold: float = None):
+    registry.slow_query_threshold = slow_query_threshold
+    registry.enabled = True
+
+
+def disable():
+    registry.enabled = False
+
+
+# Decorator for the Solution.py API: records the call's latency under the function's name,
+# and tags the queries it runs with that name
+def instrumented(function):
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not registry.enabled:
+            return function(*args, **kwargs)
+        token = _current_function.set(name)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            registry.record_call(name, time.perf_counter() - start, failed)
+            _current_function.reset(token)
+
+    return wrapper
@@ -0,0 +1,89 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, List
+
+from Utility.ReturnValue import ReturnValue
+
+# Fans many calls of one Solution.py function out over a pool of workers, e.g. the nightly
+#     ParallelRunner.run_each(Solution.get_apartment_rating, apartment_ids, workers=8)
+#
+# - mode 'thread': the workers are threads of this process, and each call checks a connection out of the shared
+#   DBConnector pool, so size it for the workers first (Connector.configure_pool(max_size=workers))
+# - mode 'process': the workers are fresh ('spawn'ed) interpreters, each with a pool of its own. 'function' and the
+#   arguments / results must be picklable, so use module-level functions (Solution.get_owner_rating, ...), not lambdas
+#
+# At most 'workers' chunks of 'chunk_size' calls run at once, and a few more are queued, however many tasks there are.
+# Results come back in the order of the tasks; a call that raised (or a chunk that never ran) gives ReturnValue.ERROR.
+# The workers never run inside the caller's transaction.
+
+THREAD = 'thread'
+PROCESS = 'process'
+QUEUED_PER_WORKER = 2  # chunks submitted ahead per worker, bounds the memory of a huge task list
+
+
+# runs one chunk in a worker, capturing every call's failure on its own
+def _run_chunk(function: Callable, chunk: List[tuple]) -> list:
+    results = []
+    for args in chunk:
+        try:
+            results.append(function(*args))
+        except Exception as e:
+            results.append(ReturnValue.ERROR)
+    return results
+
+
+def _executor(mode: str, workers: int):
+    if mode == THREAD:
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ParallelRunner')
+    if mode == PROCESS:
+        # forked workers would share the parent's pooled connections (sockets included), spawned ones start clean
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    raise ValueError("Unknown mode: {}".format(mode))
+
+
+# Calls function(*args) for every 'args' tuple of 'tasks', on 'workers' workers, and returns the results in order.
+# 'progress', if given, is called from the calling thread as progress(done, total, failed) after every chunk
+# ('total' is None when 'tasks' has no len())
+def run(function: Callable, tasks: Iterable[tuple], workers: int = 4, mode: str = THREAD, chunk_size: int = None,
+        progress: Callable[[int, int, int], None] = None) -> list:
+    if workers < 1:
+        raise ValueError("workers must be positive")
+    if chunk_size is None:
+        chunk_size = 1 if mode == THREAD else 100  # a process round trip costs far more than a thread hand-off
+    total = len(tasks) if hasattr(tasks, '__len__') else None
+
+    results = []
+    pending = {}  # future -> (position of its first task, number of tasks)
+    done = failed = 0
+    tasks = iter(tasks)
+    with _executor(mode, workers) as executor:
+        while True:
+            while len(pending) < workers * QUEUED_PER_WORKER:
+                chunk = [tuple(args) for args in islice(tasks, chunk_size)]
+                if not chunk:
+                    break
+                pending[executor.submit(_run_chunk, function, chunk)] = (len(results), len(chunk))
+                results.extend([ReturnValue.ERROR] * len(chunk))
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                position, count = pending.pop(future)
+                try:
+                    results[position:position + count] = future.result()
+                except Exception as e:  # the chunk itself failed (unpicklable, a worker died...), its tasks stay ERROR
+                    pass
+                done += count
+                failed += sum(1 for result in results[position:position + count] if result == ReturnValue.ERROR)
+            if progress is not None:
+                progress(done, total, failed)
+    return results
+
+
+# run() for a function of a single argument, e.g. run_each(Solution.get_apartment_recommendation, customer_ids)
+def run_each(function: Callable, values: Iterable, workers: int = 4, mode: str = THREAD, chunk_size: int = None,
+             progress: Callable[[int, int, int], None] = None) -> list:
+    tasks = [(value,) for value in values] if hasattr(values, '__len__') else ((value,) for value in values)
+    return run(function, tasks, workers, mode, chunk_size, progress)
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# Diagnostic mode for the advanced API: while enabled, every call also runs its SELECT under
+# EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) and keeps the plan, keyed by (function name, arguments).
+# EXPLAIN ANALYZE executes the query a second time, so only enable it while investigating.
+
+enabled = False
+MAX_RUNS = 20  # plans kept per (function, arguments), oldest dropped first
+
+_plans: Dict[Tuple[str, tuple], deque] = {}
+_lock = threading.Lock()
+
+
+class CapturedPlan:
+    __slots__ = ('function', 'args', 'plan', 'captured_at')
+
+    def __init__(self, function: str, args: tuple, plan: dict):
+        self.function = function
+        self.args = args
+        self.plan = plan  # the single element of EXPLAIN's JSON output: {'Plan': ..., 'Execution Time': ...}
+        self.captured_at = time.time()
+
+    @property
+    def planning_time(self) -> Optional[float]:
+        return self.plan.get('Planning Time')
+
+    @property
+    def execution_time(self) -> Optional[float]:
+        return self.plan.get('Execution Time')
+
+    def nodes(self) -> List[dict]:
+        return list(_flatten(self.plan['Plan']))
+
+    def __str__(self):
+        lines = ['{}{}: planning {} ms, execution {} ms'.format(self.function, self.args, self.planning_time,
+                                                                self.execution_time)]
+        lines += ['  ' * node['depth'] + _describe(node) for node in self.nodes()]
+        return '\n'.join(lines)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def clear():
+    with _lock:
+        _plans.clear()
+
+
+# Called by the advanced API functions after their query ran (and committed) on 'conn'.
+# A failure is only reported, never propagated: the function already has its result.
+def capture(conn, function: str, statement_name: str, args: tuple = ()):
+    try:
+        plan = conn.explain_prepared(statement_name, args, "ANALYZE, BUFFERS")[0]
+    except Exception as e:
+        print('Could not capture the plan of {}: {}'.format(function, e))
+        return
+    captured = CapturedPlan(function, tuple(args), plan)
+    with _lock:
+        runs = _plans.get((function, captured.args))
+        if runs is None:
+            runs = _plans[(function, captured.args)] = deque(maxlen=MAX_RUNS)
+        runs.append(captured)
+
+
+# the captured plans, oldest first, of one function (and arguments) or of everything
+def plans(function: str = None, args: tuple = None) -> List[CapturedPlan]:
+    with _lock:
+        return [captured for (name, key_args), runs in _plans.items()
+                if (function is None or name == function) and (args is None or key_args == tuple(args))
+                for captured in runs]
+
+
+def latest(function: str, args: tuple = ()) -> Optional[CapturedPlan]:
+    with _lock:
+        runs = _plans.get((function, tuple(args)))
+        return runs[-1] if runs else None
+
+
+def _flatten(node: dict, depth: int = 0):
+    yield {'depth': depth,
+           'node_type': node.get('Node Type'),
+           'relation': node.get('Relation Name'),
+           'index': node.get('Index Name'),
+           'plan_rows': node.get('Plan Rows'),
+           'actual_rows': node.get('Actual Rows'),
+           'actual_loops': node.get('Actual Loops'),
+           'actual_time': node.get('Actual Total Time'),
+           'shared_hit': node.get('Shared Hit Blocks'),
+           'shared_read': node.get('Shared Read Blocks')}
+    for child in node.get('Plans', ()):
+        yield from _flatten(child, depth + 1)
+
+
+def _describe(node: dict) -> str:
+    target = node['index'] or node['relation']
+    return '{}{} (rows {} of {} planned, {} loops, {} ms, buffers hit {} read {})'.format(
+        node['node_type'], ' on ' + target if target else '', node['actual_rows'], node['plan_rows'],
+        node['actual_loops'], node['actual_time'], node['shared_hit'], node['shared_read'])
+
+
+# Node by node (pre-order) differences between two captured plans, as readable lines.
+# A change of shape (node type / relation / index) is reported as such; otherwise the row counts, timings and buffers
+# that changed by more than 'tolerance' (0.1 = 10%) are listed.
+def diff(old: CapturedPlan, new: CapturedPlan, tolerance: float = 0.1) -> List[str]:
+    changes = []
+    if _changed(old.execution_time, new.execution_time, tolerance):
+        changes.append('execution time: {} ms -> {} ms'.format(old.execution_time, new.execution_time))
+    old_nodes, new_nodes = old.nodes(), new.nodes()
+    for position, (before, after) in enumerate(zip(old_nodes, new_nodes)):
+        shape = ('depth', 'node_type', 'relation', 'index')
+        if any(before[field] != after[field] for field in shape):
+            changes.append('node {}: {} -> {}'.format(position, _describe(before), _describe(after)))
+            continue
+        for field in ('actual_rows', 'actual_loops', 'actual_time', 'shared_hit', 'shared_read'):
+            if _changed(before[field], after[field], tolerance):
+                changes.append('node {} ({}): {} {} -> {}'.format(position, after['node_type'], field, before[field],
+                                                                  after[field]))
+    for position, node in enumerate(old_nodes[len(new_nodes):], len(new_nodes)):
+        changes.append('node {} removed: {}'.format(position, _describe(node)))
+    for position, node in enumerate(new_nodes[len(old_nodes):], len(old_nodes)):
+        changes.append('node {} added: {}'.format(position, _describe(node)))
+    return changes
+
+
+def _changed(before, after, tolerance: float) -> bool:
+    if before is None or after is None:
+        return before != after
+    return abs(after - before) > tolerance * max(abs(before), abs(after))
@@ -0,0 +1,93 @@
+from typing import Dict, Iterable, List, Tuple
+
+# NumPy / SciPy are only needed by the batch recommendations, so they are imported on first use
+np = None
+sparse = None
+
+BATCH_SIZE = 2000  # customers expanded at once, bounds the memory of the (customer, apartment) candidates
+
+
+def _import():
+    global np, sparse
+    if np is None:
+        import numpy
+        import scipy.sparse
+        np, sparse = numpy, scipy.sparse
+
+
+# The rating-ratio recommendation of get_apartment_recommendation(), for many customers at once.
+# 'reviews' is an (n, 3) integer array of (cust_id, apartment_id, rating), one row per review.
+# For a customer c, every customer u that reviewed an apartment c reviewed gets
+#     ratio(u) = AVG over those common apartments of rating(c) / rating(u)     (ratio(c) itself is 1)
+# and every apartment b c didn't review gets the average, over the reviews (u, b) of those customers, of
+#     LEAST(GREATEST(ratio(u) * rating(u, b), 1), 10)
+# Returns cust_id -> [(apartment_id, approximation)] sorted by apartment_id ([] for a customer with no reviews).
+# The arithmetic is float64 where the SQL uses NUMERIC, so the values agree up to rounding in the last digits.
+def recommend(reviews, customers: Iterable[int], batch_size: int = BATCH_SIZE) -> Dict[int, List[Tuple[int, float]]]:
+    _import()
+    reviews = np.asarray(reviews, dtype=np.int64).reshape(-1, 3)
+    customers = list(dict.fromkeys(customers))
+    results = {cust_id: [] for cust_id in customers}
+    if reviews.shape[0] == 0 or not customers:
+        return results
+
+    cust_ids, cust_rows = np.unique(reviews[:, 0], return_inverse=True)
+    apt_ids, apt_cols = np.unique(reviews[:, 1], return_inverse=True)
+    ratings = reviews[:, 2].astype(np.float64)
+    shape = (len(cust_ids), len(apt_ids))
+    rated = sparse.csr_matrix((ratings, (cust_rows, apt_cols)), shape=shape)  # customer x apartment -> rating
+    rated.sort_indices()
+    inverse = rated.copy()
+    inverse.data = 1.0 / inverse.data  # same pattern, 1 / rating
+    reviewed = rated.copy()
+    reviewed.data = np.ones_like(reviewed.data)  # same pattern, 1
+
+    # only customers that reviewed something can get recommendations
+    requested = np.array(customers, dtype=np.int64)
+    positions = np.searchsorted(cust_ids, requested)
+    known = (positions < len(cust_ids)) & (cust_ids[np.minimum(positions, len(cust_ids) - 1)] == requested)
+    positions = positions[known]
+
+    for start in range(0, len(positions), batch_size):
+        batch = positions[start:start + batch_size]
+        for cust_id, recommendations in _recommend_batch(rated, inverse, reviewed, batch, apt_ids).items():
+            results[int(cust_ids[cust_id])] = recommendations
+    return results
+
+
+def _recommend_batch(rated, inverse, reviewed, batch, apt_ids) -> Dict[int, List[Tuple[int, float]]]:
+    # ratio(c, u): the sum of rating(c) / rating(u) over their common apartments, divided by how many there are.
+    # Both products have the same pattern (ratings are >= 1), so their data line up once the indices are sorted
+    ratio_sums = (rated[batch] @ inverse.T).tocsr()
+    ratio_counts = (reviewed[batch] @ reviewed.T).tocsr()
+    ratio_sums.sort_indices()
+    ratio_counts.sort_indices()
+    ratios = ratio_sums.tocoo()
+    weights = ratio_sums.data / ratio_counts.data
+    batch_rows, neighbours = ratios.row, ratios.col
+
+    # expand every (c, u, ratio) to the reviews of u: one candidate (c, b, clamped ratio * rating(u, b)) per review
+    starts = rated.indptr[neighbours]
+    lengths = rated.indptr[neighbours + 1] - starts
+    total = int(lengths.sum())
+    offsets = np.cumsum(lengths) - lengths
+    review_positions = np.arange(total) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+    candidate_rows = np.repeat(batch_rows, lengths)
+    candidate_cols = rated.indices[review_positions]
+    approximations = np.clip(np.repeat(weights, lengths) * rated.data[review_positions], 1, 10)
+
+    # average per (c, b), leaving out the apartments c reviewed itself
+    columns = rated.shape[1]
+    keys = candidate_rows.astype(np.int64) * columns + candidate_cols
+    own = reviewed[batch].tocoo()
+    keep = ~np.isin(keys, own.row.astype(np.int64) * columns + own.col)
+    unique_keys, groups = np.unique(keys[keep], return_inverse=True)
+    averages = np.bincount(groups, weights=approximations[keep]) / np.bincount(groups)
+
+    results = {}
+    rows, cols = np.divmod(unique_keys, columns)
+    boundaries = np.searchsorted(rows, np.arange(len(batch) + 1))
+    for batch_row, cust_position in enumerate(batch):
+        begin, end = boundaries[batch_row], boundaries[batch_row + 1]
+        results[int(cust_position)] = list(zip(apt_ids[cols[begin:end]].tolist(), averages[begin:end].tolist()))
+    return results
@@ -0,0 +1,66 @@
+import re
+import threading
+from typing import Dict, Tuple
+
+
+_parameter = re.compile(r'\$(\d+)')
+
+
+# A query that is parsed and planned once per connection (PREPARE) and then only executed (EXECUTE).
+# 'text' uses PostgreSQL's positional parameters ($1, $2, ...), 'arg_types' are the SQL types of those parameters.
+class Statement:
+    __slots__ = ('name', 'arg_types', 'text', 'prepare_sql', 'execute_sql', 'cursor_sql')
+
+    def __init__(self, name: str, arg_types: Tuple[str, ...], text: str):
+        self.name = name
+        self.arg_types = tuple(arg_types)
+        self.text = text
+        if self.arg_types:
+            self.prepare_sql = "PREPARE {} ({}) AS {}".format(name, ', '.join(self.arg_types), text)
+            self.execute_sql = "EXECUTE {} ({})".format(name, ', '.join(['%s'] * len(self.arg_types)))
+        else:
+            self.prepare_sql = "PREPARE {} AS {}".format(name, text)
+            self.execute_sql = "EXECUTE {}".format(name)
+        # a server-side cursor can't DECLARE an EXECUTE, so cursors get the text itself, with psycopg2 placeholders
+        # ('%(p1)s', ... bound with cursor_args()) cast to the declared types
+        if self.arg_types:
+            self.cursor_sql = _parameter.sub(lambda match: "%(p{0})s::{1}".format(
+                match.group(1), self.arg_types[int(match.group(1)) - 1]), text.replace('%', '%%'))
+        else:
+            self.cursor_sql = text
+
+    def cursor_args(self, args: tuple):
+        if not self.arg_types:
+            return None
+        return {'p{}'.format(position): value for position, value in enumerate(args, 1)}
+
+    def __str__(self):
+        return self.prepare_sql
+
+
+_registry: Dict[str, Statement] = {}
+_registry_lock = threading.Lock()
+
+
+# define a statement once, at import time of the module that uses it
+def register(name: str, arg_types: Tuple[str, ...], text: str) -> Statement:
+    name = name.lower()  # PostgreSQL folds unquoted identifiers
+    statement = Statement(name, arg_types, text)
+    with _registry_lock:
+        existing = _registry.get(name)
+        if existing is not None and (existing.arg_types, existing.text) != (statement.arg_types, statement.text):
+            raise ValueError("Statement {} is already registered with a different definition".format(name))
+        _registry[name] = statement
+    return statement
+
+
+def get(name: str) -> Statement:
+    try:
+        return _registry[name.lower()]
+    except KeyError:
+        raise KeyError("Unknown statement {}".format(name)) from None
+
+
+def all_statements() -> Dict[str, Statement]:
+    with _registry_lock:
+        return dict(_registry)
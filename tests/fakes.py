@@ -0,0 +1,142 @@
+# Stand-ins for the database side, so the Python logic around it can be tested without PostgreSQL.
+from psycopg2 import errors, extensions
+
+from Utility.Exceptions import DatabaseException
+
+
+# a psycopg2 connection / cursor pair that only records what it was asked to run
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 1
+        self.description = None
+
+    def execute(self, query, args=None):
+        self.connection.log.append(str(query))
+        self.connection.status = extensions.TRANSACTION_STATUS_INTRANS
+        failure = self.connection.failures.pop(str(query), None)
+        if failure is not None:
+            raise failure
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.prepared = set()
+        self.log = []
+        self.failures = {}  # query -> exception its next execution raises
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        self.log.append('COMMIT')
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.log.append('ROLLBACK')
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakePool:
+    def __init__(self):
+        self.connection = FakeConnection()
+        self.in_use = 0
+
+    def get(self):
+        self.in_use += 1
+        return self.connection
+
+    def put(self, connection, discard=False):
+        self.in_use -= 1
+
+
+class FakeResult:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+
+class FakeStream:
+    def __init__(self, rows):
+        self.__rows = list(rows)
+
+    def rows(self):
+        return iter(self.__rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+# The 'Reserves' table, as far as the reservation statements of Solution.py see it.
+# 'on_commit', when set, runs (once) when the next commit happens, to interleave another call with it
+class FakeReserves:
+    def __init__(self, rows=()):
+        self.rows = {(cust_id, apartment_id, start_date): end_date
+                     for apartment_id, cust_id, start_date, end_date in rows}
+        self.calls = []
+        self.on_commit = None
+
+    def overlapping(self, apartment_id, start_date, end_date) -> list:
+        return [key for key, end in self.rows.items()
+                if key[1] == apartment_id and key[2] < end_date and start_date < end]
+
+    def execute(self, name: str, args: tuple):
+        self.calls.append(name)
+        if name == 'customer_made_reservation':
+            cust_id, apartment_id, start_date, end_date, _ = args
+            if not start_date < end_date:
+                raise DatabaseException.CHECK_VIOLATION("CHECK_VIOLATION")
+            if self.overlapping(apartment_id, start_date, end_date):
+                raise DatabaseException.EXCLUSION_VIOLATION("EXCLUSION_VIOLATION")
+            self.rows[(cust_id, apartment_id, start_date)] = end_date
+            return 1, FakeResult()
+        if name == 'customer_cancelled_reservation':
+            return (1 if self.rows.pop(tuple(args), None) is not None else 0), FakeResult()
+        if name == 'booking_calendar_overlap':
+            if args[2] < args[1]:  # daterange() refuses a reversed range
+                raise errors.DataException("range lower bound must be less than or equal to range upper bound")
+            return 0, FakeResult([(1,)] if self.overlapping(*args) else [])
+        raise AssertionError("unexpected statement " + name)
+
+    def commit(self):
+        hook, self.on_commit = self.on_commit, None
+        if hook is not None:
+            hook()
+
+    def stream(self, name: str):
+        assert name == 'booking_calendar_rows'
+        return FakeStream([(apartment_id, cust_id, start_date, end_date)
+                           for (cust_id, apartment_id, start_date), end_date in self.rows.items()])
+
+
+# what Solution.py uses of a DBConnector, backed by a FakeReserves
+class FakeConnector:
+    def __init__(self, database: FakeReserves):
+        self.database = database
+
+    def execute_prepared(self, name: str, args: tuple = (), printSchema=False, commit=True):
+        result = self.database.execute(name, tuple(args))
+        if commit:
+            self.commit()
+        return result
+
+    def stream_prepared(self, name: str, args: tuple = (), fetch_size: int = None):
+        return self.database.stream(name)
+
+    def commit(self):
+        self.database.commit()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
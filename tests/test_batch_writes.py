@@ -0,0 +1,111 @@
+from datetime import date
+
+import pytest
+
+import Solution
+from Utility.Exceptions import DatabaseException
+from Utility.ReturnValue import ReturnValue
+from fakes import FakeResult
+
+JAN_1, JAN_5, JAN_9 = date(2024, 1, 1), date(2024, 1, 5), date(2024, 1, 9)
+
+
+# what _batch_write uses of a DBConnector: every statement is answered by 'answer(rows)' -> [(index, status)]
+class FakeBatchConnector:
+    def __init__(self, answer):
+        self.answer = answer
+        self.statements = []  # the rows sent by every statement
+
+    def execute_values(self, query, rows, template, printSchema=False, commit=True):
+        rows = list(rows)
+        self.statements.append(rows)
+        assert query.count('%s') == 1 and template.count('%s') == len(rows[0])
+        return len(rows), FakeResult(self.answer(rows))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    def install(answer):
+        fake = FakeBatchConnector(answer)
+        monkeypatch.setattr(Solution.Connector, 'DBConnector', lambda: fake)
+        return fake
+    yield install
+    Solution.disable_booking_calendar()
+
+
+def test_invalid_rows_are_rejected_before_the_statement(connector):
+    fake = connector(lambda rows: [(row[0], 'OK') for row in rows])
+    results = Solution.customers_made_reservations([
+        (1, 1, JAN_1, JAN_5, 100),
+        (1, 1, JAN_5, JAN_1, 100),  # ends before it starts
+        (0, 1, JAN_1, JAN_5, 100),  # bad id
+        (1, 1, JAN_1, JAN_5, 0.2),  # price rounds to 0
+        (1, 1, None, JAN_5, 100),
+        (1, 1, JAN_1),  # not a reservation at all
+        (2, 1, JAN_5, JAN_9, 100),
+    ])
+    assert results == [ReturnValue.OK] + [ReturnValue.BAD_PARAMS] * 5 + [ReturnValue.OK]
+    # one statement, with the valid rows tagged with their position in the input
+    assert fake.statements == [[(0, 1, 1, JAN_1, JAN_5, 100), (6, 2, 1, JAN_5, JAN_9, 100)]]
+
+
+def test_statuses_are_mapped_back_by_index(connector):
+    statuses = {0: 'OK', 1: 'NOT_EXISTS', 2: 'ALREADY_EXISTS', 3: 'BAD_PARAMS'}
+    connector(lambda rows: [(row[0], statuses[row[0]]) for row in reversed(rows)])
+    reviews = [(1, 1, JAN_5, 5, 'good'), (2, 1, JAN_5, 5, 'good'), (1, 1, JAN_9, 6, 'again'), (3, 1, JAN_5, 5, None)]
+    assert Solution.customers_reviewed_apartments(reviews) == [ReturnValue.OK, ReturnValue.NOT_EXISTS,
+                                                               ReturnValue.ALREADY_EXISTS, ReturnValue.BAD_PARAMS]
+
+
+def test_ratings_out_of_range_are_bad_params(connector):
+    fake = connector(lambda rows: [(row[0], 'OK') for row in rows])
+    updates = [(1, 1, JAN_5, 0, 'text'), (1, 2, JAN_5, 11, 'text'), (1, 3, JAN_5, 7.5, 'text')]
+    assert Solution.customers_updated_reviews(updates) == [ReturnValue.BAD_PARAMS] * 3
+    assert fake.statements == []
+
+
+def test_updates_of_the_same_review_go_in_separate_statements(connector):
+    fake = connector(lambda rows: [(row[0], 'OK') for row in rows])
+    updates = [(1, 1, JAN_1, 5, 'a'), (2, 1, JAN_1, 5, 'b'), (1, 1, JAN_5, 6, 'c'), (1, 1, JAN_9, 7, 'd')]
+    assert Solution.customers_updated_reviews(updates) == [ReturnValue.OK] * 4
+    assert [[row[0] for row in rows] for rows in fake.statements] == [[0, 1], [2], [3]]
+
+
+def test_a_failing_statement_fails_only_its_rows(connector):
+    def answer(rows):
+        if any(row[0] == 2 for row in rows):
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+        return [(row[0], 'OK') for row in rows]
+    connector(answer)
+    updates = [(1, 1, JAN_1, 5, 'a'), (1, 1, JAN_5, 6, 'b'), (2, 2, JAN_1, 5, 'c')]
+    assert Solution.customers_updated_reviews(updates, chunk_size=2) == [ReturnValue.OK, ReturnValue.OK,
+                                                                         ReturnValue.ERROR]
+
+
+def test_cancellations(connector):
+    connector(lambda rows: [(row[0], 'OK' if row[0] == 0 else 'NOT_EXISTS') for row in rows])
+    cancellations = [(1, 1, JAN_1), (1, 1, JAN_1), (-1, 1, JAN_1)]
+    assert Solution.customers_cancelled_reservations(cancellations) == [ReturnValue.OK, ReturnValue.NOT_EXISTS,
+                                                                        ReturnValue.BAD_PARAMS]
+
+
+def test_batch_reservations_keep_the_booking_calendar_in_sync(connector, monkeypatch):
+    connector(lambda rows: [(row[0], 'OK' if row[0] == 0 else 'BAD_PARAMS') for row in rows])
+    calendar = Solution.BookingCalendar()
+    monkeypatch.setattr(Solution, '_booking_calendar', calendar)
+    Solution.customers_made_reservations([(1, 1, JAN_1, JAN_5, 100), (2, 2, JAN_1, JAN_5, 100)])
+    assert calendar.overlaps(1, JAN_1, JAN_5)
+    assert not calendar.overlaps(2, JAN_1, JAN_5)
+
+    connector(lambda rows: [(row[0], 'OK') for row in rows])
+    Solution.customers_cancelled_reservations([(1, 1, JAN_1)])
+    assert not calendar.overlaps(1, JAN_1, JAN_5)
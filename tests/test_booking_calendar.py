@@ -0,0 +1,173 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import Solution
+import Utility.BookingCalendar as BookingCalendarModule
+from Utility.BookingCalendar import BookingCalendar
+from Utility.ReturnValue import ReturnValue
+from fakes import FakeConnector, FakeReserves
+
+DAY = date(2024, 1, 1)
+
+
+def day(offset: int) -> date:
+    return DAY + timedelta(days=offset)
+
+
+def test_overlaps_is_half_open():
+    calendar = BookingCalendar()
+    calendar.warm([(1, 10, day(0), day(5)), (1, 11, day(10), day(12))])
+    assert calendar.overlaps(1, day(4), day(6))
+    assert calendar.overlaps(1, day(-10), day(20))
+    assert not calendar.overlaps(1, day(5), day(10))  # between the two stays, touching both
+    assert not calendar.overlaps(2, day(0), day(5))  # another apartment
+
+
+def test_overlaps_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(500):
+        calendar = BookingCalendar()
+        stays = []
+        for customer_id in range(10):
+            start = rng.randint(0, 50)
+            end = start + rng.randint(1, 6)
+            if not any(a < end and start < b for a, b in stays):
+                stays.append((start, end))
+                calendar.add(1, customer_id, day(start), day(end))
+        start = rng.randint(0, 55)
+        end = start + rng.randint(1, 8)
+        assert calendar.overlaps(1, day(start), day(end)) == any(a < end and start < b for a, b in stays)
+
+
+def test_removals():
+    calendar = BookingCalendar()
+    calendar.warm([(1, 10, day(0), day(5)), (2, 10, day(0), day(5)), (3, 11, day(0), day(5))])
+    calendar.remove(3, day(0))
+    calendar.remove_customer(10)
+    assert calendar.size() == 0
+    calendar.add(4, 12, day(0), day(5))
+    calendar.remove_apartment(4)
+    assert not calendar.overlaps(4, day(0), day(5))
+
+
+def test_cancel_between_commit_and_add_leaves_no_phantom():
+    calendar = BookingCalendar()
+    ticket = calendar.ticket()  # the reservation is about to be written
+    calendar.remove(1, day(0))  # ... and was cancelled (by another thread) before the writer got to add it
+    calendar.add(1, 10, day(0), day(5), ticket)
+    assert not calendar.overlaps(1, day(0), day(5))
+    assert calendar.stats()['ignored_adds'] == 1
+
+
+def test_removal_of_the_apartment_or_customer_also_voids_the_ticket():
+    calendar = BookingCalendar()
+    ticket = calendar.ticket()
+    calendar.remove_apartment(1)
+    calendar.add(1, 10, day(0), day(5), ticket)
+    ticket = calendar.ticket()
+    calendar.remove_customer(11)
+    calendar.add(2, 11, day(0), day(5), ticket)
+    assert calendar.size() == 0
+
+
+def test_unrelated_removal_keeps_the_ticket_valid():
+    calendar = BookingCalendar()
+    ticket = calendar.ticket()
+    calendar.remove(2, day(0))
+    calendar.remove(1, day(7))
+    calendar.add(1, 10, day(0), day(5), ticket)
+    assert calendar.overlaps(1, day(0), day(5))
+
+
+def test_removal_before_the_ticket_doesnt_void_it():
+    calendar = BookingCalendar()
+    calendar.remove(1, day(0))
+    ticket = calendar.ticket()
+    calendar.add(1, 10, day(0), day(5), ticket)
+    assert calendar.overlaps(1, day(0), day(5))
+
+
+def test_expired_or_foreign_tickets_are_ignored(monkeypatch):
+    calendar = BookingCalendar()
+    calendar.add(1, 10, day(0), day(5), BookingCalendar().ticket())
+    monkeypatch.setattr(BookingCalendarModule, 'TICKET_TTL', -1.0)
+    calendar.add(2, 10, day(0), day(5), calendar.ticket())
+    assert calendar.size() == 0
+    assert calendar.stats()['ignored_adds'] == 2
+
+
+def test_remove_stale_drops_the_overlapping_stays():
+    calendar = BookingCalendar()
+    calendar.warm([(1, 10, day(0), day(5)), (1, 11, day(5), day(8)), (1, 12, day(20), day(22))])
+    assert calendar.overlaps(1, day(4), day(6))
+    calendar.remove_stale(1, day(4), day(6))
+    assert not calendar.overlaps(1, day(0), day(8))
+    assert calendar.overlaps(1, day(20), day(21))
+    stats = calendar.stats()
+    assert (stats['rejects'], stats['stale_hits'], stats['bookings']) == (1, 1, 1)
+
+
+@pytest.fixture
+def reserves(monkeypatch):
+    database = FakeReserves()
+    monkeypatch.setattr(Solution.Connector, 'DBConnector', lambda: FakeConnector(database))
+    yield database
+    Solution.disable_booking_calendar()
+
+
+def test_solution_cancel_between_commit_and_add(reserves):
+    calendar = Solution.enable_booking_calendar(sole_writer=True)
+    # the cancellation runs right when the reservation commits, before customer_made_reservation updates the calendar
+    reserves.on_commit = lambda: Solution.customer_cancelled_reservation(10, 1, day(0))
+    assert Solution.customer_made_reservation(10, 1, day(0), day(5), 100) == ReturnValue.OK
+    assert reserves.rows == {}
+    assert not calendar.overlaps(1, day(0), day(5))
+
+    # so the same stay is still sent to the database, instead of being rejected by a phantom booking
+    reserves.calls.clear()
+    assert Solution.customer_made_reservation(11, 1, day(1), day(3), 100) == ReturnValue.OK
+    assert reserves.calls == ['customer_made_reservation']
+
+
+def test_solution_sole_writer_rejects_locally(reserves):
+    reserves.rows[(10, 1, day(0))] = day(5)
+    Solution.enable_booking_calendar(sole_writer=True)
+    reserves.calls.clear()
+    assert Solution.customer_made_reservation(11, 1, day(2), day(3), 100) == ReturnValue.BAD_PARAMS
+    assert reserves.calls == []
+
+
+def test_solution_confirms_overlaps_with_the_database(reserves):
+    reserves.rows[(10, 1, day(0))] = day(5)
+    reserves.rows[(10, 2, day(0))] = day(5)
+    calendar = Solution.enable_booking_calendar()
+    # cancelled by another process: the calendar never heard of it
+    del reserves.rows[(10, 1, day(0))]
+
+    reserves.calls.clear()
+    assert Solution.customer_made_reservation(11, 1, day(2), day(3), 100) == ReturnValue.OK
+    assert reserves.calls == ['booking_calendar_overlap', 'customer_made_reservation']
+    assert Solution.customer_made_reservation(11, 2, day(2), day(3), 100) == ReturnValue.BAD_PARAMS
+    stats = calendar.stats()
+    assert (stats['rejects'], stats['stale_hits']) == (1, 1)
+
+
+def test_empty_or_reversed_ranges_overlap_nothing():
+    calendar = BookingCalendar()
+    calendar.warm([(1, 10, day(0), day(5))])
+    assert not calendar.overlaps(1, day(3), day(2))
+    assert not calendar.overlaps(1, day(2), day(2))
+    assert calendar.stats()['rejects'] == 0
+
+
+@pytest.mark.parametrize('sole_writer', [False, True])
+@pytest.mark.parametrize('start, end', [(day(3), day(2)), (day(2), day(2))])
+def test_solution_leaves_bad_ranges_to_the_database(reserves, sole_writer, start, end):
+    reserves.rows[(10, 1, day(0))] = day(5)
+    calendar = Solution.enable_booking_calendar(sole_writer=sole_writer)
+    reserves.calls.clear()
+    assert Solution.customer_made_reservation(11, 1, start, end, 100) == ReturnValue.BAD_PARAMS
+    assert reserves.calls == ['customer_made_reservation']  # rejected by the CHECK constraint
+    assert calendar.overlaps(1, day(0), day(5))  # the booked stay is still known
@@ -0,0 +1,108 @@
+from operator import itemgetter
+
+import pytest
+
+import Solution
+from Business.Apartment import Apartment
+from Business.Customer import Customer
+from Business.Owner import Owner
+from Utility.Exceptions import DatabaseException
+from Utility.ReturnValue import ReturnValue
+from fakes import FakeResult
+
+
+def test_rounds_separate_rows_sharing_a_key():
+    rows = list(enumerate([(1, 'a'), (2, 'b'), (1, 'c'), (3, 'b'), (1, 'd')]))
+    rounds = Solution._rounds(rows, (itemgetter(0), itemgetter(1)))
+    assert rounds == [[(0, (1, 'a')), (1, (2, 'b'))], [(2, (1, 'c')), (3, (3, 'b'))], [(4, (1, 'd'))]]
+
+
+def test_rounds_keep_every_row_after_the_earlier_rows_it_clashes_with():
+    rows = list(enumerate([(5,), (6,), (5,), (7,), (6,), (5,)]))
+    rounds = Solution._rounds(rows, (itemgetter(0),))
+    position = {index: number for number, round_rows in enumerate(rounds) for index, _ in round_rows}
+    for index, row in rows:
+        assert len({row[0] for _, row in rounds[position[index]]}) == len(rounds[position[index]])
+        assert all(position[earlier] < position[index] for earlier, other in rows[:index] if other == row)
+
+
+# what _bulk_add uses of a DBConnector: the staged rows are inserted unless their key (first column) exists
+class FakeBulkConnector:
+    def __init__(self, existing=(), failing=()):
+        self.existing = set(existing)
+        self.failing = set(failing)  # keys whose round fails
+        self.staged = []
+        self.rounds = 0
+
+    def execute(self, query, printSchema=False, commit=True):
+        if query.startswith('CREATE TEMP TABLE'):
+            self.staged = []
+            return 0, FakeResult()
+        assert query.startswith('INSERT INTO')
+        self.rounds += 1
+        if self.failing & {row[0] for row in self.staged}:
+            raise DatabaseException.ConnectionInvalid("Connection Invalid")
+        inserted = [(row[0],) for row in self.staged if row[0] not in self.existing]
+        self.existing.update(key for key, in inserted)
+        return len(inserted), FakeResult(inserted)
+
+    def copy_in(self, table, columns, rows):
+        self.staged = list(rows)
+        return len(self.staged)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    def install(**kwargs):
+        fake = FakeBulkConnector(**kwargs)
+        monkeypatch.setattr(Solution.Connector, 'DBConnector', lambda: fake)
+        return fake
+    return install
+
+
+def test_add_owners_reports_every_row(connector):
+    fake = connector(existing={3})
+    owners = [Owner(1, 'a'), Owner(2, 'b'), Owner(1, 'again'), Owner(3, 'exists'), Owner(0, 'bad id'), Owner(4, None)]
+    assert Solution.add_owners(owners) == [ReturnValue.OK, ReturnValue.OK, ReturnValue.ALREADY_EXISTS,
+                                           ReturnValue.ALREADY_EXISTS, ReturnValue.BAD_PARAMS, ReturnValue.BAD_PARAMS]
+    assert fake.rounds == 2  # the second owner 1 waits for the round after the first one
+
+
+def test_add_owners_chunks(connector):
+    connector()
+    results = Solution.add_owners((Owner(i, 'owner') for i in range(1, 26)), chunk_size=10)
+    assert results == [ReturnValue.OK] * 25
+
+
+def test_a_failing_round_only_fails_its_rows(connector):
+    connector(failing={2})
+    owners = [Owner(1, 'a'), Owner(2, 'b'), Owner(1, 'again')]
+    # the first owner 1 was rolled back with its round, so the later one gets in
+    assert Solution.add_owners(owners) == [ReturnValue.ERROR, ReturnValue.ERROR, ReturnValue.OK]
+
+
+def test_add_apartments_clash_on_the_address_too(connector):
+    fake = connector()
+    apartments = [Apartment(1, 'street', 'city', 'country', 50), Apartment(2, 'street', 'city', 'country', 60),
+                  Apartment(3, 'street', 'city', 'country', 0.4)]
+    results = Solution.add_apartments(apartments)
+    assert results[2] == ReturnValue.BAD_PARAMS  # rounds to size 0
+    assert fake.rounds == 2  # same address: the second apartment is staged after the first
+
+
+def test_bulk_add_without_a_connection_reports_valid_rows_as_errors(monkeypatch):
+    def unavailable():
+        raise DatabaseException.ConnectionInvalid("pool exhausted")
+    monkeypatch.setattr(Solution.Connector, 'DBConnector', unavailable)
+    assert Solution.add_customers([]) == []
+    assert Solution.add_customers([Customer(1, 'a'), Customer(-1, 'b')]) == [ReturnValue.ERROR,
+                                                                            ReturnValue.BAD_PARAMS]
@@ -0,0 +1,192 @@
+import threading
+import time
+
+import pytest
+from psycopg2 import extensions
+
+import Utility.ConnectionPool as ConnectionPoolModule
+import Utility.DBConnector as Connector
+from Utility.ConnectionPool import ConnectionPool
+from Utility.Exceptions import DatabaseException
+
+
+# what the pool uses of a psycopg2 connection
+class FakePgConnection:
+    def __init__(self, number: int):
+        self.number = number
+        self.closed = False
+        self.returned_at = time.monotonic()
+        self.prepared = set()
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.healthy = True
+        self.log = []
+
+    def cursor(self):
+        return FakePgCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.log.append('ROLLBACK')
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = True
+
+
+class FakePgCursor:
+    def __init__(self, connection: FakePgConnection):
+        self.connection = connection
+
+    def execute(self, query):
+        self.connection.log.append(query)
+        if not self.connection.healthy:
+            raise Exception("server closed the connection unexpectedly")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+
+    def connect(connection_factory=None, **params):
+        opened.append(FakePgConnection(len(opened)))
+        return opened[-1]
+    monkeypatch.setattr(ConnectionPoolModule.psycopg2, 'connect', connect)
+    return opened
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        ConnectionPool({}, min_size=3, max_size=2)
+    with pytest.raises(ValueError):
+        ConnectionPool({}, max_size=0)
+
+
+def test_checkouts_are_bounded_and_time_out(connections):
+    pool = ConnectionPool({}, max_size=2, timeout=0.05)
+    pool.get(), pool.get()
+    with pytest.raises(DatabaseException.ConnectionInvalid):
+        pool.get()
+    stats = pool.get_stats()
+    assert len(connections) == 2
+    assert (stats['checkouts'], stats['waits'], stats['timeouts'], stats['peak_in_use']) == (2, 1, 1, 2)
+
+
+def test_a_waiting_checkout_gets_the_returned_connection(connections):
+    pool = ConnectionPool({}, max_size=1, timeout=5.0)
+    first = pool.get()
+    returner = threading.Timer(0.05, pool.put, (first,))
+    returner.start()
+    assert pool.get() is first
+    returner.join()
+    assert pool.get_stats()['waits'] == 1
+    assert len(connections) == 1
+
+
+def test_idle_connections_are_reused_most_recent_first(connections):
+    pool = ConnectionPool({}, max_size=3)
+    first, second = pool.get(), pool.get()
+    pool.put(first)
+    pool.put(second)
+    assert pool.get() is second
+    assert pool.get() is first
+    assert pool.get_stats()['creations'] == 2
+
+
+def test_long_idle_connections_are_closed_down_to_min_size(connections):
+    pool = ConnectionPool({}, min_size=1, max_size=3, max_idle=10.0)
+    first, second, third = pool.get(), pool.get(), pool.get()
+    for connection in (first, second, third):
+        pool.put(connection)
+    first.returned_at -= 100
+    second.returned_at -= 100
+    assert pool.get() is third  # evicts 'first' and 'second' on its way
+    assert first.closed and second.closed
+    assert pool.get_stats()['evictions'] == 2
+
+    pool.put(third)
+    third.returned_at -= 100
+    assert pool.get() is third  # the last one is kept, min_size is 1
+    assert pool.size() == 1
+
+
+def test_a_connection_idle_for_a_while_is_checked_first(connections):
+    pool = ConnectionPool({}, health_check_after=5.0)
+    first = pool.get()
+    pool.put(first)
+    assert pool.get() is first
+    assert first.log == []  # recently used, not pinged
+    pool.put(first)
+
+    first.returned_at -= 10
+    assert pool.get() is first
+    assert first.log == ["SELECT 1", 'ROLLBACK']
+    pool.put(first)
+
+    first.returned_at -= 10
+    first.healthy = False
+    replacement = pool.get()
+    assert replacement is not first and first.closed
+    stats = pool.get_stats()
+    assert (stats['failed_health_checks'], stats['discards'], stats['in_use']) == (1, 1, 1)
+
+
+def test_put_rolls_back_or_discards(connections):
+    pool = ConnectionPool({})
+    first = pool.get()
+    first.status = extensions.TRANSACTION_STATUS_INTRANS
+    pool.put(first)
+    assert first.log == ['ROLLBACK'] and pool.idle() == 1
+
+    first = pool.get()
+    first.status = extensions.TRANSACTION_STATUS_UNKNOWN  # the connection is broken
+    pool.put(first)
+    assert first.closed and pool.idle() == 0
+
+    second = pool.get()
+    pool.put(second, discard=True)
+    assert second.closed
+    stats = pool.get_stats()
+    assert (stats['returns'], stats['discards'], stats['size']) == (3, 2, 0)
+
+
+def test_warm_and_close(connections):
+    pool = ConnectionPool({}, min_size=2, max_size=4)
+    pool.warm()
+    assert (pool.size(), pool.idle()) == (2, 2)
+    checked_out = pool.get()
+    pool.close()
+    assert [connection.closed for connection in connections] == [True, False]
+    with pytest.raises(DatabaseException.ConnectionInvalid):
+        pool.get()
+    pool.put(checked_out)
+    assert checked_out.closed
+
+
+def test_a_failed_connect_frees_its_slot(monkeypatch):
+    def connect(**params):
+        raise Exception("could not connect to server")
+    monkeypatch.setattr(ConnectionPoolModule.psycopg2, 'connect', connect)
+    pool = ConnectionPool({}, max_size=1)
+    for _ in range(2):
+        with pytest.raises(DatabaseException.ConnectionInvalid):
+            pool.get()
+    assert pool.in_use() == 0
+
+
+def test_pool_stats_of_the_shared_pool(connections, monkeypatch):
+    monkeypatch.setattr(Connector, '_pool', None)
+    monkeypatch.setattr(Connector.DBConnector, 'config', staticmethod(lambda: {}))
+    pool = Connector.configure_pool(min_size=0, max_size=2)
+    assert Connector.get_pool() is pool
+    pool.put(pool.get())
+    stats = Connector.pool_stats()
+    assert (stats['checkouts'], stats['returns'], stats['max_size'], stats['idle']) == (1, 1, 2, 1)
+    pool.close()
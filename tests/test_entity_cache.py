@@ -0,0 +1,51 @@
+import pytest
+
+from Utility.EntityCache import EntityCache
+
+
+def test_get_put_and_lru_eviction():
+    cache = EntityCache(max_size=2, ttl=None)
+    cache.put(('owner', 1), 'a')
+    cache.put(('owner', 2), 'b')
+    assert cache.get(('owner', 1)) == 'a'  # now the most recently used
+    cache.put(('owner', 3), 'c')
+    assert cache.get(('owner', 2)) is EntityCache.MISS
+    assert cache.get(('owner', 1)) == 'a'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_none_is_a_cached_value():
+    cache = EntityCache()
+    cache.put(('owner', 1), None)
+    assert cache.get(('owner', 1)) is None
+
+
+def test_entries_expire():
+    cache = EntityCache(ttl=-1.0)
+    cache.put(('owner', 1), 'a')
+    assert cache.get(('owner', 1)) is EntityCache.MISS
+    assert cache.stats()['expirations'] == 1
+
+
+def test_a_read_that_raced_an_invalidation_is_not_stored():
+    cache = EntityCache()
+    epoch = cache.epoch()  # a reader starts loading ('owner', 1)
+    cache.invalidate(('owner', 1))  # a writer changes it meanwhile
+    cache.put(('owner', 1), 'stale', epoch)
+    assert cache.get(('owner', 1)) is EntityCache.MISS
+    cache.put(('owner', 1), 'fresh', cache.epoch())
+    assert cache.get(('owner', 1)) == 'fresh'
+
+
+def test_invalidate_where():
+    cache = EntityCache()
+    cache.put(('apartment_owner', 1), (7, 'owner'))
+    cache.put(('apartment_owner', 2), (8, 'other'))
+    cache.invalidate_where(lambda key, row: row is not None and row[0] == 7)
+    assert cache.get(('apartment_owner', 1)) is EntityCache.MISS
+    assert cache.get(('apartment_owner', 2)) == (8, 'other')
+
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        EntityCache(max_size=0)
@@ -0,0 +1,99 @@
+import pytest
+
+import Utility.DBConnector as Connector
+import Utility.Instrumentation as Instrumentation
+from Utility.Instrumentation import Histogram, instrumented
+from fakes import FakePool
+
+
+@pytest.fixture
+def registry():
+    Instrumentation.registry.reset()
+    yield Instrumentation.registry
+    Instrumentation.disable()
+    Instrumentation.registry.reset()
+
+
+def test_empty_histogram():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) is None
+    assert histogram.as_dict()['mean'] is None
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram()
+    for seconds in [0.0002] * 50 + [0.003] * 45 + [0.2] * 4 + [7.0]:
+        histogram.observe(seconds)
+    assert histogram.quantile(0.5) == 0.0005
+    assert histogram.quantile(0.95) == 0.005
+    assert histogram.quantile(0.99) == 0.25
+    assert histogram.quantile(1.0) == 7.0  # in the (5, 10] bucket, but nothing took longer than 7
+    summary = histogram.as_dict()
+    assert (summary['count'], summary['min'], summary['max']) == (100, 0.0002, 7.0)
+    assert summary['mean'] == pytest.approx(sum([0.0002] * 50 + [0.003] * 45 + [0.2] * 4 + [7.0]) / 100)
+    assert summary['buckets']['0.0005'] == 50 and summary['buckets']['+Inf'] == 0
+
+
+def test_the_last_bucket_has_no_bound():
+    histogram = Histogram()
+    histogram.observe(20.0)
+    assert histogram.quantile(0.5) == 20.0
+    assert histogram.as_dict()['buckets']['+Inf'] == 1
+
+
+@instrumented
+def api_call(fail: bool = False):
+    Instrumentation.registry.record_query("SELECT 1", (), 0.001, 0.0, 0.0, 1, 0)
+    if fail:
+        raise ValueError
+    return 'result'
+
+
+def test_disabled_instrumentation_records_nothing(registry):
+    assert api_call() == 'result'
+    assert api_call.__name__ == 'api_call'
+    assert registry.snapshot()['functions'] == {}
+
+
+def test_enabled_instrumentation_records_calls_and_their_queries(registry):
+    records = []
+    registry.add_hook(records.append)
+    Instrumentation.enable()
+    assert api_call() == 'result'
+    with pytest.raises(ValueError):
+        api_call(fail=True)
+    registry.record_query("SELECT 2", (), 0.001, 0.0, 0.0, 1, 0)
+    registry.remove_hook(records.append)
+
+    snapshot = registry.snapshot()
+    assert snapshot['functions']['api_call']['count'] == 2
+    assert snapshot['function_errors'] == {'api_call': 1}
+    assert [record.function for record in records] == ['api_call', 'api_call', None]
+    assert (snapshot['queries'], snapshot['rows_returned']) == (3, 3)
+
+
+def test_commits_and_slow_queries(registry):
+    Instrumentation.enable(slow_query_threshold=0.01)
+    registry.record_commit(0.002)
+    registry.record_query("SELECT fast", None, 0.001, 0.0, 0.0, 0, 1)
+    registry.record_query("SELECT slow", None, 0.005, 0.004, 0.0, 0, 1, commit_time=0.002)
+    snapshot = registry.snapshot()
+    assert snapshot['commits'] == 1 and snapshot['phases']['commit']['count'] == 1
+    assert [record['query'] for record in snapshot['slow_queries']] == ["SELECT slow"]
+    assert snapshot['slow_queries'][0]['total_time'] == pytest.approx(0.011)
+
+
+def test_connector_times_commits_as_their_own_phase(registry):
+    records = []
+    registry.add_hook(records.append)
+    Instrumentation.enable()
+    pool = FakePool()
+    conn = Connector.DBConnector(pool)
+    conn.execute("INSERT 1")
+    conn.execute("INSERT 2", commit=False)
+    conn.commit()
+    conn.close()
+    registry.remove_hook(records.append)
+    snapshot = registry.snapshot()
+    assert (snapshot['queries'], snapshot['commits'], snapshot['phases']['commit']['count']) == (2, 2, 2)
+    assert [record.query for record in records] == ["INSERT 1", "INSERT 2"]
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+import Utility.ParallelRunner as ParallelRunner
+from Utility.ReturnValue import ReturnValue
+
+
+def slow_square(value: int) -> int:
+    time.sleep(0.001 * (value % 3))  # finishes out of order
+    return value * value
+
+
+def fails_on_seven(value: int) -> int:
+    if value == 7:
+        raise RuntimeError("seven")
+    return value
+
+
+def test_results_come_back_in_task_order():
+    assert ParallelRunner.run_each(slow_square, range(40), workers=4) == [value * value for value in range(40)]
+    assert ParallelRunner.run(pow, [(2, 3), (3, 2)], workers=2, chunk_size=1) == [8, 9]
+
+
+def test_a_failed_call_only_fails_its_own_result():
+    results = ParallelRunner.run_each(fails_on_seven, range(10), workers=3, chunk_size=4)
+    assert results == [0, 1, 2, 3, 4, 5, 6, ReturnValue.ERROR, 8, 9]
+
+
+def test_generators_and_progress():
+    reports = []
+    results = ParallelRunner.run_each(fails_on_seven, (value for value in range(10)), workers=2, chunk_size=3,
+                                      progress=lambda *report: reports.append(report))
+    assert results[7] == ReturnValue.ERROR and len(results) == 10
+    assert reports[-1] == (10, None, 1)  # a generator has no len()
+    assert [done for done, _, _ in reports] == sorted(done for done, _, _ in reports)
+
+
+def test_no_more_than_workers_calls_at_once():
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def call(value):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.002)
+        with lock:
+            running[0] -= 1
+        return value
+    assert ParallelRunner.run_each(call, range(30), workers=3) == list(range(30))
+    assert peak[0] <= 3
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        ParallelRunner.run_each(slow_square, [1], workers=0)
+    with pytest.raises(ValueError):
+        ParallelRunner.run_each(slow_square, [1], mode='fiber')
@@ -0,0 +1,81 @@
+import pytest
+
+import Utility.PlanCapture as PlanCapture
+from Utility.PlanCapture import CapturedPlan
+
+
+def scan(node_type, relation=None, index=None, rows=10, time=1.0, hit=5, read=0, plans=()):
+    return {'Node Type': node_type, 'Relation Name': relation, 'Index Name': index, 'Plan Rows': 10,
+            'Actual Rows': rows, 'Actual Loops': 1, 'Actual Total Time': time, 'Shared Hit Blocks': hit,
+            'Shared Read Blocks': read, 'Plans': list(plans)}
+
+
+# the single element of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)'s output
+def explain(root, execution_time=2.0):
+    return {'Plan': root, 'Planning Time': 0.1, 'Execution Time': execution_time}
+
+
+OLD = explain(scan('Hash Join', plans=[scan('Seq Scan', 'reserves', rows=1000, time=5.0, read=40),
+                                       scan('Hash', plans=[scan('Seq Scan', 'apartments')])]), 6.0)
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    yield
+    PlanCapture.disable()
+    PlanCapture.clear()
+
+
+def test_nodes_are_flattened_depth_first():
+    plan = CapturedPlan('get_top_customers_list', (), OLD)
+    assert [(node['depth'], node['node_type'], node['relation']) for node in plan.nodes()] == [
+        (0, 'Hash Join', None), (1, 'Seq Scan', 'reserves'), (1, 'Hash', None), (2, 'Seq Scan', 'apartments')]
+    assert str(plan).splitlines()[2] == \
+        '  Seq Scan on reserves (rows 1000 of 10 planned, 1 loops, 5.0 ms, buffers hit 5 read 40)'
+
+
+def test_diff_of_the_same_plan_is_empty():
+    assert PlanCapture.diff(CapturedPlan('f', (), OLD), CapturedPlan('f', (), OLD)) == []
+
+
+def test_diff_reports_changed_figures_beyond_the_tolerance():
+    new = explain(scan('Hash Join', time=1.05, plans=[scan('Seq Scan', 'reserves', rows=1000, time=5.0, read=2),
+                                                      scan('Hash', plans=[scan('Seq Scan', 'apartments')])]), 6.2)
+    assert PlanCapture.diff(CapturedPlan('f', (), OLD), CapturedPlan('f', (), new)) == [
+        'node 1 (Seq Scan): shared_read 40 -> 2']
+
+
+def test_diff_reports_a_new_plan_shape():
+    new = explain(scan('Nested Loop', plans=[scan('Index Scan', 'reserves', 'reserves_apartment_id', rows=3)]), 0.5)
+    assert PlanCapture.diff(CapturedPlan('f', (), OLD), CapturedPlan('f', (), new)) == [
+        'execution time: 6.0 ms -> 0.5 ms',
+        'node 0: Hash Join (rows 10 of 10 planned, 1 loops, 1.0 ms, buffers hit 5 read 0) -> '
+        'Nested Loop (rows 10 of 10 planned, 1 loops, 1.0 ms, buffers hit 5 read 0)',
+        'node 1: Seq Scan on reserves (rows 1000 of 10 planned, 1 loops, 5.0 ms, buffers hit 5 read 40) -> '
+        'Index Scan on reserves_apartment_id (rows 3 of 10 planned, 1 loops, 1.0 ms, buffers hit 5 read 0)',
+        'node 2 removed: Hash (rows 10 of 10 planned, 1 loops, 1.0 ms, buffers hit 5 read 0)',
+        'node 3 removed: Seq Scan on apartments (rows 10 of 10 planned, 1 loops, 1.0 ms, buffers hit 5 read 0)']
+
+
+class PlanningConnector:
+    def __init__(self, plans):
+        self.plans = list(plans)
+
+    def explain_prepared(self, name, args=(), options=""):
+        assert options == "ANALYZE, BUFFERS"
+        if not self.plans:
+            raise Exception("no plan")
+        return [self.plans.pop(0)]
+
+
+def test_captured_plans_are_kept_per_function_and_arguments(capsys):
+    conn = PlanningConnector([OLD, OLD, OLD])
+    PlanCapture.capture(conn, 'get_apartment_rating', 'get_apartment_rating', (1,))
+    PlanCapture.capture(conn, 'get_apartment_rating', 'get_apartment_rating', (2,))
+    PlanCapture.capture(conn, 'get_owner_rating', 'get_owner_rating', (1,))
+    PlanCapture.capture(conn, 'get_owner_rating', 'get_owner_rating', (1,))  # fails, only reported
+    assert 'Could not capture the plan of get_owner_rating' in capsys.readouterr().out
+    assert len(PlanCapture.plans()) == 3
+    assert [plan.args for plan in PlanCapture.plans('get_apartment_rating')] == [(1,), (2,)]
+    assert PlanCapture.latest('get_owner_rating', (1,)).execution_time == 6.0
+    assert PlanCapture.latest('get_owner_rating', (2,)) is None
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+from Utility.RatioRecommender import recommend
+
+
+# get_apartment_recommendation()'s query, one customer at a time, the straightforward way
+def brute_force(reviews, cust_id):
+    ratings = {(customer, apartment): rating for customer, apartment, rating in reviews}
+    own = {apartment: rating for (customer, apartment), rating in ratings.items() if customer == cust_id}
+    if not own:
+        return []
+    ratios = {}
+    for customer in {customer for customer, _ in ratings}:
+        common = [own[apartment] / rating for (other, apartment), rating in ratings.items()
+                  if other == customer and apartment in own]
+        if common:
+            ratios[customer] = sum(common) / len(common)
+    approximations = {}
+    for (customer, apartment), rating in ratings.items():
+        if customer in ratios and apartment not in own:
+            approximations.setdefault(apartment, []).append(min(max(ratios[customer] * rating, 1), 10))
+    return [(apartment, sum(values) / len(values)) for apartment, values in sorted(approximations.items())]
+
+
+def random_reviews(rng: random.Random):
+    customers, apartments = rng.randint(1, 12), rng.randint(1, 12)
+    pairs = rng.sample([(c, a) for c in range(1, customers + 1) for a in range(1, apartments + 1)],
+                       rng.randint(0, customers * apartments))
+    return [(customer, apartment, rng.randint(1, 10)) for customer, apartment in pairs]
+
+
+def test_matches_the_query_semantics():
+    rng = random.Random(0)
+    for _ in range(300):
+        reviews = random_reviews(rng)
+        customers = list(range(0, 14))  # 0 and 13 never reviewed anything
+        results = recommend(reviews, customers, batch_size=rng.randint(1, 5))
+        assert sorted(results) == customers
+        for cust_id in customers:
+            expected = brute_force(reviews, cust_id)
+            assert [apartment for apartment, _ in results[cust_id]] == [apartment for apartment, _ in expected]
+            assert [value for _, value in results[cust_id]] == pytest.approx([value for _, value in expected])
+
+
+def test_no_reviews():
+    assert recommend([], [1, 2]) == {1: [], 2: []}
+    assert recommend([(1, 1, 5)], []) == {}
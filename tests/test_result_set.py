@@ -0,0 +1,59 @@
+from collections import namedtuple
+
+from Utility.DBConnector import ResultSet, ResultSetRow
+
+Column = namedtuple('Column', 'name')  # what ResultSet reads of a cursor's description
+
+
+def result_set(names, rows) -> ResultSet:
+    return ResultSet([Column(name) for name in names], rows)
+
+
+def test_empty_result():
+    result = result_set(['id'], [])
+    assert result.size() == 0 and result.isEmpty()
+    assert result.rows == [] and result.cols_header == []
+    assert list(result) == []
+    assert str(result) == "\n"
+
+
+def test_rows_and_columns():
+    result = result_set(['id', 'name'], [(1, 'Dana'), (2, 'Noa')])
+    assert result.size() == 2 and not result.isEmpty()
+    assert result.cols_header == ['id', 'name']
+    assert result.cols['ID'] == 0 and result.cols[0] is None
+    assert result['name'] == ['Dana', 'Noa']
+    assert result[1]['name'] == 'Noa'
+    assert [row['id'] for row in result] == [1, 2]
+
+
+def test_row_views():
+    result = result_set(['id', 'name'], [(1, 'Dana')])
+    row = result[0]
+    assert isinstance(row, ResultSetRow)
+    assert row['Name'] == 'Dana'  # column names are case insensitive, like the ResultSetDict they replaced
+    assert row[0] is None  # only names are looked up
+    assert row.get('missing', 'default') == 'default'
+    assert list(row.keys()) == ['id', 'name'] and row.values() == [1, 'Dana']
+    assert row.items() == [('id', 1), ('name', 'Dana')]
+    assert len(row) == 2 and 'NAME' in row and 'missing' not in row and 0 not in row
+    assert row == {'id': 1, 'name': 'Dana'} and row == result[0]
+    assert repr(row) == "{'id': 1, 'name': 'Dana'}"
+
+
+def test_rows_share_the_result_tuples():
+    rows = [(1, 'Dana')]
+    result = result_set(['id', 'name'], rows)
+    assert result.rows is rows
+    assert not hasattr(result, '__dict__') and not hasattr(result[0], '__dict__')
+
+
+def test_an_invalid_row_is_empty(capsys):
+    result = result_set(['id'], [(1,)])
+    assert len(result[5]) == 0
+    assert capsys.readouterr().out == "Invalid row 5\n"
+
+
+def test_print():
+    result = result_set(['id', 'name'], [(1, 'Dana'), (2, None)])
+    assert str(result) == "id   name   \n1   Dana   \n2   None   \n"
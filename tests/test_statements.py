@@ -0,0 +1,93 @@
+import pytest
+from psycopg2 import errors
+
+import Utility.DBConnector as Connector
+import Utility.Statements as Statements
+from fakes import FakePool
+
+
+def test_prepare_and_execute_sql():
+    statement = Statements.Statement("find", ("INTEGER", "TEXT"), "SELECT * FROM T WHERE id = $1 AND name = $2")
+    assert statement.prepare_sql == "PREPARE find (INTEGER, TEXT) AS SELECT * FROM T WHERE id = $1 AND name = $2"
+    assert statement.execute_sql == "EXECUTE find (%s, %s)"
+
+
+def test_cursor_sql_binds_named_parameters_with_their_types():
+    statement = Statements.Statement("find", ("INTEGER", "DATE"),
+                                     "SELECT * FROM T WHERE id = $1 AND name LIKE 'a%' AND day >= $2 AND id <> $1")
+    assert statement.cursor_sql == ("SELECT * FROM T WHERE id = %(p1)s::INTEGER AND name LIKE 'a%%' "
+                                    "AND day >= %(p2)s::DATE AND id <> %(p1)s::INTEGER")
+    assert statement.cursor_args((5, 'day')) == {'p1': 5, 'p2': 'day'}
+
+
+def test_statement_without_parameters():
+    statement = Statements.Statement("everything", (), "SELECT 100 % 7")
+    assert statement.prepare_sql == "PREPARE everything AS SELECT 100 % 7"
+    assert statement.execute_sql == "EXECUTE everything"
+    assert statement.cursor_sql == "SELECT 100 % 7"
+    assert statement.cursor_args(()) is None
+
+
+def test_register_folds_names_and_rejects_redefinitions():
+    Statements.register("Test_Statement", ("INTEGER",), "SELECT $1")
+    assert Statements.get("test_statement").name == "test_statement"
+    Statements.register("test_statement", ("INTEGER",), "SELECT $1")  # the same definition again is fine
+    with pytest.raises(ValueError):
+        Statements.register("test_statement", ("TEXT",), "SELECT $1")
+    with pytest.raises(KeyError):
+        Statements.get("no_such_statement")
+
+
+def test_prepared_once_per_connection():
+    Statements.register("test_prepared_once", ("INTEGER",), "SELECT $1")
+    pool = FakePool()
+    for _ in range(2):
+        conn = Connector.DBConnector(pool)
+        conn.execute_prepared("test_prepared_once", (1,))
+        conn.close()
+    prepares = [query for query in pool.connection.log if "PREPARE test_prepared_once" in query]
+    assert len(prepares) == 1
+    assert pool.connection.log.count("EXECUTE test_prepared_once (%s)") == 2
+
+
+def test_an_already_prepared_name_keeps_the_pending_work():
+    statement = Statements.register("test_duplicate_prepare", (), "SELECT 1")
+    pool = FakePool()
+    prepare = "SAVEPOINT prepare_statement; " + statement.prepare_sql + "; RELEASE SAVEPOINT prepare_statement"
+    pool.connection.failures[prepare] = errors.DuplicatePreparedStatement()
+    conn = Connector.DBConnector(pool)
+    conn.execute("INSERT 1", commit=False)
+    conn.execute_prepared("test_duplicate_prepare", commit=False)
+    conn.close()
+    assert pool.connection.log == ["INSERT 1", prepare,
+                                   "ROLLBACK TO SAVEPOINT prepare_statement; RELEASE SAVEPOINT prepare_statement",
+                                   "EXECUTE test_duplicate_prepare"]
+    assert "test_duplicate_prepare" in pool.connection.prepared
+
+
+def test_lost_prepared_statements_are_prepared_again():
+    statement = Statements.register("test_reprepare", (), "SELECT 1")
+    pool = FakePool()
+    pool.connection.prepared.add(statement.name)  # prepared by an earlier session the server has since reset
+    pool.connection.failures[statement.execute_sql] = errors.InvalidSqlStatementName()
+    conn = Connector.DBConnector(pool)
+    conn.execute_prepared("test_reprepare")
+    conn.close()
+    assert pool.connection.log == [
+        "EXECUTE test_reprepare", "ROLLBACK",
+        "SAVEPOINT prepare_statement; " + statement.prepare_sql + "; RELEASE SAVEPOINT prepare_statement",
+        "EXECUTE test_reprepare", "COMMIT"]
+
+
+def test_lost_prepared_statement_doesnt_roll_back_the_pending_work():
+    statement = Statements.register("test_reprepare_pending", (), "SELECT 1")
+    pool = FakePool()
+    pool.connection.prepared.add(statement.name)
+    pool.connection.failures[statement.execute_sql] = errors.InvalidSqlStatementName()
+    conn = Connector.DBConnector(pool)
+    conn.execute("INSERT 1", commit=False)
+    with pytest.raises(errors.InvalidSqlStatementName):
+        conn.execute_prepared("test_reprepare_pending", commit=False)
+    assert pool.connection.log == ["INSERT 1", "EXECUTE test_reprepare_pending"]
+    assert statement.name not in pool.connection.prepared  # prepared again by the next call
+    conn.close()
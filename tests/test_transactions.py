@@ -0,0 +1,96 @@
+import pytest
+from psycopg2 import errors
+
+import Utility.DBConnector as Connector
+import Utility.Statements as Statements
+from fakes import FakePool
+
+
+@pytest.fixture
+def pool():
+    return FakePool()
+
+
+def test_connector_outside_a_transaction_uses_the_pool(pool):
+    conn = Connector.DBConnector(pool)
+    conn.execute("SELECT 1", commit=False)
+    conn.commit()
+    conn.close()
+    assert pool.connection.log == ["SELECT 1", "COMMIT"]
+    assert pool.in_use == 0
+
+
+def test_calls_in_a_transaction_share_its_connection_in_savepoints(pool):
+    with Connector.Transaction(pool) as transaction:
+        assert Connector.current_transaction() is transaction
+        first = Connector.DBConnector()
+        first.execute("INSERT 1")  # commit=True only releases the savepoint
+        first.close()
+        second = Connector.DBConnector()
+        second.execute("INSERT 2", commit=False)
+        second.close()  # closing without a commit rolls back to the savepoint
+        assert pool.in_use == 1
+    assert Connector.current_transaction() is None
+    assert pool.connection.log == [
+        "SAVEPOINT sp_0", "INSERT 1", "RELEASE SAVEPOINT sp_0; SAVEPOINT sp_0",
+        "ROLLBACK TO SAVEPOINT sp_0; RELEASE SAVEPOINT sp_0",
+        "SAVEPOINT sp_1", "INSERT 2", "ROLLBACK TO SAVEPOINT sp_1; RELEASE SAVEPOINT sp_1",
+        "COMMIT"]
+    assert pool.in_use == 0
+
+
+def test_rollback_of_a_call_goes_back_to_its_savepoint(pool):
+    with Connector.Transaction(pool):
+        conn = Connector.DBConnector()
+        conn.rollback()
+        conn.close()
+    assert "ROLLBACK TO SAVEPOINT sp_0" in pool.connection.log
+    assert pool.connection.log[-1] == "COMMIT"
+
+
+def test_nested_transaction_joins_the_outer_one(pool):
+    committed = []
+    with Connector.Transaction(pool) as outer:
+        with Connector.Transaction(FakePool()) as inner:
+            assert inner is outer
+            inner.on_commit(lambda: committed.append('inner'))
+        assert committed == []  # the inner block's end commits nothing
+        outer.on_commit(lambda: committed.append('outer'))
+    assert committed == ['inner', 'outer']
+    assert pool.connection.log.count("COMMIT") == 1
+
+
+def test_on_commit_callbacks_run_after_the_commit_only(pool):
+    calls = []
+    with Connector.Transaction(pool) as transaction:
+        transaction.on_commit(lambda: calls.append(list(pool.connection.log)))
+    assert calls == [["COMMIT"]]
+
+    calls.clear()
+    with pytest.raises(RuntimeError):
+        with Connector.Transaction(pool) as transaction:
+            transaction.on_commit(lambda: calls.append('committed'))
+            raise RuntimeError
+    with Connector.Transaction(pool) as transaction:
+        transaction.on_commit(lambda: calls.append('committed'))
+        transaction.rollback()
+    assert calls == []
+    assert pool.connection.log[-2:] == ["ROLLBACK", "ROLLBACK"]
+
+
+def test_a_lost_prepared_statement_doesnt_roll_back_the_other_calls(pool):
+    statement = Statements.register("test_transaction_reprepare", (), "SELECT 1")
+    pool.connection.prepared.add(statement.name)
+    pool.connection.failures[statement.execute_sql] = errors.InvalidSqlStatementName()
+    with Connector.Transaction(pool):
+        first = Connector.DBConnector()
+        first.execute("INSERT 1")
+        first.close()
+        second = Connector.DBConnector()
+        with pytest.raises(errors.InvalidSqlStatementName):
+            second.execute_prepared("test_transaction_reprepare")
+        second.close()
+    assert pool.connection.log[-3:] == [
+        "EXECUTE test_transaction_reprepare",
+        "ROLLBACK TO SAVEPOINT sp_1; RELEASE SAVEPOINT sp_1",  # only the failed call is undone
+        "COMMIT"]